@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# Checks that contacts spawned from the ContactTemplate prototype match
+# contacts constructed from scratch and share no writeable buffers, then
+# times both ways of creating a contact. Needs no ROS master.
+
+import sys
+import argparse
+import timeit
+import numpy as np
+
+from contact_tracker.spawn import ContactTemplate
+
+
+def random_detect(rng, k, with_velocity, with_position=True):
+    """
+    Returns: detect info of a random detect, with or without velocity, and
+    with or without position.
+    """
+
+    pos_covar = [.0]*36
+    pos_covar[0] = rng.uniform(0.1, 10.0)
+    pos_covar[6] = rng.uniform(0.1, 10.0)
+    x_vel, y_vel = (rng.randn(2)*5.0) if with_velocity else (np.nan, np.nan)
+    x_pos, y_pos = (rng.randn(2)*1000.0) if with_position else (np.nan, np.nan)
+    return {'stamp': float(k),
+            'x_pos': x_pos,
+            'y_pos': y_pos,
+            'x_vel': x_vel,
+            'y_vel': y_vel,
+            'pos_covar': pos_covar}
+
+
+def array_attributes(c):
+    """
+    Returns: dictionary of every array held by a contact's filter bank and
+    filters, keyed by where it is held.
+    """
+
+    arrays = {}
+    for name, value in vars(c.filter_bank).items():
+        if isinstance(value, np.ndarray):
+            arrays['imm.' + name] = value
+    for i, kf in enumerate(c.filter_bank.filters):
+        for name, value in vars(kf).items():
+            if isinstance(value, np.ndarray):
+                arrays['filters[%d].%s' % (i, name)] = value
+    return arrays
+
+
+def shares_writeable(a, b):
+    """
+    Returns: True if the two arrays share memory that may be written to.
+    """
+
+    return a.flags.writeable and b.flags.writeable and np.may_share_memory(a, b)
+
+
+def check(args):
+    """
+    Compare spawned contacts with constructed ones.
+
+    Returns: True if they hold the same values and no shared writeable buffers
+    """
+
+    rng = np.random.RandomState(args.seed)
+    template = ContactTemplate()
+    ok = True
+    # The prototype is built from a detect with position, so a contact
+    # spawned from one without must not keep the prototype's state.
+    for kind, with_velocity, with_position in [('position', False, True),
+                                               ('position and velocity', True, True),
+                                               ('velocity alone', True, False)]:
+        mismatches = 0
+        shared = 0
+        previous = template.spawn(random_detect(rng, -1, with_velocity, with_position), -1)
+        for k in range(args.cases):
+            detect_info = random_detect(rng, k, with_velocity, with_position)
+            spawned = template.spawn(detect_info, k)
+            constructed = template.construct(detect_info, k)
+
+            built = array_attributes(constructed)
+            for name, value in array_attributes(spawned).items():
+                if not np.array_equal(value, built[name]):
+                    mismatches += 1
+
+            # A spawned contact must not write into the prototype's buffers
+            # or those of the contacts spawned before it.
+            others = (list(array_attributes(template.prototype).values()) +
+                      list(array_attributes(previous).values()))
+            for value in array_attributes(spawned).values():
+                if any(shares_writeable(value, other) for other in others):
+                    shared += 1
+            previous = spawned
+
+        passed = mismatches == 0 and shared == 0
+        ok = ok and passed
+        print('%s: %d mismatched and %d shared arrays over %d contacts, %s' %
+              (kind, mismatches, shared, args.cases, 'ok' if passed else 'FAILED'))
+    return ok
+
+
+def bench(args):
+    """
+    Time constructing and spawning contacts.
+    """
+
+    rng = np.random.RandomState(args.seed)
+    template = ContactTemplate()
+    detects = [random_detect(rng, k, k % 2 == 0) for k in range(args.n)]
+    template.spawn(detects[0], 0)
+
+    def create(func):
+        for k, detect_info in enumerate(detects):
+            func(detect_info, k)
+
+    times = []
+    for func in [template.construct, template.spawn]:
+        seconds = min(timeit.repeat(lambda: create(func), number=1, repeat=3))
+        times.append(1e6*seconds/args.n)
+
+    print('construct: %6.1f us per contact' % times[0])
+    print('spawn:     %6.1f us per contact' % times[1])
+
+
+def main():
+
+    arg_parser = argparse.ArgumentParser(description='Check contacts spawned from the template against constructed ones and time both.')
+    arg_parser.add_argument('-n', type=int, help='number of contacts created per timing run, default: 5000', default=5000)
+    arg_parser.add_argument('-cases', type=int, help='number of random detects checked with and without velocity, default: 200', default=200)
+    arg_parser.add_argument('-seed', type=int, help='seed of the random detects, default: 0', default=0)
+    args = arg_parser.parse_args()
+
+    if not check(args):
+        sys.exit(1)
+    bench(args)
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+# Checks that a detect log reads back the detects written to it, through
+# chunks that are views into its memory maps, then times reading detects
+# from a log against reading them from a flat export. Needs no ROS master.
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+from contact_tracker.detect_log import DetectLog
+from contact_tracker.detect_log import write_log
+from contact_tracker.replay import covariances
+from contact_tracker.replay import read_csv
+from contact_tracker.replay import write_csv
+from contact_tracker.stage_timers import clock
+
+
+def random_detects(rng, n):
+    """
+    Returns: list of n random detects, half with velocity, from three
+    sensors that each report one of a few covariances.
+    """
+
+    detects = []
+    for k in range(n):
+        x_vel, y_vel = (rng.randn(2)*5.0) if k % 2 == 0 else (np.nan, np.nan)
+        pos_covar, twist_covar = covariances(*rng.choice([0.5, 1.0, 2.0], 5))
+        detects.append({'stamp': 1000.0 + 0.01*k,
+                        'sensor_id': ['radar', 'ais', 'camera'][k % 3],
+                        'x_pos': float(rng.randn()*1000.0),
+                        'y_pos': float(rng.randn()*1000.0),
+                        'x_vel': float(x_vel),
+                        'y_vel': float(y_vel),
+                        'pos_covar': pos_covar,
+                        'twist_covar': twist_covar})
+    return detects
+
+
+def same_detect(a, b):
+    """
+    Returns: True if two detects hold the same fields that the log keeps.
+    """
+
+    values = lambda d: [d['stamp'], d['x_pos'], d['y_pos'], d['x_vel'], d['y_vel'],
+                        d['pos_covar'][0], d['pos_covar'][6], d['pos_covar'][7],
+                        d['twist_covar'][0], d['twist_covar'][7]]
+    return (a['sensor_id'] == b['sensor_id'] and
+            np.allclose(values(a), values(b), rtol=0, atol=0, equal_nan=True))
+
+
+def check(args, path):
+    """
+    Write random detects to a log and read them back, a chunk at a time.
+
+    Returns: True if every detect read back matches and every chunk is a
+    view into the log's memory maps
+    """
+
+    rng = np.random.RandomState(args.seed)
+    detects = random_detects(rng, args.cases)
+    write_log(detects, path, args.chunk_size)
+
+    log = DetectLog(path)
+    read = list(log.detects(args.chunk_size))
+    mismatches = abs(len(read) - len(detects))
+    mismatches += sum(not same_detect(a, b) for a, b in zip(detects, read))
+
+    copies = 0
+    for chunk in log.chunks(args.chunk_size):
+        copies += sum(not isinstance(column, np.memmap) for column in chunk.values())
+
+    passed = mismatches == 0 and copies == 0
+    print('%d detects written, %d read back, %d mismatched, %d chunk columns copied, %s' %
+          (len(detects), len(read), mismatches, copies, 'ok' if passed else 'FAILED'))
+    return passed
+
+
+def bench(args, path):
+    """
+    Time reading detects from a flat export and from a log, and reading the
+    positions of a log through its chunks alone.
+    """
+
+    rng = np.random.RandomState(args.seed)
+    csv_path = os.path.join(path, 'detects.csv')
+    log_path = os.path.join(path, 'log')
+    write_csv(random_detects(rng, args.n), csv_path)
+    write_log(read_csv(csv_path), log_path)
+
+    for name, read in [('flat export', lambda: read_csv(csv_path)),
+                       ('detect log', lambda: DetectLog(log_path).detects())]:
+        t = clock()
+        n = sum(1 for _ in read())
+        seconds = clock() - t
+        print('%s: %0.0f detects/s' % (name, n/seconds))
+
+    t = clock()
+    total = 0.0
+    for chunk in DetectLog(log_path).chunks():
+        total += np.sum(np.hypot(chunk['x_pos'], chunk['y_pos']))
+    seconds = clock() - t
+    print('detect log chunks: %0.0f detects/s' % (args.n/seconds))
+
+
+def main():
+
+    arg_parser = argparse.ArgumentParser(description='Check a detect log reads back what was written to it and time reading it.')
+    arg_parser.add_argument('-n', type=int, help='number of detects read per timing run, default: 200000', default=200000)
+    arg_parser.add_argument('-chunk_size', type=int, help='number of detects per chunk when checking, default: 1000', default=1000)
+    arg_parser.add_argument('-cases', type=int, help='number of random detects checked, default: 2500', default=2500)
+    arg_parser.add_argument('-seed', type=int, help='seed of the random detects, default: 0', default=0)
+    args = arg_parser.parse_args()
+
+    path = tempfile.mkdtemp()
+    try:
+        if not check(args, os.path.join(path, 'check')):
+            sys.exit(1)
+        bench(args, path)
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__=='__main__':
+    main()
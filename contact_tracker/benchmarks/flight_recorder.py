@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+# Checks that the flight recorder reads back the association decisions
+# recorded into it, oldest first, once its ring buffer has wrapped around,
+# then times recording a decision and keeping the evaluations of the contacts
+# it records. Needs no ROS master.
+
+import os
+import sys
+import argparse
+import tempfile
+import timeit
+import numpy as np
+
+from contact_tracker.flight_recorder import Evaluations
+from contact_tracker.flight_recorder import FlightRecorder
+from contact_tracker.flight_recorder import MAX_CANDIDATES
+
+
+def random_decision(rng, k):
+    """
+    Returns: detect info, contacts evaluated, as (id, log Bayes factor,
+    rejected) in the order they were evaluated, and chosen contact of a
+    random decision.
+    """
+
+    pos_covar = [.0]*36
+    pos_covar[0] = rng.uniform(0.1, 10.0)
+    pos_covar[7] = rng.uniform(0.1, 10.0)
+    x_vel, y_vel = (rng.randn(2)*5.0) if k % 2 == 0 else (np.nan, np.nan)
+    detect_info = {'stamp': float(k),
+                   'sensor_id': 'radar' if k % 3 else 'ais',
+                   'x_pos': rng.randn()*1000.0,
+                   'y_pos': rng.randn()*1000.0,
+                   'x_vel': x_vel,
+                   'y_vel': y_vel,
+                   'pos_covar': pos_covar}
+    candidates = [(int(i), rng.uniform(2.0, 20.0), False)
+                  for i in rng.randint(0, 1 << 40, rng.randint(0, MAX_CANDIDATES + 3))]
+    rejected = [(int(i), rng.uniform(-20.0, 10.0) if rng.rand() < 0.9 else np.nan, True)
+                for i in rng.randint(0, 1 << 40, rng.randint(0, 2*MAX_CANDIDATES + 3))]
+    evaluated = [(candidates + rejected)[i] for i in rng.permutation(len(candidates) + len(rejected))]
+    chosen = candidates[0][0] if candidates else None
+    return detect_info, evaluated, chosen
+
+
+def evaluate(evaluated):
+    """
+    Returns: Evaluations of contacts evaluated, as random_decision returns them.
+    """
+
+    evaluations = Evaluations()
+    for contact_id, logBF, rejected in evaluated:
+        evaluations.add(contact_id, logBF, rejected)
+    return evaluations
+
+
+def check(args):
+    """
+    Record more random decisions than the recorder holds, dump them and
+    compare the dump with the most recent decisions.
+
+    Returns: True if every field read back matches
+    """
+
+    rng = np.random.RandomState(args.seed)
+    recorder = FlightRecorder(args.size)
+    decisions = [random_decision(rng, k) for k in range(args.cases)]
+    for detect_info, evaluated, chosen in decisions:
+        recorder.record(detect_info, evaluate(evaluated), chosen)
+
+    fd, path = tempfile.mkstemp(suffix='.npy')
+    os.close(fd)
+    try:
+        recorder.dump(path)
+        records = np.load(path)
+    finally:
+        os.remove(path)
+
+    expected = decisions[-args.size:]
+    mismatches = 0 if len(records) == len(expected) else 1
+    for r, (detect_info, evaluated, chosen) in zip(records, expected):
+        # The contacts with the greatest log Bayes factors, whether they
+        # were candidates or rejected, and those that are NaN last.
+        kept = sorted(evaluated, key=lambda e: e[1] if e[1] == e[1] else -np.inf,
+                      reverse=True)[:MAX_CANDIDATES]
+        padding = MAX_CANDIDATES - len(kept)
+        ids = [contact_id for contact_id, logBF, rejected in kept] + [-1]*padding
+        bfs = [logBF for contact_id, logBF, rejected in kept] + [np.nan]*padding
+        flags = [rejected for contact_id, logBF, rejected in kept] + [False]*padding
+        candidates = sum(1 for contact_id, logBF, rejected in evaluated if not rejected)
+        detect = [detect_info['stamp'], detect_info['x_pos'],
+                  detect_info['y_pos'], detect_info['x_vel'], detect_info['y_vel'],
+                  detect_info['pos_covar'][0], detect_info['pos_covar'][7]]
+        read = [r['stamp'], r['x_pos'], r['y_pos'], r['x_vel'], r['y_vel'],
+                r['x_var'], r['y_var']]
+        if (not np.allclose(read, detect, rtol=0, atol=0, equal_nan=True) or
+                r['sensor_id'].decode('utf-8') != detect_info['sensor_id'] or
+                r['candidates'] != candidates or
+                r['evaluated'] != len(evaluated) or
+                r['chosen'] != (-1 if chosen is None else chosen) or
+                list(r['candidate_ids']) != ids or
+                list(r['rejected']) != flags or
+                not np.allclose(r['log_bf'], bfs, rtol=0, atol=0, equal_nan=True)):
+            mismatches += 1
+
+    passed = mismatches == 0
+    print('%d decisions recorded, %d read back, %d mismatched, %s' %
+          (args.cases, len(records), mismatches, 'ok' if passed else 'FAILED'))
+    return passed
+
+
+def bench(args):
+    """
+    Time recording decisions with no contacts evaluated, one candidate, the
+    most kept, and many evaluated, and time keeping the evaluations of the
+    contacts, which is done as they are evaluated.
+    """
+
+    rng = np.random.RandomState(args.seed)
+    recorder = FlightRecorder(args.size)
+    detect_info = random_decision(rng, 0)[0]
+    for n, m in [(0, 0), (1, 0), (MAX_CANDIDATES, 0), (MAX_CANDIDATES, 100)]:
+        evaluations = evaluate([(i, float(i), False) for i in range(n)] +
+                               [(n + i, rng.uniform(-20.0, 10.0), True) for i in range(m)])
+        seconds = min(timeit.repeat(lambda: recorder.record(detect_info, evaluations, 0),
+                                    number=args.n, repeat=3))
+        print('%d candidates, %d rejected: %5.2f us per decision' % (n, m, 1e6*seconds/args.n))
+
+    evaluated = [(i, rng.uniform(-20.0, 20.0), False) for i in range(100)]
+    seconds = min(timeit.repeat(lambda: evaluate(evaluated), number=args.n//100, repeat=3))
+    print('keeping the evaluations of 100 contacts: %5.2f us per contact' % (1e6*seconds/args.n))
+
+
+def main():
+
+    arg_parser = argparse.ArgumentParser(description='Check the flight recorder reads back what was recorded and time recording.')
+    arg_parser.add_argument('-n', type=int, help='number of decisions recorded per timing run, default: 200000', default=200000)
+    arg_parser.add_argument('-size', type=int, help='number of decisions the recorder holds, default: 1000', default=1000)
+    arg_parser.add_argument('-cases', type=int, help='number of random decisions checked, default: 2500', default=2500)
+    arg_parser.add_argument('-seed', type=int, help='seed of the random decisions, default: 0', default=0)
+    args = arg_parser.parse_args()
+
+    if not check(args):
+        sys.exit(1)
+    bench(args)
+
+
+if __name__=='__main__':
+    main()
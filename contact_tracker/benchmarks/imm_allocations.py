@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+# Compares the memory allocated and the time taken per predict and update
+# by filterpy's IMMEstimator and by ContactIMMEstimator, driving both with
+# the same contact filters and measurements. Needs no ROS master.
+
+import argparse
+import timeit
+import numpy as np
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from filterpy.kalman import IMMEstimator
+
+import contact_tracker.contact_kf
+from contact_tracker.imm import ContactIMMEstimator
+from contact_tracker.model_cache import PROCESS_MODELS
+from contact_tracker.model_cache import H_POSITION
+from contact_tracker.model_cache import H_POSITION_VELOCITY
+
+
+M = np.array([[0.5, 0.5],
+              [0.5, 0.5]])
+MU = np.array([0.5, 0.5])
+R_POSITION = np.diag([1.0, 1.0])
+R_POSITION_VELOCITY = np.diag([1.0, 1.0, 0.25, 0.25])
+
+
+def make_filters():
+    """
+    Returns: the two filters of a contact, set up as Contact.init_filters does.
+    """
+
+    filters = []
+    for filter_type in ['first', 'second']:
+        kf = contact_tracker.contact_kf.ContactKalmanFilter(dim_x=6, dim_z=4, filter_type=filter_type)
+        kf.x = np.array([10.0, 20.0, 1.0, -1.0, .0, .0])
+        kf.P = np.diag([100.0, 100.0, 5.0**2, 5.0**2, 1.0, 1.0])
+        filters.append(kf)
+    return filters
+
+
+def set_models(imm, dt, dim_z):
+    """
+    Give the filters of an IMM the F, Q, H and R of the next detect.
+    """
+
+    for kf in imm.filters:
+        if kf.filter_type == 'first':
+            kf.F, kf.Q = PROCESS_MODELS.get('first', dt, 0.5)
+        else:
+            kf.F, kf.Q = PROCESS_MODELS.get('second', dt, 0.1)
+        if dim_z == 2:
+            kf.H, kf.R = H_POSITION, R_POSITION
+        else:
+            kf.H, kf.R = H_POSITION_VELOCITY, R_POSITION_VELOCITY
+
+
+def measurement(k, dim_z):
+    """
+    Returns: measurement k of a contact moving at constant velocity.
+    """
+
+    z = [10.0 + k, 20.0 - k, 1.0, -1.0]
+    return z[:dim_z]
+
+
+def peak_bytes(func):
+    """
+    Returns: peak memory allocated while running func, in bytes.
+    """
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def run(name, cls, args):
+    """
+    Print the allocations and time per predict and update of one estimator.
+    """
+
+    imm = cls(make_filters(), MU, M)
+    state = {'k': 0}
+
+    def next_detect():
+        state['k'] += 1
+        set_models(imm, 1.0, args.dim_z)
+
+    def update():
+        imm.update(measurement(state['k'], args.dim_z))
+
+    def cycle():
+        next_detect()
+        imm.predict()
+        update()
+
+    # Warm up the process model cache and any lazily built state.
+    for _ in range(10):
+        cycle()
+
+    print('%s, %d-D measurements:' % (name, args.dim_z))
+    if tracemalloc is not None:
+        predicts = []
+        updates = []
+        for _ in range(args.n):
+            next_detect()
+            predicts.append(peak_bytes(imm.predict))
+            updates.append(peak_bytes(update))
+        print('  predict: %7.0f bytes allocated at peak' % np.median(predicts))
+        print('  update:  %7.0f bytes allocated at peak' % np.median(updates))
+    else:
+        print('  tracemalloc is not available, allocations not measured')
+
+    seconds = min(timeit.repeat(cycle, number=args.n, repeat=3))
+    print('  predict + update: %0.1f us' % (1e6*seconds/args.n))
+
+
+def main():
+
+    arg_parser = argparse.ArgumentParser(description='Compare the allocations and time per predict and update of the filterpy and the preallocated IMM estimators.')
+    arg_parser.add_argument('-n', type=int, help='number of predicts and updates measured, default: 2000', default=2000)
+    arg_parser.add_argument('-dim_z', type=int, choices=[2, 4], help='dimension of the measurements, default: 4', default=4)
+    args = arg_parser.parse_args()
+
+    run('filterpy IMMEstimator', IMMEstimator, args)
+    run('ContactIMMEstimator', ContactIMMEstimator, args)
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# Checks the closed-form 2-D and 4-D innovation kernels and the generic
+# kernel against the np.linalg.inv formulas on random filter states, then
+# times them against inverting S once and against inverting it for every
+# use, as the tracker did before innovations were shared. Needs no ROS master.
+
+import sys
+import argparse
+import timeit
+import numpy as np
+
+from contact_tracker.innovation import Innovation
+from contact_tracker.innovation import make_innovation
+from contact_tracker.model_cache import H_POSITION
+from contact_tracker.model_cache import H_POSITION_VELOCITY
+
+
+def random_case(rng, dim_z):
+    """
+    Returns: H, x, P, R and z of a random filter state and measurement.
+    """
+
+    A = rng.randn(6, 6)
+    P = np.dot(A, A.T) + np.diag(rng.uniform(0.1, 100.0, 6))
+    x = rng.randn(6)*100.0
+    if dim_z == 2:
+        H = H_POSITION
+        R = np.diag(rng.uniform(0.1, 10.0, 2))
+    else:
+        H = H_POSITION_VELOCITY
+        R = np.diag(rng.uniform(0.1, 10.0, 4))
+    z = list(np.dot(H, x) + rng.randn(dim_z)*10.0)
+    return H, x, P, R, z
+
+
+def inverse_path(H, x, P, R, z, V=None):
+    """
+    Returns: S, the squared Mahalanobis distance, log det S and the gain,
+    and the quadratic forms of the columns of V if given, computed with
+    np.linalg.inv.
+    """
+
+    y = np.asarray(z) - np.dot(H, x)
+    S = np.dot(np.dot(H, P), H.T) + R
+    S_inv = np.linalg.inv(S)
+    K = np.dot(np.dot(P, H.T), S_inv)
+    d2 = None
+    if V is not None:
+        d2 = np.einsum('ij,ik,kj->j', V, S_inv, V)
+    return S, np.dot(np.dot(y, S_inv), y), np.log(np.linalg.det(S)), K, d2
+
+
+def inverse_per_use(H, x, P, R, z, V):
+    """
+    Compute what the tracker uses of an innovation the way it did before
+    innovations were shared: the likelihood, the Bayes factor's quadratic
+    forms and the gain each build and invert S themselves.
+    """
+
+    for use in range(3):
+        y = np.asarray(z) - np.dot(H, x)
+        S = np.dot(np.dot(H, P), H.T) + R
+        S_inv = np.linalg.inv(S)
+        if use == 0:
+            -0.5*(np.dot(np.dot(y, S_inv), y) + np.log(np.linalg.det(S)))
+        elif use == 1:
+            np.einsum('ij,ik,kj->j', V, S_inv, V)
+        else:
+            np.dot(np.dot(P, H.T), S_inv)
+
+
+def check(args):
+    """
+    Compare every kernel with the np.linalg.inv path.
+
+    Returns: True if they all agree to within the tolerance
+    """
+
+    rng = np.random.RandomState(args.seed)
+    ok = True
+    for dim_z in [2, 4]:
+        worst = 0.0
+        for _ in range(args.cases):
+            case = random_case(rng, dim_z)
+            V = np.column_stack((rng.randn(dim_z), rng.randn(dim_z)))*10.0
+            S, m2, log_det, K, d2_ref = inverse_path(*case, V=V)
+            for inn in [make_innovation(*case), Innovation(*case)]:
+                d2 = inn.quadratic_forms(V)
+                errors = [np.max(np.abs(inn.S - S) / np.abs(S).max()),
+                          abs(inn.mahalanobis_sq() - m2) / max(m2, 1.0),
+                          abs(inn.log_det_S() - log_det) / max(abs(log_det), 1.0),
+                          np.max(np.abs(inn.gain() - K)) / np.abs(K).max(),
+                          np.max(np.abs(d2 - d2_ref) / np.maximum(d2_ref, 1.0))]
+                worst = max(worst, max(errors))
+
+        passed = worst <= args.rtol
+        ok = ok and passed
+        print('%d-D kernel: worst relative error %0.2e over %d cases, %s' %
+              (dim_z, worst, args.cases, 'ok' if passed else 'FAILED'))
+    return ok
+
+
+def bench(args):
+    """
+    Time building an innovation and computing everything the tracker uses.
+    """
+
+    rng = np.random.RandomState(args.seed)
+    for dim_z in [2, 4]:
+        case = random_case(rng, dim_z)
+        V = np.column_stack((np.ones(dim_z), np.arange(dim_z, dtype=float)))
+
+        def use(inn):
+            inn.quadratic_forms(V)
+            inn.log_likelihood()
+            inn.gain()
+
+        runs = [('closed form', lambda: use(make_innovation(*case))),
+                ('generic', lambda: use(Innovation(*case))),
+                ('inv once', lambda: inverse_path(*case, V=V)),
+                ('inv per use', lambda: inverse_per_use(*case, V=V))]
+
+        print('%d-D measurements:' % dim_z)
+        for name, func in runs:
+            seconds = min(timeit.repeat(func, number=args.n, repeat=3))
+            print('  %-14s %6.1f us' % (name, 1e6*seconds/args.n))
+
+
+def main():
+
+    arg_parser = argparse.ArgumentParser(description='Check the closed-form innovation kernels against np.linalg.inv and time them.')
+    arg_parser.add_argument('-n', type=int, help='number of innovations timed per kernel, default: 20000', default=20000)
+    arg_parser.add_argument('-cases', type=int, help='number of random states checked per kernel, default: 1000', default=1000)
+    arg_parser.add_argument('-rtol', type=float, help='largest relative error accepted, default: 1e-8', default=1e-8)
+    arg_parser.add_argument('-seed', type=int, help='seed of the random states, default: 0', default=0)
+    args = arg_parser.parse_args()
+
+    if not check(args):
+        sys.exit(1)
+    bench(args)
+
+
+if __name__=='__main__':
+    main()
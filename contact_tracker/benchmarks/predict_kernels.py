@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+# Checks the structure-exploiting and the dense batch predicts against
+# FPF' + Q formed in full on random filter states, then times both for
+# banks of increasing size. Needs no ROS master.
+
+import sys
+import argparse
+import timeit
+import numpy as np
+
+from contact_tracker.model_cache import DENSE_PREDICT_MAX
+from contact_tracker.model_cache import predict_dense
+from contact_tracker.model_cache import predict_kinematic
+from contact_tracker.model_cache import process_noise_matrices
+from contact_tracker.model_cache import transition_matrices
+
+
+def random_bank(rng, n):
+    """
+    Returns: dt, spectral densities, x and P of n random contacts.
+    """
+
+    dt = rng.uniform(0.0, 10.0, n)
+    spectral_density = np.column_stack((np.full(n, 0.5), np.full(n, 0.1)))
+    x = rng.randn(n, 2, 6)*100.0
+    A = rng.randn(n, 2, 6, 6)
+    P = np.matmul(A, A.swapaxes(-1, -2)) + np.eye(6)
+    return dt, spectral_density, x, P
+
+
+def predict_reference(dt, spectral_density, x, P):
+    """
+    Returns: x' = Fx and P' = FPF' + Q with F and Q built as dense matrices.
+    """
+
+    F = transition_matrices(dt)
+    Q = process_noise_matrices(dt, spectral_density)
+    x_prior = np.einsum('nmij,nmj->nmi', F, x)
+    P_prior = np.matmul(np.matmul(F, P), F.swapaxes(-1, -2)) + Q
+    return x_prior, P_prior
+
+
+def check(args):
+    """
+    Compare the structured and the dense predict with the reference.
+
+    Returns: True if both agree with it to within the tolerance
+    """
+
+    rng = np.random.RandomState(args.seed)
+    bank = random_bank(rng, args.cases)
+    x_ref, P_ref = predict_reference(*bank)
+    scale = np.abs(P_ref).max(axis=(-1, -2), keepdims=True)
+
+    ok = True
+    for name, func in [('structured', predict_kinematic), ('dense', predict_dense)]:
+        x, P = func(*bank)
+        worst = max(np.max(np.abs(x - x_ref) / np.maximum(np.abs(x_ref), 1.0)),
+                    np.max(np.abs(P - P_ref) / scale))
+        passed = worst <= args.rtol
+        ok = ok and passed
+        print('%s predict: worst relative error %0.2e over %d contacts, %s' %
+              (name, worst, args.cases, 'ok' if passed else 'FAILED'))
+    return ok
+
+
+def bench(args):
+    """
+    Time the structured and the dense predict of banks of several sizes.
+    The bank uses the dense one below DENSE_PREDICT_MAX contacts.
+    """
+
+    rng = np.random.RandomState(args.seed)
+    print('The bank predicts with the dense predict below %d contacts.' % DENSE_PREDICT_MAX)
+    print('contacts   structured        dense')
+    for n in args.sizes:
+        bank = random_bank(rng, n)
+        number = max(1, args.n // n)
+        times = []
+        for func in [predict_kinematic, predict_dense]:
+            seconds = min(timeit.repeat(lambda: func(*bank), number=number, repeat=5))
+            times.append(1e6*seconds/number)
+        print('%8d %9.1f us %9.1f us' % (n, times[0], times[1]))
+
+
+def main():
+
+    arg_parser = argparse.ArgumentParser(description='Check the structured and the dense batch predicts against FPF\' + Q and time them.')
+    arg_parser.add_argument('-n', type=int, help='number of contacts predicted per timing run, default: 100000', default=100000)
+    arg_parser.add_argument('-sizes', type=int, nargs='+', help='numbers of contacts in the banks timed, default: 10 100 1000 5000', default=[10, 100, 1000, 5000])
+    arg_parser.add_argument('-cases', type=int, help='number of random contacts checked, default: 1000', default=1000)
+    arg_parser.add_argument('-rtol', type=float, help='largest relative error accepted, default: 1e-10', default=1e-10)
+    arg_parser.add_argument('-seed', type=int, help='seed of the random states, default: 0', default=0)
+    args = arg_parser.parse_args()
+
+    if not check(args):
+        sys.exit(1)
+    bench(args)
+
+
+if __name__=='__main__':
+    main()
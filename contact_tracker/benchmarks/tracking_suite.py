@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+
+# Runs what the tracker node does for each detect, from the Detect message
+# to the updated contacts, on synthetic scenarios of 10 to 5000 contacts
+# with clutter, and saves the throughput, latency percentiles and peak
+# memory of each as JSON. Stand-ins replace the ROS message and Time types,
+# so it needs no ROS install.
+
+import os
+import ast
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import multiprocessing
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from contact_tracker.engine import TrackingEngine
+from contact_tracker.engine import check_detect
+from contact_tracker.engine import detect_from_msg
+from contact_tracker.stage_timers import clock
+
+CFG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cfg', 'contact_tracker.cfg')
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Time:
+    """
+    Stand-in for rospy.Time.
+    """
+
+    def __init__(self, secs=0, nsecs=0):
+        self.secs = secs
+        self.nsecs = nsecs
+
+
+    @staticmethod
+    def from_sec(t):
+        secs = int(t)
+        return Time(secs, int(round((t - secs)*1e9)))
+
+
+    def to_sec(self):
+        return self.secs + 1e-9*self.nsecs
+
+
+class Field:
+    """
+    Stand-in for a message, or a field of one, holding the attributes given.
+    """
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def make_detect(t, sensor_id, x, y, x_vel, y_vel, pos_var, vel_var):
+    """
+    Returns: stand-in for a marine_msgs/Detect with the fields the tracker
+    reads, and row-major 6x6 covariances with the given variances.
+    """
+
+    pos_covar = [.0]*36
+    pos_covar[0] = pos_covar[7] = pos_var
+    twist_covar = [.0]*36
+    twist_covar[0] = twist_covar[7] = vel_var
+    return Field(header=Field(stamp=Time.from_sec(t), frame_id='map'),
+                 sensor_id=sensor_id,
+                 pose=Field(pose=Field(position=Field(x=x, y=y, z=.0)), covariance=pos_covar),
+                 twist=Field(twist=Field(linear=Field(x=x_vel, y=y_vel, z=.0)), covariance=twist_covar))
+
+
+def default_config():
+    """
+    Returns: dictionary of the defaults of the parameters declared in
+    cfg/contact_tracker.cfg, read from the file without dynamic_reconfigure.
+    """
+
+    with open(CFG_FILE) as f:
+        tree = ast.parse(f.read())
+
+    config = {}
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and
+                node.func.attr == 'add' and len(node.args) >= 5):
+            config[ast.literal_eval(node.args[0])] = ast.literal_eval(node.args[4])
+    return config
+
+
+def scenario_sweeps(contacts, clutter, sweeps, seed, spacing=500.0, p_detect=0.9):
+    """
+    Generate the detects of a scenario, a sweep of the sensors at a time.
+    Contacts move at constant velocity over a square sized to keep their
+    density the same whatever their number. In each one second sweep every
+    contact is detected with probability p_detect, by AIS with its velocity
+    for even contacts and by radar without for odd ones, and clutter*contacts
+    radar detects fall uniformly over the square.
+
+    Keyword arguments:
+    contacts -- number of contacts
+    clutter -- number of clutter detects per sweep, as a fraction of contacts
+    sweeps -- number of sweeps
+    seed -- seed of the scenario
+
+    Returns: generator of a list of the Detect stand-ins of each sweep, in stamp order
+    """
+
+    rng = np.random.RandomState(seed)
+    side = spacing*np.sqrt(contacts)
+    start = rng.uniform(-side/2, side/2, (contacts, 2))
+    velocity = rng.uniform(-5.0, 5.0, (contacts, 2))
+    n_clutter = int(round(clutter*contacts))
+
+    for k in range(sweeps):
+        t0 = 1000.0 + k
+        detects = []
+        for i in np.flatnonzero(rng.rand(contacts) < p_detect):
+            t = t0 + (i + 0.5)/contacts
+            x, y = start[i] + velocity[i]*(t - 1000.0) + 2.0*rng.randn(2)
+            if i % 2 == 0:
+                x_vel, y_vel = velocity[i] + 0.3*rng.randn(2)
+                detects.append((t, make_detect(t, 'ais', x, y, x_vel, y_vel, 4.0, 0.09)))
+            else:
+                detects.append((t, make_detect(t, 'radar', x, y, np.nan, np.nan, 4.0, 0.09)))
+
+        for t, (x, y) in zip(t0 + rng.rand(n_clutter), rng.uniform(-side/2, side/2, (n_clutter, 2))):
+            detects.append((t, make_detect(t, 'radar', x, y, np.nan, np.nan, 4.0, 0.09)))
+
+        detects.sort(key=lambda d: d[0])
+        yield [d[1] for d in detects]
+
+
+def peak_rss_mb():
+    """
+    Returns: the peak resident memory of this process so far, in MB, or
+    None where it cannot be read.
+    """
+
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss/2.0**20 if sys.platform == 'darwin' else rss/2.0**10
+
+
+def run_scenario(contacts, clutter, args, config):
+    """
+    Run a scenario through a fresh engine, sized as the tracker node sizes
+    it, as the node would: each Detect is converted, checked and processed on its own, and stale
+    deletion, merging and scan timeouts run at their configured rates on
+    the detects' clock, timed apart from the detects as the node runs them
+    on timers.
+
+    Returns: dictionary of the results of the scenario
+    """
+
+    engine = TrackingEngine(args.history_depth, args.flight_recorder_size)
+    engine.configure(config)
+    periods = {'stale': 1.0/config['stale_check_rate']}
+    if config['merge_rate'] > 0:
+        periods['merge'] = 1.0/config['merge_rate']
+    if config['scan_window'] > 0:
+        periods['scan'] = 0.1
+    due = dict((task, 1000.0 + period) for task, period in periods.items())
+    task_seconds = dict((task, 0.0) for task in periods)
+
+    rss_before = peak_rss_mb()
+    latencies = []
+    updates = 0
+    for sweep in scenario_sweeps(contacts, clutter, args.sweeps, args.seed):
+        for msg in sweep:
+            now = msg.header.stamp.to_sec()
+            for task in sorted(due):
+                if now >= due[task]:
+                    t = clock()
+                    if task == 'stale':
+                        engine.delete_stale_contacts(due[task])
+                    elif task == 'merge':
+                        engine.merge_contacts(due[task])
+                    else:
+                        updates += len(engine.close_scan(due[task]))
+                    task_seconds[task] += clock() - t
+                    due[task] += periods[task]
+
+            t = clock()
+            detect_info = detect_from_msg(msg)
+            if check_detect(detect_info) is None:
+                updates += len(engine.process([detect_info]))
+            latencies.append(clock() - t)
+
+    latencies = np.array(latencies)
+    seconds = latencies.sum() + sum(task_seconds.values())
+    result = {'contacts': contacts,
+              'clutter': clutter,
+              'detects': len(latencies),
+              'updates': updates,
+              'contacts_tracked': len(engine.all_contacts),
+              'seconds': seconds,
+              'detects_per_sec': len(latencies)/seconds,
+              'latency_ms': dict(('p%g' % p, 1e3*v) for p, v in
+                                 zip(PERCENTILES, np.percentile(latencies, PERCENTILES))),
+              'task_seconds': task_seconds,
+              'peak_rss_mb': peak_rss_mb(),
+              'rss_before_mb': rss_before}
+    result['latency_ms']['max'] = 1e3*latencies.max()
+    return result
+
+
+def revision():
+    """
+    Returns: the git commit the package is at, or None outside a checkout.
+    """
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                           cwd=os.path.dirname(CFG_FILE),
+                                           stderr=devnull).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_child(queue, contacts, clutter, args, config):
+    queue.put(run_scenario(contacts, clutter, args, config))
+
+
+def run_isolated(contacts, clutter, args, config):
+    """
+    Run a scenario in a child process of its own, so that its peak memory
+    is not that of the scenarios run before it.
+
+    Returns: dictionary of the results of the scenario
+    """
+
+    queue = multiprocessing.Queue()
+    child = multiprocessing.Process(target=run_child, args=(queue, contacts, clutter, args, config))
+    child.start()
+    result = queue.get()
+    child.join()
+    return result
+
+
+def compare(results, path):
+    """
+    Print the change in throughput and in 99th percentile latency of each
+    scenario from the results saved in a previous run.
+
+    Keyword arguments:
+    results -- list of the results of this run
+    path -- JSON file saved by the previous run
+    """
+
+    with open(path) as f:
+        previous = dict(((r['contacts'], r['clutter']), r) for r in json.load(f)['results'])
+
+    print('Compared with %s:' % path)
+    for r in results:
+        old = previous.get((r['contacts'], r['clutter']))
+        if old is None:
+            continue
+        print('%5d contacts, clutter %4.2f: detects/s %+6.1f%%, p99 latency %+6.1f%%' %
+              (r['contacts'], r['clutter'],
+               100.0*(r['detects_per_sec']/old['detects_per_sec'] - 1.0),
+               100.0*(r['latency_ms']['p99']/old['latency_ms']['p99'] - 1.0)))
+
+
+def main():
+
+    arg_parser = argparse.ArgumentParser(description='Time the tracking of synthetic scenarios of many sizes and save the results as JSON.')
+    arg_parser.add_argument('-sizes', type=int, nargs='+', help='numbers of contacts in the scenarios, default: 10 100 1000 5000', default=[10, 100, 1000, 5000])
+    arg_parser.add_argument('-clutter', type=float, nargs='+', help='clutter detects per sweep in the scenarios, as fractions of the number of contacts, default: 0 0.5', default=[0.0, 0.5])
+    arg_parser.add_argument('-sweeps', type=int, help='number of one second sweeps of the sensors per scenario, default: 5', default=5)
+    arg_parser.add_argument('-history_depth', type=int, help='number of detects to remember for each contact, as the tracker node does when plotting, default: 0, as when it is not', default=0)
+    arg_parser.add_argument('-flight_recorder_size', type=int, help='number of recent association decisions kept by the flight recorder, default: 20000', default=20000)
+    arg_parser.add_argument('-param', type=str, nargs='+', help='parameters of cfg/contact_tracker.cfg to change from their defaults, as NAME=VALUE', default=[])
+    arg_parser.add_argument('-o', type=str, help='file to save the results to, default: tracking_suite.json, current working directory', default='tracking_suite.json')
+    arg_parser.add_argument('-compare', type=str, help='results saved by a previous run to compare with', default=None)
+    arg_parser.add_argument('-seed', type=int, help='seed of the scenarios, default: 0', default=0)
+    args = arg_parser.parse_args()
+
+    config = default_config()
+    for param in args.param:
+        name, _, value = param.partition('=')
+        if name not in config:
+            sys.exit('Unknown parameter %s' % name)
+        if isinstance(config[name], bool):
+            config[name] = value.lower() in ['1', 'true', 'yes']
+        else:
+            config[name] = type(config[name])(value)
+
+    results = []
+    for contacts in args.sizes:
+        for clutter in args.clutter:
+            r = run_isolated(contacts, clutter, args, config)
+            results.append(r)
+            print('%5d contacts, clutter %4.2f: %6d detects, %7.0f detects/s, latency p50 %6.3f p99 %7.3f max %7.3f ms, peak memory %s MB' %
+                  (contacts, clutter, r['detects'], r['detects_per_sec'], r['latency_ms']['p50'],
+                   r['latency_ms']['p99'], r['latency_ms']['max'],
+                   'unknown' if r['peak_rss_mb'] is None else '%0.0f' % r['peak_rss_mb']))
+
+    with open(args.o, 'w') as f:
+        json.dump({'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'revision': revision(),
+                   'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'machine': platform.machine(),
+                   'sweeps': args.sweeps,
+                   'seed': args.seed,
+                   'history_depth': args.history_depth,
+                   'flight_recorder_size': args.flight_recorder_size,
+                   'config': config,
+                   'results': results}, f, indent=2, sort_keys=True)
+    print('Results saved to %s' % args.o)
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# Stand-in for the project11_transformations map_to_wgs84 service, backed
+# by the tracker's in-process LocalTangentPlane converter. It can serve the
+# service itself so the tracker runs without project11, or check the
+# converter's accuracy against the real service.
+
+import rospy
+import argparse
+import numpy as np
+
+import contact_tracker.map_transform
+from project11_transformations.srv import MapToLatLong
+from project11_transformations.srv import MapToLatLongRequest
+from project11_transformations.srv import MapToLatLongResponse
+
+
+class MapToWGS84StandIn:
+    """
+    Class to serve or check the in-process map to WGS84 conversion.
+    """
+
+
+    def __init__(self, args):
+        """
+        Define the constructor.
+
+        args -- parsed command line arguments
+        """
+
+        self.args = args
+        self.converter = None
+
+
+    def handle_map_to_wgs84(self, req):
+        """
+        Answer a MapToLatLong request with the in-process converter.
+
+        Keyword arguments:
+        req -- the MapToLatLongRequest to answer
+        """
+
+        lat, lon, alt = self.converter.to_wgs84(req.map.point.x, req.map.point.y, req.map.point.z)
+
+        res = MapToLatLongResponse()
+        res.wgs84.header.stamp = req.map.header.stamp
+        res.wgs84.header.frame_id = 'wgs84'
+        res.wgs84.position.latitude = float(lat)
+        res.wgs84.position.longitude = float(lon)
+        res.wgs84.position.altitude = float(alt)
+        return res
+
+
+    def serve(self):
+        """
+        Advertise the map_to_wgs84 service for the origin given on the command line.
+        """
+
+        self.converter = contact_tracker.map_transform.LocalTangentPlane(self.args.latitude,
+                                                                         self.args.longitude,
+                                                                         self.args.altitude)
+        rospy.Service(self.args.service, MapToLatLong, self.handle_map_to_wgs84)
+        rospy.loginfo('Serving %s for map origin %f, %f, %f' %
+                      ((self.args.service,) + self.converter.origin))
+        rospy.spin()
+
+
+    def query(self, proxy, x, y):
+        """
+        Return the latitude, longitude and altitude the service gives for a map position.
+        """
+
+        req = MapToLatLongRequest()
+        req.map.point.x = x
+        req.map.point.y = y
+        req.map.point.z = 0.0
+        res = proxy(req)
+        return (res.wgs84.position.latitude,
+                res.wgs84.position.longitude,
+                res.wgs84.position.altitude)
+
+
+    def compare(self):
+        """
+        Convert a grid of map positions with both the service and the
+        in-process converter and print how far apart the results are.
+        """
+
+        rospy.wait_for_service(self.args.service)
+        proxy = rospy.ServiceProxy(self.args.service, MapToLatLong)
+
+        origin = self.query(proxy, 0.0, 0.0)
+        self.converter = contact_tracker.map_transform.LocalTangentPlane(*origin)
+
+        extent = self.args.extent
+        steps = np.linspace(-extent, extent, self.args.steps)
+        xs, ys = np.meshgrid(steps, steps)
+        xs = xs.ravel()
+        ys = ys.ravel()
+
+        service = np.array([self.query(proxy, x, y) for x, y in zip(xs, ys)])
+        lat, lon, alt = self.converter.to_wgs84(xs, ys)
+
+        # Express both answers in the map frame so the error is in meters.
+        sx, sy, sz = self.converter.to_map(service[:, 0], service[:, 1], service[:, 2])
+        cx, cy, cz = self.converter.to_map(lat, lon, alt)
+        error = np.hypot(sx - cx, sy - cy)
+
+        print('Map origin: %f, %f, %f' % origin)
+        print('Positions compared: %d, out to +/- %0.1f m' % (len(xs), extent))
+        print('Horizontal error, m: mean %0.6f, max %0.6f' % (np.mean(error), np.max(error)))
+        worst = np.argmax(error)
+        print('Worst at map %0.1f, %0.1f' % (xs[worst], ys[worst]))
+
+
+def main():
+
+    arg_parser = argparse.ArgumentParser(description='Serve map_to_wgs84 with the in-process converter, or compare the converter against the map_to_wgs84 service.')
+    arg_parser.add_argument('mode', type=str, choices=['serve', 'compare'], help='serve the service, or compare against a running one')
+    arg_parser.add_argument('-service', type=str, help='name of the service, default: map_to_wgs84', default='map_to_wgs84')
+    arg_parser.add_argument('-latitude', type=float, help='latitude of the map origin when serving, in degrees', default=0.0)
+    arg_parser.add_argument('-longitude', type=float, help='longitude of the map origin when serving, in degrees', default=0.0)
+    arg_parser.add_argument('-altitude', type=float, help='altitude of the map origin when serving, in m, default: 0', default=0.0)
+    arg_parser.add_argument('-extent', type=float, help='half width of the grid of positions compared, in m, default: 10000', default=10000.0)
+    arg_parser.add_argument('-steps', type=int, help='number of positions along each side of the grid compared, default: 11', default=11)
+    args = arg_parser.parse_args(rospy.myargv()[1:])
+
+    try:
+        rospy.init_node('map_to_wgs84_standin', anonymous=True)
+        standin = MapToWGS84StandIn(args)
+        if args.mode == 'serve':
+            standin.serve()
+        else:
+            standin.compare()
+
+    except rospy.ROSInterruptException:
+        rospy.loginfo('Failed to run the map_to_wgs84 stand-in')
+        pass
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+# Replay recorded detects through the tracker offline, as fast as they can
+# be processed, and write the resulting tracks to a file. Needs no ROS
+# master; rosbag is only needed to read bags. Bags can also be converted to
+# flat exports or to detect logs, which read back much faster.
+
+import os
+import sys
+import argparse
+
+import contact_tracker.detect_log
+import contact_tracker.replay
+from contact_tracker.cfg import contact_trackerConfig
+from contact_tracker.stage_timers import clock
+
+
+def parse_params(params):
+    """
+    Build the tracker's parameters from the defaults of
+    cfg/contact_tracker.cfg and the overrides given on the command line.
+
+    Keyword arguments:
+    params -- list of NAME=VALUE strings
+
+    Returns: dictionary of the parameters
+    """
+
+    config = dict(contact_trackerConfig.defaults)
+    for param in params:
+        name, _, value = param.partition('=')
+        if name not in config:
+            sys.exit('Unknown parameter %s' % name)
+        if isinstance(config[name], bool):
+            config[name] = value.lower() in ['1', 'true', 'yes']
+        else:
+            config[name] = type(config[name])(value)
+    return config
+
+
+def main():
+
+    arg_parser = argparse.ArgumentParser(description='Replay recorded detects through the tracker as fast as they can be processed, or export them to a flat file.')
+    arg_parser.add_argument('mode', type=str, choices=['track', 'export'], help='track the detects, or write them to a flat export or a detect log')
+    arg_parser.add_argument('input', type=str, help='bag file, flat export ending in .csv or detect log directory to read the detects from')
+    arg_parser.add_argument('-o', type=str, help='file to write the tracks to, or the export, which is a flat export if it ends in .csv and a detect log directory otherwise, default: tracks.csv, current working directory', default='tracks.csv')
+    arg_parser.add_argument('-topic', type=str, help='topic of the detects in a bag, default: /detects', default='/detects')
+    arg_parser.add_argument('-reorder_window', type=float, help='longest time a detect is held back to put the detects in stamp order, in s, default: 5', default=5.0)
+    arg_parser.add_argument('-param', type=str, nargs='+', help='parameters of cfg/contact_tracker.cfg to change from their defaults, as NAME=VALUE', default=[])
+    args = arg_parser.parse_args()
+
+    if os.path.isdir(args.input):
+        detects = contact_tracker.detect_log.DetectLog(args.input).detects()
+    elif args.input.endswith('.csv'):
+        detects = contact_tracker.replay.read_csv(args.input)
+    else:
+        detects = contact_tracker.replay.read_bag(args.input, args.topic)
+    detects = contact_tracker.replay.in_stamp_order(detects, args.reorder_window)
+
+    t = clock()
+    if args.mode == 'export':
+        if args.o.endswith('.csv'):
+            n = contact_tracker.replay.write_csv(detects, args.o)
+        else:
+            n = contact_tracker.detect_log.write_log(detects, args.o)
+        print('%d detects exported to %s in %0.1f s' % (n, args.o, clock() - t))
+        return
+
+    replay = contact_tracker.replay.Replay(parse_params(args.param))
+    counts = replay.run(detects, args.o)
+    seconds = clock() - t
+
+    print('%d detects, %d rejected, %d late: %d updates, %d contacts started, %d deleted as stale, %d merged' %
+          (counts['detects'], counts['rejected'], counts['late'], counts['updates'],
+           counts['new'], counts['stale'], counts['merged']))
+    print('%0.1f s, %0.0f detects/s, %0.0f detects/s in the tracker alone' %
+          (seconds, counts['detects']/max(seconds, 1e-9),
+           counts['detects']/max(replay.engine_seconds, 1e-9)))
+    print('Tracks written to %s' % args.o)
+
+
+if __name__=='__main__':
+    main()
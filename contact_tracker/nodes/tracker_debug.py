@@ -7,19 +7,24 @@
 # University of New Hampshire
 # Date last modified: 03/30/2020
 
-import math
+import os
+import time
+import signal
 import rospy
+import threading
 import argparse
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 from numpy import nan
-from copy import deepcopy
 
-import contact_tracker.contact
-import contact_tracker.contact_kf
+import contact_tracker.engine
+import contact_tracker.map_transform
+import contact_tracker.publisher
 from contact_tracker.cfg import contact_trackerConfig
 from marine_msgs.msg import Detect, Contact
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+from std_srvs.srv import Trigger, TriggerResponse
 from project11_transformations.srv import MapToLatLong
 from project11_transformations.srv import MapToLatLongRequest
 
@@ -27,22 +32,34 @@ from filterpy.stats.stats import plot_covariance
 from dynamic_reconfigure.server import Server
 
 
-DEBUG = True
-
 class ContactTracker:
     """
     Class to create custom contact tracker.
     """
 
 
-    def __init__(self):
+    def __init__(self, history_depth=0, flight_recorder_size=20000):
         """
         Define the constructor.
+
+        history_depth -- number of detects to remember in each contact's plotting history, 0 for none
+        flight_recorder_size -- number of association decisions kept by the flight recorder
         """
 
-        self.all_contacts = {}
+        self.engine = contact_tracker.engine.TrackingEngine(history_depth, flight_recorder_size)
         self.plotcolors = {}
-        self.all_contact_history = {}
+        self.colors = cm.rainbow(np.linspace(0, 1, 8)) # Generate 8 colors from the rainbow colormap
+        self.map_to_wgs84 = None
+        self.lock = threading.RLock()
+        self.stale_check_rate = 1.0
+        self.stale_timer = None
+        self.merge_rate = 1.0
+        self.merge_timer = None
+        self.diagnostics_rate = 1.0
+        self.diagnostics_timer = None
+        self.timers_started = False
+        self.output = None
+        self.flight_recorder_dir = '.'
 
 
     def plot_x_vs_y(self, output_path):
@@ -61,46 +78,34 @@ class ContactTracker:
 
         plt.figure(figsize=(10,10))
 
-        for contact in self.all_contacts:
-            c = self.all_contacts[contact]
-
-            m_xs = []
-            m_ys = []
-            p_xs = []
-            p_ys = []
-            e_xs = []
-            e_ys = []
-
-            for i in c.zs:
-                m_xs.append(i[0])
-                m_ys.append(i[1])
-
-            for i in c.xs:
-                p_xs.append(i[0])
-                p_ys.append(i[1])
+        for cid in self.engine.all_contact_history:
+            history = self.engine.all_contact_history[cid]
 
-            for i in c.xs:
-                e_xs.append(i[0])
-                e_ys.append(i[1])
+            m_xs = history['meas_xy'][:, 0]
+            m_ys = history['meas_xy'][:, 1]
+            p_xs = history['track_xy'][:, 0]
+            p_ys = history['track_xy'][:, 1]
+            e_xs = p_xs
+            e_ys = p_ys
             
             plt.scatter(m_xs, m_ys, marker='.',
-                        label='contact' + str(c.id) + ' meas',
-                        color=self.plotcolors[c.id])
+                        label='contact' + history.name + ' meas',
+                        color=self.plotcolors[cid])
             plt.plot(p_xs, p_ys, marker='x',
-                     label='contact' + str(c.id) + ' pred',
-                     color=self.plotcolors[c.id])
+                     label='contact' + history.name + ' pred',
+                     color=self.plotcolors[cid])
             plt.scatter(e_xs, e_ys,marker='P', linestyle='-',
-                        label='contact' + str(c.id) + ' est',
+                        label='contact' + history.name + ' est',
                         color = 'r')
                         #color=self.plotcolors[contact])
 
-            tmp = np.min(np.array(m_xs))
+            tmp = np.nanmin(m_xs)
             if tmp < minx: minx = tmp
-            tmp = np.max(np.array(m_xs))
+            tmp = np.nanmax(m_xs)
             if tmp > maxx: maxx = tmp
-            tmp = np.min(np.array(m_ys))
+            tmp = np.nanmin(m_ys)
             if tmp < miny: miny = tmp
-            tmp = np.max(np.array(m_ys))
+            tmp = np.nanmax(m_ys)
             if tmp > maxy: maxy = tmp
 
         #plt.legend()
@@ -129,35 +134,34 @@ class ContactTracker:
         fig, (ax1,ax2) = plt.subplots(2, sharex=True, figsize=(12,6))
         tstart = 0
         
-        for cid in self.all_contact_history:
-            contactList = self.all_contact_history[cid]
-            print(contactList[0].Z)
-
-            m_xs = [c.Z[0] for c in contactList]
-            m_ys = [c.Z[1] for c in contactList]
-            e_xs = [c.filter_bank.x[0] for c in contactList]
-            e_ys = [c.filter_bank.x[1] for c in contactList]
-            p_xs = [c.all_filters[1].x_prior[0] for c in contactList]
-            p_ys = [c.all_filters[1].x_prior[1] for c in contactList]
-            sigma_mx = np.sqrt(np.array([c.all_filters[0].R[0,0] for c in contactList]))
-            sigma_my = np.sqrt(np.array([c.all_filters[0].R[1,1] for c in contactList]))
-            sigma_ex = np.sqrt(np.array([c.filter_bank.P[0,0] for c in contactList]))
-            sigma_ey = np.sqrt(np.array([c.filter_bank.P[1,1] for c in contactList]))
-            sigma_px = np.sqrt(np.array([c.all_filters[1].P_prior[0,0] for c in contactList]))
-            sigma_py = np.sqrt(np.array([c.all_filters[1].P_prior[1,1] for c in contactList]))
-            tt = np.array([c.evalTime for c in contactList] )
+        for cid in self.engine.all_contact_history:
+            history = self.engine.all_contact_history[cid]
+
+            m_xs = history['z'][:, 0]
+            m_ys = history['z'][:, 1]
+            e_xs = history['x'][:, 0]
+            e_ys = history['x'][:, 1]
+            p_xs = history['x_prior'][:, 0]
+            p_ys = history['x_prior'][:, 1]
+            sigma_mx = np.sqrt(history['R_diag'][:, 0])
+            sigma_my = np.sqrt(history['R_diag'][:, 1])
+            sigma_ex = np.sqrt(history['P_diag'][:, 0])
+            sigma_ey = np.sqrt(history['P_diag'][:, 1])
+            sigma_px = np.sqrt(history['P_prior_diag'][:, 0])
+            sigma_py = np.sqrt(history['P_prior_diag'][:, 1])
+            tt = history['time']
   
             if tstart == 0:
                 tstart = tt[0]
             tt = tt - tstart
 
-            tmp = np.min(np.array(m_xs))
+            tmp = np.min(m_xs)
             if tmp < minx: minx = tmp
-            tmp = np.max(np.array(m_xs))
+            tmp = np.max(m_xs)
             if tmp > maxx: maxx = tmp
-            tmp = np.min(np.array(m_ys))
+            tmp = np.min(m_ys)
             if tmp < miny: miny = tmp
-            tmp = np.max(np.array(m_ys))
+            tmp = np.max(m_ys)
             if tmp > maxy: maxy = tmp
 
             ax1.errorbar(tt,m_xs,yerr = sigma_mx, marker='x',
@@ -207,32 +211,30 @@ class ContactTracker:
         all_zs = []
         all_ps = []
 
-        for contact in self.all_contacts:
-            c = self.all_contacts[contact]
-            p_xs = []
-            p_ys = []
+        for cid in self.engine.all_contact_history:
+            history = self.engine.all_contact_history[cid]
             cur_ps = []
             z_means = []
 
-            for i in c.xs:
-                p_xs.append(i[0])
-                p_ys.append(i[1])
+            track_xy = history['track_xy']
+            meas_xy = history['meas_xy']
+            track_P_xy = history['track_P_xy']
 
-            all_pxs.append(p_xs)
-            all_pys.append(p_ys)
+            all_pxs.append(track_xy[:, 0])
+            all_pys.append(track_xy[:, 1])
 
-            for i in range(0, len(c.xs), 4):
-                z_mean = np.array([c.zs[i][0], c.zs[i][1]])
-                cur_p = c.ps[i]
+            for i in range(0, len(history), 4):
+                z_mean = meas_xy[i]
+                cur_p = track_P_xy[i]
                 plot_covariance(mean=z_mean, cov=cur_p)
 
             all_zs.append(z_means)
             all_ps.append(cur_ps)
 
-        minx = np.min([np.min(np.array(x)) for x in all_pxs])
-        maxx = np.max([np.max(np.array(x)) for x in all_pxs])
-        miny = np.min([np.min(np.array(x)) for x in all_pys])
-        maxy = np.max([np.max(np.array(x)) for x in all_pys])
+        minx = np.min([np.min(x) for x in all_pxs])
+        maxx = np.max([np.max(x) for x in all_pxs])
+        miny = np.min([np.min(x) for x in all_pys])
+        maxy = np.max([np.max(x) for x in all_pys])
 
         for i in range(0, len(all_pxs)):
             plt.plot(all_pxs[i], all_pys[i], label='predictions', color='g')
@@ -246,330 +248,330 @@ class ContactTracker:
         plt.savefig(output_path + '.png')
 
 
-    def dump_detect(self, detect_info):
+    def populate_detect_info(self, data):
         """
-        Print the contents of a contact's detect_info dictionary for debugging purposes.
+        Initialize the data structure for this detect message and check
+        for empty position and velocity fields. Return an empty dictionary
+        if one position or velocity field is empty and the other position
+        or velocity field is not.
 
         Keyword arguments:
-        detect_info -- the dictionary containing the detect info to be printed
+        data -- The detect message that was just transmitted
         """
 
-        print('+++++++ DETECT +++++++')
-        for k, v in detect_info.items():
-            print(k, ': ', v)
+        detect_info = contact_tracker.engine.detect_from_msg(data)
+
+        # Check to see that if one coordinate is not NaN, neither is the other
+        error = contact_tracker.engine.check_detect(detect_info)
+        if error is not None:
+            rospy.loginfo('ERROR: %s...returning' % error)
+            detect_info = {}
+
+        return detect_info
 
 
-    def dump_contacts(self):
+    def check_scan_timeout(self, event):
         """
-        Print the contents of the all_contacts dictionary for debugging purposes.
+        Process the current scan if its window has passed without another
+        detect arriving to close it.
+
+        Keyword arguments:
+        event -- rospy.TimerEvent
         """
 
-        print('+++++++ CONTACTS +++++++')
-        for k in self.all_contacts.items():
-            print(k)
-        print('++++++++++++++++++++++++')
+        with self.lock:
+            updates = self.engine.close_scan(rospy.get_rostime().to_sec())
+            self.publish_updates(updates)
 
 
-    def populate_detect_info(self, data):
+    def delete_stale_contacts(self, event=None):
         """
-        Initialize the data structure for this detect message and check
-        for empty position and velocity fields. Return an empty dictionary
-        if one position or velocity field is empty and the other position
-        or velocity field is not.
+        Remove contacts that have not been measured recently. Called
+        periodically by a timer.
 
         Keyword arguments:
-        data -- The detect message that was just transmitted
+        event -- rospy.TimerEvent when called by a timer
         """
 
-        # Get necessary info from the Detect data
-        detect_info = {
-                'header': data.header,
-                'sensor_id': data.sensor_id,
-                'pos_covar': data.pose.covariance,
-                'twist_covar': data.twist.covariance,
-                'x_pos': float('nan'),
-                'x_vel': float('nan'),
-                'y_pos': float('nan'),
-                'y_vel': float('nan'),
-                }
-        
-        # Assign values only if they are not NaNs
-        if not math.isnan(data.pose.pose.position.x):
-            detect_info['x_pos'] = float(data.pose.pose.position.x)
+        with self.lock:
+            self.engine.delete_stale_contacts(rospy.get_rostime().to_sec())
 
-        if not math.isnan(data.pose.pose.position.y):
-            detect_info['y_pos'] = float(data.pose.pose.position.y)
 
-        if not math.isnan(data.twist.twist.linear.x):
-            detect_info['x_vel'] = float(data.twist.twist.linear.x)
-
-        if not math.isnan(data.twist.twist.linear.y):
-            detect_info['y_vel'] = float(data.twist.twist.linear.y)
+    def merge_contacts(self, event=None):
+        """
+        Merge contacts that are most likely the same target. Called
+        periodically by a timer.
 
-        # Check to see that if one coordinate is not NaN, neither is the other
-        if ((not math.isnan(detect_info['x_pos']) and math.isnan(detect_info['y_pos'])) or (math.isnan(detect_info['x_pos']) and not math.isnan(detect_info['y_pos']))):
-            rospy.loginfo('ERROR: x_pos and y_pos both were not nans...returning')
-            detect_info = {}
-        if ((not math.isnan(detect_info['x_vel']) and math.isnan(detect_info['y_vel'])) or (math.isnan(detect_info['x_vel']) and not math.isnan(detect_info['y_vel']))):
-            rospy.loginfo('ERROR: x_vel and y_vel both were not nans...returning')
-            detect_info = {}
+        Keyword arguments:
+        event -- rospy.TimerEvent when called by a timer
+        """
 
-        return detect_info
+        with self.lock:
+            merged = self.engine.merge_contacts(rospy.get_rostime().to_sec())
+        for keep, drop in merged:
+            rospy.loginfo('Merging Contact %s into %s' % (drop, keep))
 
 
-    def check_all_contacts_by_distance(self, detect_info, data):
+    def start_merge_timer(self):
+        """
+        (Re)start the timer that merges duplicate contacts at the configured
+        rate, or stop it if merging is disabled.
         """
-        FOR DEBUGGING PURPOSES
-        Iterate over every contact in the dictionary and return the contact
-        the current detect is most likely associated with by checking Euclidean
-        distance between the prediction and the measurement. If no contact
-        is asociated with this detect, return the timestamp of the current detect
-        message as the new hash_key for the new contact that will be made.
 
-        Keyword arguments:
-        detect_info -- the dictionary containing the detect info to be checked
-        data -- data from the detect message that was just transmitted
+        if self.merge_timer is not None:
+            self.merge_timer.shutdown()
+            self.merge_timer = None
+        if self.merge_rate > 0:
+            self.merge_timer = rospy.Timer(rospy.Duration(1.0/self.merge_rate),
+                                           self.merge_contacts)
 
-        Returns:
-        None if no appropriate contacts are found, otherwise the found contact's id
+
+    def start_stale_timer(self):
+        """
+        (Re)start the timer that deletes stale contacts at the configured rate.
         """
 
-        greatest_pred = float('inf')
-        return_contact_id = None
+        if self.stale_timer is not None:
+            self.stale_timer.shutdown()
+        self.stale_timer = rospy.Timer(rospy.Duration(1.0/self.stale_check_rate),
+                                       self.delete_stale_contacts)
 
-        for contact in self.all_contacts:
-            c = self.all_contacts[contact]
 
-            # Get the distance between the measurement and the prediction for each filter.
-            side1a = abs(detect_info['x_pos'] - c.filter_bank.filters[0].x[0])
-            side1b = abs(detect_info['y_pos'] - c.filter_bank.filters[0].x[1])
-            side2a = abs(detect_info['x_pos'] - c.filter_bank.filters[1].x[0])
-            side2b = abs(detect_info['y_pos'] - c.filter_bank.filters[1].x[1])
+    def reconfigure_callback(self, config, level):
+        """
+        Get the parameters from the cfg file and assign them to the member variables of the
+        ContactTracker class.
+        """
+
+        with self.lock:
+            self.engine.configure(config)
+
+        # The rates are kept even before run() starts the timers, which it
+        # does with the rates last configured. A running timer is restarted
+        # only when its own rate changes; a disabled one, which has no
+        # timer, is started again once the timers are running.
+        if config['stale_check_rate'] != self.stale_check_rate:
+            self.stale_check_rate = config['stale_check_rate']
+            if self.stale_timer is not None:
+                self.start_stale_timer()
+        if config['merge_rate'] != self.merge_rate:
+            self.merge_rate = config['merge_rate']
+            if self.merge_timer is not None or self.timers_started:
+                self.start_merge_timer()
+        if config['diagnostics_rate'] != self.diagnostics_rate:
+            self.diagnostics_rate = config['diagnostics_rate']
+            if self.diagnostics_timer is not None or self.timers_started:
+                self.start_diagnostics_timer()
+        return config
+
 
-            H1 = math.sqrt(side1a**2 + side1b**2)
-            H2 = math.sqrt(side2a**2 + side2b**2)
+    def diagnostics(self):
+        """
+        Returns: list of (key, value) pairs describing the tracker's state:
+        the engine's diagnostics followed by the backlog of the output stage.
+        """
 
-            # If both filters have predictions within 10 of the measurement, incorporate
-            # the measurement into the filter.
-            if H1 <= 10 and H2 <= 10:
-                if H1 + H2 <= greatest_pred:
-                    greatest_pred = H1 + H2
-                    return_contact_id = c.id
+        values = self.engine.diagnostics()
+        if self.output is not None:
+            for key, value in sorted(self.output.stats().items()):
+                values.append(('output_' + key, value))
 
-        return return_contact_id
+        return values
 
 
-    def check_all_contacts_by_likelihood(self, detect_info, data):
+    def publish_diagnostics(self, event=None):
         """
-        FOR DEBUGGING PURPOSES
-        Iterate over every contact in the dictionary and return the contact
-        the current detect is most likely associated with by checking log
-        likilehood of each Kalman filter in the contact. If no contact
-        is asociated with this detect, return the timestamp of the current detect
-        message as the new hash_key for the new contact that will be made.
+        Publish the tracker's diagnostics on the diagnostics topic. Called
+        periodically by a timer.
 
         Keyword arguments:
-        detect_info -- the dictionary containing the detect info to be checked
-        data -- data from the detect message that was just transmitted
+        event -- rospy.TimerEvent when called by a timer
+        """
 
-        Returns:
-        None if no appropriate contacts are found, otherwise the found contact's id
+        with self.lock:
+            values = self.diagnostics()
+
+        status = DiagnosticStatus()
+        status.level = DiagnosticStatus.OK
+        status.name = 'contact_tracker'
+        status.message = '%d contacts' % len(self.engine.all_contacts)
+        status.values = [KeyValue(key, str(value)) for key, value in values]
+
+        msg = DiagnosticArray()
+        msg.header.stamp = rospy.get_rostime()
+        msg.status = [status]
+        self.pub_diagnostics.publish(msg)
+
+
+    def start_diagnostics_timer(self):
+        """
+        (Re)start the timer that publishes diagnostics at the configured
+        rate, or stop it if publishing them is disabled.
         """
 
-        greatest_likelihood = 0.0
-        return_contact_id = None
+        if self.diagnostics_timer is not None:
+            self.diagnostics_timer.shutdown()
+            self.diagnostics_timer = None
+        if self.diagnostics_rate > 0:
+            self.diagnostics_timer = rospy.Timer(rospy.Duration(1.0/self.diagnostics_rate),
+                                                 self.publish_diagnostics)
 
-        for contact_id in self.all_contacts:
-            c = self.all_contacts[contact_id]
-            
-            for kf in c.filter_bank.filters:
-                kf.set_log_likelihood(c)
-
-                if DEBUG:
-                    print('sensor_id: ', detect_info['sensor_id'])
-                    print('filter type: ', kf.filter_type)
-                    print('contact id: ', c.id)
-                    print('likelihood :', kf.get_log_likelihood())
-                    print('________________')
-                    
-            # L1 = c.filter_bank.filters[0].get_log_likelihood()
-            # L2 = c.filter_bank.filters[1].get_log_likelihood()
-
-            # EXPERIMENTAL
-            # Here only the second order filter is being evaluated, as it
-            # accommodates the largest changes. I'm using the likelihood rather
-            # than the log liklihood, which is equivalent, but easier to
-            # understand.
-
-            for kf in c.filter_bank.filters:
-                if kf.filter_type == 'second':
-                    L = np.exp(kf.get_log_likelihood())
-                    #print("Contact: %s L: %0.4f Last dT: %f" %
-                    #      (contact_id,L,c.dt))
-
-                   # This requires the measurement to be somewhat likely (1/20).
-                   # Otherwise the measurement is not considered to be a candidate
-                   # measurement of the contact.
-                    if L > 0.05:
-                        # Here we keep track of the contact for whom the measurement
-                        # has the greatest likelihood.
-                        if L > greatest_likelihood:
-                            greatest_likelihood = L
-                            return_contact_id = contact_id
-
-
-
-            # Not sure about this condition
-            #if L1 / L2 > 0.5:
-            #    if L1 / L2 > greatest_likelihood:
-            #        greatest_likelihood = L1 / L2
-            #        return_contact_id = c.id
-        print("   Greatest Likelihood: %0.4f, Contact: %s" %
-              (greatest_likelihood,return_contact_id))
-        return return_contact_id
-
-
-    def check_all_contacts_by_BF(self, detect_info, data):
-        """
-        Iterate over every contact in the dictionary and return the contact
-        the current detect is most likely associated with by checking the
-        Bayes factor of each Kalman filter in the contact. If no contact
-        is asociated with this detect, return the timestamp of the current detect
-        message as the new hash_key for the new contact that will be made.
 
-        Keyword arguments:
-        detect_info -- the dictionary containing the detect info to be checked
-        data -- data from the detect message that was just transmitted
+    def dump_flight_recorder(self):
+        """
+        Write the flight recorder's records to a new file in flight_recorder_dir,
+        named after the current time.
 
-        Returns:
-        None if no appropriate contacts are found, otherwise the found contact's id
+        Returns: the path written and the number of records in it
         """
 
-        greatest_logBF = 0
-        return_contact_id = None
+        path = os.path.join(self.flight_recorder_dir,
+                            time.strftime('flight_recorder_%Y%m%d_%H%M%S.npy'))
+        with self.lock:
+            n = self.engine.recorder.dump(path)
+        rospy.loginfo('Flight recorder: %d records written to %s' % (n, path))
+        return path, n
 
-        for contact in self.all_contacts:
-            c = self.all_contacts[contact]
-            
-            for kf in c.filter_bank.filters:
-                kf.set_bayes_factor(c, 2.0)
 
-                if DEBUG:
-                    print('sensor_id: ', detect_info['sensor_id'])
-                    print('filter type: ', kf.filter_type)
-                    print('contact id: ', c.id)
-                    print('BF :', kf.get_bayes_factor())
-                    print('________________')
+    def handle_dump_flight_recorder(self, req):
+        """
+        Dump the flight recorder on a call to the dump_flight_recorder service.
+
+        Keyword arguments:
+        req -- std_srvs/TriggerRequest
 
-            logBF1 = c.filter_bank.filters[0].get_bayes_factor()
-            logBF2 = c.filter_bank.filters[1].get_bayes_factor()
+        Returns: std_srvs/TriggerResponse with the path written
+        """
 
-            if logBF1 > 2 and logBF2 > 2:
-                if logBF1 + logBF2 > greatest_logBF:
-                    greatest_logBF = logBF1 + logBF2
-                    return_contact_id = c.id
+        try:
+            path, n = self.dump_flight_recorder()
+        except (IOError, OSError) as e:
+            return TriggerResponse(False, str(e))
+        return TriggerResponse(True, path)
 
-        return return_contact_id
 
+    def handle_signal(self, signum, frame):
+        """
+        Dump the flight recorder on SIGUSR1.
+        """
 
-    def setup_contacts_for_detect(self, detect_info):
-        """ 
-        Loops through the contacts, populates Q, F, H and R for the measured
-        time and parameters. Sets c.dt which is the time since the last time
-        the contact position was predicted. Finally, for each filter, predicts
-        the location of the contact at the measurement time.
+        try:
+            self.dump_flight_recorder()
+        except (IOError, OSError) as e:
+            rospy.logerr('Flight recorder dump failed: %s' % e)
 
-        These steps are required prior to evaulating whether the received detect
-        is likely a measure of a given contact, or a new contact altogether.
 
-        NB. The prediction step done here populates ONLY KF.x_prior and
-        KF.P_prior, and NOT KF.x and KF.P. This detail is important, because
-        the "prior" variables allow us to use these predicted states to
-        test for whether a measurement should be associated with the contact
-        without actually modifying the contact's state (just in case the test
-        fails).
+    def refresh_map_origin(self, event=None):
+        """
+        Fetch the WGS84 position of the map origin from the map_to_wgs84
+        service and rebuild the in-process map to WGS84 converter if the
+        origin changed. Called once at startup and then periodically by a timer.
 
         Keyword arguments:
-        detect_info -- the dictionary containing the detect info to use 
-        """ 
-
-        for contact_id in self.all_contacts:
-            c = self.all_contacts[contact_id]
-            # Recompute the value for dt, so we can use it to update this Contact's
-            # KalmanFilter's Q(s).
-            c.dt = (detect_info['header'].stamp - c.last_measured).to_sec()
-            c.set_Z(detect_info)
-            c.set_Q()    # sets Q for all filters.
-            
-            for kf in c.filter_bank.filters:
-                kf.set_F(c)
-                kf.set_H(c, detect_info)
-                kf.set_R(c, detect_info)
-                kf.predict_prior()   # This does not update the state, x. Just x_prior.
-                
-                if kf.filter_type == 'second':
-                    print("C: %s: Prior X,Y: %0.3f,%0.3f" %
-                          (c.id,
-                           np.sqrt(kf.P_prior[0,0]),
-                           np.sqrt(kf.P_prior[1,1])))
+        event -- rospy.TimerEvent when called by a timer
+        """
 
+        try:
+            rospy.wait_for_service('map_to_wgs84', timeout=5.0)
+            project11_transformation_node = rospy.ServiceProxy('map_to_wgs84', MapToLatLong)
+
+            req = MapToLatLongRequest()
+            req.map.point.x = 0.0
+            req.map.point.y = 0.0
+            req.map.point.z = 0.0
 
-    def delete_stale_contacts(self):
+            llcoords = project11_transformation_node(req)
+            origin = (llcoords.wgs84.position.latitude,
+                      llcoords.wgs84.position.longitude,
+                      llcoords.wgs84.position.altitude)
+
+        except (rospy.ServiceException, rospy.ROSException) as e:
+            rospy.logwarn('Could not get the map origin from map_to_wgs84: %s' % e)
+            return
+
+        if self.map_to_wgs84 is None or self.map_to_wgs84.origin != origin:
+            rospy.loginfo('Map origin at %f, %f, %f' % origin)
+            self.map_to_wgs84 = contact_tracker.map_transform.LocalTangentPlane(*origin)
+
+
+    def publish_updates(self, updates):
         """
-        Remove items from the dictionary that have not been measured recently.
+        Queue the Contact and Detect messages for each contact the engine
+        just updated. They are built and published by the output stage's
+        worker thread from the update, which holds copies of everything they
+        need. Contacts just started are given a plot color, not published.
+
+        Keyword arguments:
+        updates -- list of the updates returned by the engine
         """
 
-        for contact_id in list(self.all_contacts):
-            cur_contact = self.all_contacts[contact_id]
-            time_between_now_and_last_measured = (rospy.get_rostime() -
-                                                  cur_contact.last_measured).to_sec() / 60.0
-            print(" Contact: %s, dT %0.3f m" %
-                  (contact_id,time_between_now_and_last_measured))
-            if time_between_now_and_last_measured > self.max_stale_contact_time:
-                rospy.loginfo('Deleting stale Contact from dictionary, %0.3f' %
-                              time_between_now_and_last_measured)
-                del self.all_contacts[contact_id]
+        if len(updates) == 0:
+            return
 
+        t = self.engine.timers.start()
+        for update in updates:
+            if update['new']:
+                # Pick the subsequent color from this colormap each time we make a new contact
+                self.plotcolors[update['id']] = self.colors[np.mod(len(self.engine.all_contacts), len(self.colors))]
+            else:
+                self.output.submit(update['id'], update)
+        self.engine.timers.stop('publish_msgs', t)
 
-    def reconfigure_callback(self, config, level):
+
+    def handle_output_error(self, error, errors):
         """
-        Get the parameters from the cfg file and assign them to the member variables of the
-        ContactTracker class.
+        Report a contact update the output stage failed to build or publish.
+        A broken publisher fails on every update, so the report is throttled.
+
+        Keyword arguments:
+        error -- the exception raised
+        errors -- number of updates that have failed so far
         """
 
-        self.max_stale_contact_time = config['max_stale_contact_time']
-        self.initial_velocity = config['initial_velocity']
-        return config
+        rospy.logerr_throttle(10.0, 'Failed to publish a contact update (%d failures so far): %r' %
+                              (errors, error))
 
 
-    def add_contact(self, cid, detect_info):
+    def build_msgs(self, updates):
         """
-        Initialize new contact and add it to all_contacts.
+        Build the Detect and Contact messages for the queued updates. The
+        map positions of all of them are converted to WGS84 in one call.
+        Runs on the output stage's worker thread.
 
         Keyword arguments:
-        cid -- timestamp representing unique id of this contact object
-        detect_info -- the dictionary containing the detect info to use 
+        updates -- list of the dictionaries queued by publish_updates
+
+        Returns: list of the messages for pub_contactmap and pub_contacts of each update
         """
 
-        first_order_kf = contact_tracker.contact_kf.ContactKalmanFilter(dim_x=6, dim_z=4, filter_type='first')
-        second_order_kf = contact_tracker.contact_kf.ContactKalmanFilter(dim_x=6, dim_z=4, filter_type='second')
-        all_filters = [first_order_kf, second_order_kf]
-        c = contact_tracker.contact.Contact(detect_info, all_filters, cid)
-        self.all_contacts[cid] = c
-        colors = cm.rainbow(np.linspace(0, 1, 8)) # Generate 8 colors from the rainbow colormap
-        self.plotcolors[cid] = colors[np.mod(len(self.all_contacts), len(colors))] # Pick the subsequent color from this colormap each time we make a new contact
-        
+        # Convert map coordinates to latitude and longitude in-process,
+        # relative to the map origin fetched from the map_to_wgs84 service.
+        # The timer may replace the converter, so it is read once.
+        converter = self.map_to_wgs84
+        if converter is not None:
+            positions = np.array([(update['detect_info']['x_pos'], update['detect_info']['y_pos'])
+                                  for update in updates])
+            lats, lons, alts = converter.to_wgs84(positions[:, 0], positions[:, 1])
+        else:
+            lats = lons = [nan]*len(updates)
+
+        return [self.build_update_msgs(update, lat, lon)
+                for update, lat, lon in zip(updates, lats, lons)]
 
-    def publish_msgs(self, c, detect_info):
+
+    def build_update_msgs(self, update, latitude, longitude):
         """
-        Initialize new contact and add it to all_contacts.
+        Build the Detect and Contact messages for one queued update.
 
         Keyword arguments:
-        detect_info -- the dictionary containing the detect info to publish         
-        c -- Contact object for which to publish data 
+        update -- dictionary queued by publish_updates
+        latitude -- latitude of the detect, in degrees
+        longitude -- longitude of the detect, in degrees
+
+        Returns: list of the messages for pub_contactmap and pub_contacts
         """
 
-        
+        detect_info = update['detect_info']
 
         ################################################
         ###### Set fields for the Contact message ######
@@ -578,27 +580,13 @@ class ContactTracker:
         contact_msg.header.stamp.secs = detect_info['header'].stamp.secs
         contact_msg.header.stamp.nsecs = detect_info['header'].stamp.nsecs
         contact_msg.header.frame_id = "wgs84"
-        contact_msg.name = str(c.id)
+        contact_msg.name = update['name']
         contact_msg.callsign = "UNKNOWN"
         #contact_msg.heading = course_made_good # Should I subscribe to the cmg node?
         #contact_msg.contact_souce = "contact_tracker" #This is supposed to be a unit64 
 
-        # Do a service call to MaptoLatLong.srv to convert map coordinates to
-        # latitude and longitude.
-        try:
-            rospy.wait_for_service('map_to_wgs84')
-            project11_transformation_node = rospy.ServiceProxy('map_to_wgs84', MapToLatLong)
-
-            req = MapToLatLongRequest()
-            req.map.point.x = detect_info['x_pos']
-            req.map.point.y = detect_info['y_pos']
-
-            llcoords = project11_transformation_node(req)
-            contact_msg.position.latitude = llcoords.wgs84.position.latitude
-            contact_msg.position.longitude = llcoords.wgs84.position.longitude
-
-        except rospy.ServiceException, e:
-            print("Service call failed: %s", e)
+        contact_msg.position.latitude = float(latitude)
+        contact_msg.position.longitude = float(longitude)
 
         # Convert velocity in x and y into course over ground
         # and speed over ground.
@@ -625,18 +613,17 @@ class ContactTracker:
         detect_msg.sensor_id = detect_info['sensor_id']
 
         # Not sure if this is the right thing to do...
-        for kf in c.filter_bank.filters:
-            if kf.filter_type == 'first':
-                detect_msg.pose.covariance = kf.P
-            elif kf.filter_type == 'second':
-                detect_msg.twist.covariance = kf.P 
+        for filter_type in update['P']:
+            if filter_type == 'first':
+                detect_msg.pose.covariance = update['P'][filter_type]
+            elif filter_type == 'second':
+                detect_msg.twist.covariance = update['P'][filter_type]
 
 
         ##################################
         ###### Publish the messages ######
         ##################################
-        self.pub_contactmap.publish(detect_msg)
-        self.pub_contacts.publish(contact_msg)
+        return [detect_msg, contact_msg]
 
 
 
@@ -653,88 +640,22 @@ class ContactTracker:
         ########################################################
 
         # Initialize variables and store in a dictionary.
+        timers = self.engine.timers
+        started = timers.start()
         detect_info = self.populate_detect_info(data)
+        timers.stop('populate_detect_info', started)
         if len(detect_info) == 0:
             return
 
-        #  If there are no contacts yet, no need to traverse empty dictionary
-        #  Otherwise, we have to check each contact in the dictionary to see if
-        #  it is a potential match for our current detect message.
-        self.setup_contacts_for_detect(detect_info)
-
-        contact_id = None
-        if len(self.all_contacts) > 0:
-            contact_id = self.check_all_contacts_by_BF(detect_info, data)
-
-        if contact_id is None:
-           contact_id = data.header.stamp
-
-
-        #######################################################
-        ####### CREATE OR UPDATE CONTACT WITH VARIABLES #######
-        #######################################################
-
-        if not contact_id in self.all_contacts:
-            self.add_contact(contact_id, detect_info)
-            self.all_contacts[contact_id].set_Z(detect_info)
-        
-        else:
-            c = self.all_contacts[contact_id]
-            c.info = detect_info
-
-            if not math.isnan(detect_info['x_pos']):
-                c.last_xpos = detect_info['x_pos']
-                c.last_ypos = detect_info['y_pos']
-
-            if not math.isnan(detect_info['x_vel']):
-                c.last_xvel = detect_info['x_vel']
-                c.last_yvel = detect_info['y_vel']
-
-            # Incorporate with filters in the filter_bank.
-            c.filter_bank.predict()
-            c.filter_bank.update(c.Z)
-            c.last_measured = detect_info['header'].stamp
-        
-            # Publish info about this detect and contact
-            self.publish_msgs(c, detect_info)
+        if timers.enabled:
+            age = rospy.get_rostime().to_sec() - detect_info['stamp']
+            timers.record('message_age', 1e3*age)
 
+        with self.lock:
+            updates = self.engine.process([detect_info])
+            self.publish_updates(updates)
 
-        #######################################################
-        # Append appropriate prior and measurements to lists. #
-        #######################################################
-        for cid in self.all_contacts:
-            # This will be a little memory hungry, but it will capture the
-            # entire state of all contacts at each time step. Needed to debug.
-            self.all_contacts[cid].evalTime = detect_info['header'].stamp.to_sec()
-
-            if cid not in self.all_contact_history:
-                self.all_contact_history[cid] = []
-
-            self.all_contact_history[cid].append(deepcopy(self.all_contacts[cid]))
-            c = self.all_contacts[cid]
-            
-            # Iterate over all contacts associated with the measurement.
-            if cid == contact_id:
-                c.xs.append(np.array([c.filter_bank.x[0], c.filter_bank.x[1]]))
-                c.zs.append(np.array([c.info['x_pos'], c.info['y_pos']]))
-                c.ps.append(c.filter_bank.P)
-            
-            else:
-                # For contacts not associated with the measurement, capture their
-                # predicted location for the measurement time. This is calcualted
-                # and stored in the "prior" parameters of the kalman filter.
-                # Capture only the values for the 1st order filter for simplicity.
-                # Why 1st and not 2nd? dunno.
-                c.xs.append(np.array([c.all_filters[0].x_prior[0], c.all_filters[0].x[1]]))
-                #c.xs.append(np.array([c.filter_bank.filters[0].x_prior[0], c.filter_bank.filters[0].x[1]]))
-                c.zs.append(np.array([np.nan, np.nan]))
-                c.ps.append(c.all_filters[0].P_prior)
-
-
-        ###################################
-        ###### DELETE STALE CONTACTS ######
-        ###################################
-        self.delete_stale_contacts()
+        timers.stop('callback', started)
 
 
     def run(self, args):
@@ -745,14 +666,58 @@ class ContactTracker:
         """
 
         rospy.init_node('tracker_debug', anonymous=True)
+
+        # The output stage owns the publishers, and builds and publishes the
+        # messages off the detect callback. It, and everything else the
+        # callbacks use, exists before any reconfigure, timer or subscriber
+        # can call them.
+        pub_contactmap = rospy.Publisher('/contact_map', Detect, queue_size=1)
+        pub_contacts = rospy.Publisher('/contact', Contact, queue_size=1)
+        self.output = contact_tracker.publisher.AsyncPublisher([pub_contactmap, pub_contacts],
+                                                              self.build_msgs,
+                                                              args.publish_queue_size,
+                                                              self.handle_output_error)
+
+        self.pub_diagnostics = rospy.Publisher('/diagnostics', DiagnosticArray, queue_size=1)
+        self.flight_recorder_dir = args.flight_recorder_dir
+
         srv = Server(contact_trackerConfig, self.reconfigure_callback)
+
+        # The map origin rarely changes, so check for it once a minute
+        # rather than on every published contact.
+        self.refresh_map_origin()
+        rospy.Timer(rospy.Duration(60.0), self.refresh_map_origin)
+
+        # Closes scans that no later detect arrives to close.
+        rospy.Timer(rospy.Duration(0.1), self.check_scan_timeout)
+
+        # Stale contacts are deleted, and duplicates merged, off the detect path.
+        self.start_stale_timer()
+        self.start_merge_timer()
+        self.start_diagnostics_timer()
+        self.timers_started = True
+
         rospy.Subscriber('/detects', Detect, self.callback)
 
-        self.pub_contactmap = rospy.Publisher('/contact_map', Detect, queue_size=1)
-        self.pub_contacts = rospy.Publisher('/contact', Contact, queue_size=1)
+        # The recent association decisions are written out on request, or
+        # on SIGUSR1 where the service cannot be reached.
+        rospy.Service('~dump_flight_recorder', Trigger, self.handle_dump_flight_recorder)
+        signal.signal(signal.SIGUSR1, self.handle_signal)
 
         rospy.spin()
 
+        self.output.shutdown()
+        rospy.loginfo('Output stage: %s' % self.output.stats())
+        rospy.loginfo('Association gates: %s' % self.engine.gate_counts)
+        rospy.loginfo('Tentative tracks: %s' % self.engine.tentative.counts)
+        rospy.loginfo('Merges: %s' % self.engine.merge_counts)
+        if self.engine.timers.enabled:
+            rospy.loginfo('Stage timings: %s' % self.engine.timers.summary())
+        trace = self.engine.trace
+        trace.flush()
+        if trace.written > 0:
+            rospy.loginfo('Debug trace: %d records written to %s' % (trace.written, trace.path))
+
         if args.plot_type == 'xs_ys':
             self.plot_x_vs_y(args.o)
         elif args.plot_type =='xs_times':
@@ -766,10 +731,19 @@ def main():
     arg_parser = argparse.ArgumentParser(description='Track contacts by applying Kalman filters to incoming detect messages. Optionally plot the results of the filter.')
     arg_parser.add_argument('-plot_type', type=str, choices=['xs_ys', 'xs_times', 'ellipses'], help='specify the type of plot to produce, if you want one')
     arg_parser.add_argument('-o', type=str, help='path to save the plot produced, default: tracker_plot, current working directory', default='tracker_plot')
+    arg_parser.add_argument('-publish_queue_size', type=int, help='number of contact updates that may wait to be published before the oldest is dropped, default: 100', default=100)
+    arg_parser.add_argument('-history_depth', type=int, help='number of detects to remember for each contact when plotting, default: 500 with -plot_type, otherwise 0', default=None)
+    arg_parser.add_argument('-flight_recorder_size', type=int, help='number of recent association decisions kept by the flight recorder, default: 20000', default=20000)
+    arg_parser.add_argument('-flight_recorder_dir', type=str, help='directory the flight recorder is dumped to, default: current working directory', default='.')
     args = arg_parser.parse_args()
 
+    # The history is only read by the plots, so none is kept without one.
+    if args.history_depth is None:
+        args.history_depth = 500 if args.plot_type is not None else 0
+
     try:
-        ct = ContactTracker()
+        ct = ContactTracker(args.history_depth, args.flight_recorder_size)
+        ct.engine.keep_retired_history = args.plot_type is not None
         ct.run(args)
 
     except rospy.ROSInterruptException:
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# Global nearest neighbour assignment of a scan of detects to contacts,
+# solved over the gated detect/contact pairs only.
+
+import math
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.stats import chi2
+
+
+def chi_square_gate_2d(confidence):
+    """
+    Return the squared Mahalanobis distance within which a 2-D normal
+    residual falls with the given probability, the chi-square quantile with
+    two degrees of freedom, -2 ln(1 - confidence).
+
+    Keyword arguments:
+    confidence -- probability that a residual of a true match passes the gate
+
+    Returns: the gate, infinite for a confidence of 1 or more
+    """
+
+    if confidence >= 1.0:
+        return float('inf')
+    return -2.0*math.log(1.0 - confidence)
+
+
+def chi_square_gate(confidence, dof):
+    """
+    Return the squared Mahalanobis distance within which a normal residual
+    of dof dimensions falls with the given probability, the chi-square
+    quantile with dof degrees of freedom.
+
+    Keyword arguments:
+    confidence -- probability that a residual of a true match passes the gate
+    dof -- dimension of the residual
+
+    Returns: the gate, infinite for a confidence of 1 or more
+    """
+
+    if confidence >= 1.0:
+        return float('inf')
+    return float(chi2.ppf(confidence, dof))
+
+
+def mahalanobis_sq_2d(residuals, S):
+    """
+    Compute r' S^-1 r for a stack of 2-D residuals and their 2x2
+    covariances, in closed form.
+
+    Keyword arguments:
+    residuals -- array of shape (n, 2)
+    S -- array of shape (n, 2, 2) of symmetric covariances
+
+    Returns: array of shape (n,)
+    """
+
+    a = S[:, 0, 0]
+    b = S[:, 0, 1]
+    d = S[:, 1, 1]
+    rx = residuals[:, 0]
+    ry = residuals[:, 1]
+    return (d*rx*rx - 2.0*b*rx*ry + a*ry*ry) / (a*d - b*b)
+
+
+def _find(parent, i):
+    """
+    Return the root of i in a union-find forest, compressing the path.
+    """
+
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    while parent[i] != root:
+        parent[i], i = root, parent[i]
+    return root
+
+
+def solve_assignment(detects, contacts, costs):
+    """
+    Assign each detect to at most one contact and each contact to at most
+    one detect so that the total cost of the assigned pairs is minimal.
+    Only the gated pairs given are candidates; any detect or contact may
+    also stay unassigned at no cost, so only pairs with negative cost are
+    ever worth assigning.
+
+    The gated pairs are split into connected components and each component
+    is solved on its own, so the work grows with the number of gated pairs
+    rather than with detects x contacts.
+
+    Keyword arguments:
+    detects -- sequence holding the detect index of each gated pair
+    contacts -- sequence holding the contact key of each gated pair
+    costs -- sequence holding the cost of each gated pair
+
+    Returns: dictionary mapping detect index to assigned contact key
+    """
+
+    if len(costs) == 0:
+        return {}
+
+    # Number the contacts after the detects so both live in one forest.
+    detect_ids = {}
+    contact_ids = {}
+    for d in detects:
+        if d not in detect_ids:
+            detect_ids[d] = len(detect_ids)
+    for c in contacts:
+        if c not in contact_ids:
+            contact_ids[c] = len(contact_ids)
+
+    nd = len(detect_ids)
+    parent = list(range(nd + len(contact_ids)))
+    for d, c in zip(detects, contacts):
+        a = _find(parent, detect_ids[d])
+        b = _find(parent, nd + contact_ids[c])
+        if a != b:
+            parent[a] = b
+
+    components = {}
+    for k, d in enumerate(detects):
+        components.setdefault(_find(parent, detect_ids[d]), []).append(k)
+
+    assignment = {}
+    for pairs in components.values():
+        if len(pairs) == 1:
+            k = pairs[0]
+            if costs[k] < 0:
+                assignment[detects[k]] = contacts[k]
+            continue
+
+        rows = []
+        cols = []
+        row_of = {}
+        col_of = {}
+        for k in pairs:
+            if detects[k] not in row_of:
+                row_of[detects[k]] = len(rows)
+                rows.append(detects[k])
+            if contacts[k] not in col_of:
+                col_of[contacts[k]] = len(cols)
+                cols.append(contacts[k])
+
+        # One extra "unassigned" column per detect, free for its own detect.
+        # Pairs that were not gated cost more than leaving everything
+        # unassigned, so the solver never picks them.
+        forbidden = 1.0 + sum(abs(costs[k]) for k in pairs)
+        C = np.full((len(rows), len(cols) + len(rows)), forbidden)
+        C[np.arange(len(rows)), len(cols) + np.arange(len(rows))] = 0.0
+        for k in pairs:
+            i = row_of[detects[k]]
+            j = col_of[contacts[k]]
+            C[i, j] = min(C[i, j], costs[k])
+
+        for i, j in zip(*linear_sum_assignment(C)):
+            if j < len(cols) and C[i, j] < 0:
+                assignment[rows[i]] = cols[j]
+
+    return assignment
@@ -14,9 +14,10 @@ import math
 #from filterpy.kalman import KalmanFilter
 #from filterpy.kalman import update
 #from filterpy.kalman import predict
-from filterpy.kalman import IMMEstimator
 #from filterpy.common import Q_discrete_white_noise
-from filterpy.common import Q_continuous_white_noise
+
+from contact_tracker.imm import ContactIMMEstimator
+from contact_tracker.model_cache import PROCESS_MODELS
 
 
 class Contact:
@@ -30,7 +31,7 @@ class Contact:
         
         detect_info -- dictionary containing data from the detect message being used to create this contact
         all_filters -- list containing unique KalmanFilter objects for this specific contact object
-        timestamp -- header from the detect message 
+        timestamp -- stamp of the detect that created this contact, kept as its name
         """
 
         # Variables for the IMM Estimator
@@ -56,26 +57,21 @@ class Contact:
        
         # Variables that keep track of time
         self.dt = 1.0 
-        self.last_measured = detect_info['header'].stamp
+        self.last_measured = detect_info['stamp']
         self.last_xpos = .0
         self.last_ypos = .0
         self.last_xvel = .0
         self.last_yvel = .0
 
-        # Variables that keep track of data for plotting purposes
-        self.xs = []
-        self.zs = []
-        self.ps = []
-        self.times = []
-        
         # Other important variables
         self.info = detect_info
-        self.id = timestamp 
+        self.id = None        # handle from the ContactRegistry
+        self.name = str(timestamp)  # stable external id, published as Contact.name
         self.Z = None
         
         # Initialize the filters and setup the IMM Estimator
         self.init_filters()
-        self.filter_bank = IMMEstimator(all_filters, self.mu, self.M)
+        self.filter_bank = ContactIMMEstimator(all_filters, self.mu, self.M)
 
         
         # Process noise model uncertainty. 
@@ -85,115 +81,69 @@ class Contact:
     def set_Q(self):
         """
         Recompute the value of Q for the Kalman filters in this contact.
-
-        Keyword arguments:
-        contact -- contact object for which to recompute Q
+        The matrices come from the shared process model cache and are
+        read-only. The Q of the constant velocity filter is zero-padded
+        to 6x6 to match that of the constant acceleration filter.
         """
         
         for kf in self.all_filters:
             if kf.filter_type == 'first': 
-                # All Q matrices have to have matching dimensions (6x6 in our case).
-                # So we have to zero-pad the Q matrix of the constant velocity filter
-                # as it is naturally a 4x4.
-                empty_array = np.zeros([6, 6])
-                #noise = Q_discrete_white_noise(dim=2, var=self.vel_var, dt=contact.dt, block_size=2, order_by_dim=False) 
-                noise = Q_continuous_white_noise(dim=2, 
-                                                 spectral_density=self.vel_var,
-                                                 dt=self.dt,
-                                                 block_size=2,
-                                                 order_by_dim=False)
-                empty_array[:noise.shape[0],:noise.shape[1]] = noise  
-                kf.Q = empty_array
+                kf.Q = PROCESS_MODELS.get('first', self.dt, self.vel_var)[1]
             
             elif kf.filter_type == 'second':
-                #kf.Q = Q_discrete_white_noise(dim=3, var=self.acc_var, dt=contact.dt, block_size=2, order_by_dim=False) 
-                kf.Q = Q_continuous_white_noise(dim=3,
-                                                spectral_density=self.acc_var,
-                                                dt=self.dt,
-                                                block_size=2,
-                                                order_by_dim=False)
+                kf.Q = PROCESS_MODELS.get('second', self.dt, self.acc_var)[1]
 
     def init_filters(self):
         """
         Initialize each filter in this contact's filter bank.
         """
-        
-        
 
-        
-        for i in range(0, len(self.all_filters)):
-            
-            if not math.isnan(self.info['x_pos']) and math.isnan(self.info['x_vel']):
-                print('Instantiating ', self.all_filters[i].filter_type, ' Kalman filter with position but without velocity')
-                self.all_filters[i].x = np.array([self.info['x_pos'], self.info['y_pos'], .0, .0, .0, .0]).T
-                self.all_filters[i].F = np.array([
-                    [1., .0, self.dt, .0, 0.5*self.dt**2, .0],
-                    [.0, 1., .0, self.dt, .0, 0.5*self.dt**2],
-                    [.0, .0, 1., .0, self.dt, .0],
-                    [.0, .0, .0, 1., .0, self.dt],
-                    [.0, .0, .0, .0, .0, .0],
-                    [.0, .0, .0, .0, .0, .0]])
-
-                
-                '''
-                # All Q matrices have to have matching dimensions (6x6 in our case).
-                # So we have to zero-pad the Q matrix of the constant velocity filter
-                # as it is naturally a 4x4.
-                empty_array = np.zeros([6, 6])
-                
-                # And the process noise variance/time is different for first
-                # and second order filters, since the variance here is that of 
-                # a zero velocity and zero velocity acceleration model respectively. 
-                if self.all_filters[i].filter_type == 'first':
-                    noise = Q_continuous_white_noise(dim=2, 
-                                                   spectral_density= self.all_filters[i].R, 
-                                                   dt=self.dt, 
-                                                   block_size=2, 
-                                                   order_by_dim=False)
-                elif self.all_filters[i].filter_type == 'second':
-                    noise = Q_continuous_white_noise(dim=2, 
-                                                   spectral_density= self.constantAcceleration_VAR, 
-                                                   dt=self.dt, 
-                                                   block_size=2, 
-                                                   order_by_dim=False)
-                    
-                empty_array[:noise.shape[0],:noise.shape[1]] = noise  
-                self.all_filters[i].Q = empty_array
-                '''
-            
-            elif not math.isnan(self.info['x_pos']) and not math.isnan(self.info['x_vel']):
-                print('Instantiating ', self.all_filters[i].filter_type, ' order Kalman filter with velocity and position')
-                self.all_filters[i].x = np.array([self.info['x_pos'], self.info['y_pos'], self.info['x_vel'], self.info['y_vel'], .0, .0]).T
-                self.all_filters[i].F = np.array([
-                    [1., .0, self.dt, .0, 0.5*self.dt**2, .0],
-                    [.0, 1., .0, self.dt, .0, 0.5*self.dt**2],
-                    [.0, .0, 1., .0, self.dt, .0],
-                    [.0, .0, .0, 1., .0, self.dt],
-                    [.0, .0, .0, .0, 1., .0],
-                    [.0, .0, .0, .0, .0, 1.]])
-
-            '''
-                # And the process noise variance/time is different for first
-                # and second order filters, since the variance here is that of 
-                # a zero velocity and zero velocity acceleration model respectively. 
-                if self.all_filters[i].filter_type == 'first':
-                    noise = Q_discrete_white_noise(dim=3, var = self.constantVelocity_VAR, 
-                                                   dt=self.dt, block_size=2, order_by_dim=False)
-                elif self.all_filters[i].filter_type == 'second':
-                    noise = Q_discrete_white_noise(dim=3, var = self.constantAcceleration_VAR, 
-                                                   dt=self.dt, block_size=2, order_by_dim=False)
-            '''
-            
-            self.set_Q()            
-            
-            # Define the state covariance matrix.
-            self.all_filters[i].P = np.array([
-                [100.0*self.info['pos_covar'][0], .0, .0, .0, .0, .0],
-                [.0, 100.0*self.info['pos_covar'][6], .0, .0, .0, .0],
-                [.0, .0, 5.0**2, .0, .0, .0],
-                [.0, .0, .0, 5.0**2, .0, .0],
-                [.0, .0, .0, .0, 1.**2, .0],
-                [.0, .0, .0, .0, .0, 1.**2]])
+        self.init_state()
+        self.set_Q()
+
+
+    def init_state(self):
+        """
+        Set the x, F and P of each filter in this contact's filter bank from
+        the detect in self.info. They do not depend on the filter, so they
+        are built once and every filter gets its own copy of x and P.
+        """
+
+        x = None
+        if not math.isnan(self.info['x_pos']) and math.isnan(self.info['x_vel']):
+            x = np.array([self.info['x_pos'], self.info['y_pos'], .0, .0, .0, .0]).T
+            F = np.array([
+                [1., .0, self.dt, .0, 0.5*self.dt**2, .0],
+                [.0, 1., .0, self.dt, .0, 0.5*self.dt**2],
+                [.0, .0, 1., .0, self.dt, .0],
+                [.0, .0, .0, 1., .0, self.dt],
+                [.0, .0, .0, .0, .0, .0],
+                [.0, .0, .0, .0, .0, .0]])
+
+        elif not math.isnan(self.info['x_pos']) and not math.isnan(self.info['x_vel']):
+            x = np.array([self.info['x_pos'], self.info['y_pos'], self.info['x_vel'], self.info['y_vel'], .0, .0]).T
+            F = np.array([
+                [1., .0, self.dt, .0, 0.5*self.dt**2, .0],
+                [.0, 1., .0, self.dt, .0, 0.5*self.dt**2],
+                [.0, .0, 1., .0, self.dt, .0],
+                [.0, .0, .0, 1., .0, self.dt],
+                [.0, .0, .0, .0, 1., .0],
+                [.0, .0, .0, .0, .0, 1.]])
+
+        # Define the state covariance matrix.
+        P = np.array([
+            [100.0*self.info['pos_covar'][0], .0, .0, .0, .0, .0],
+            [.0, 100.0*self.info['pos_covar'][6], .0, .0, .0, .0],
+            [.0, .0, 5.0**2, .0, .0, .0],
+            [.0, .0, .0, 5.0**2, .0, .0],
+            [.0, .0, .0, .0, 1.**2, .0],
+            [.0, .0, .0, .0, .0, 1.**2]])
+
+        for kf in self.all_filters:
+            if x is not None:
+                kf.x = x.copy()
+                kf.F = F
+            kf.P = P.copy()
 
 
     def set_Z(self, detect_info):
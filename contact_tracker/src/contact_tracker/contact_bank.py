@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# Class to keep the filter states of every Contact in stacked arrays so
+# that the priors of all contacts can be predicted in a few array operations.
+
+import numpy as np
+
+from contact_tracker.model_cache import MODEL_INDEX
+from contact_tracker.model_cache import PROCESS_MODELS
+from contact_tracker.model_cache import predict_priors
+
+
+class ContactBank:
+    """
+    Class to hold the x and P of every contact's filter bank in stacked arrays.
+
+    Row i of each array belongs to the contact in row i of the
+    ContactRegistry the bank is made for, whose packed list of contacts
+    the bank shares as self.contacts. The bank must be told about every
+    contact the registry adds or removes, and about every change to a
+    contact's posterior state, which only happens when a contact is created
+    or updated with a measurement.
+    """
+
+    def __init__(self, registry, capacity=64, process_models=None):
+        """
+        Define the constructor.
+
+        registry -- the ContactRegistry holding the contacts
+        capacity -- number of contacts to allocate room for up front
+        process_models -- ProcessModelCache whose time step rounding to follow,
+                          default the one shared by the whole process
+        """
+
+        if process_models is None:
+            process_models = PROCESS_MODELS
+
+        self.models = process_models
+        self.n = 0
+        self.registry = registry
+        self.contacts = registry.contacts
+        self._allocate(capacity)
+
+
+    def _allocate(self, capacity):
+        """
+        (Re)allocate the stacked arrays, keeping the rows already in use.
+
+        Keyword arguments:
+        capacity -- number of contacts the arrays should hold
+        """
+
+        x = np.zeros((capacity, 2, 6))
+        P = np.zeros((capacity, 2, 6, 6))
+        last_measured = np.zeros(capacity)
+        spectral_density = np.zeros((capacity, 2))
+        mu = np.zeros((capacity, 2))
+
+        if self.n > 0:
+            x[:self.n] = self.x[:self.n]
+            P[:self.n] = self.P[:self.n]
+            last_measured[:self.n] = self.last_measured[:self.n]
+            spectral_density[:self.n] = self.spectral_density[:self.n]
+            mu[:self.n] = self.mu[:self.n]
+
+        self.x = x
+        self.P = P
+        self.last_measured = last_measured
+        self.spectral_density = spectral_density
+        self.mu = mu
+        self.capacity = capacity
+
+
+    def __len__(self):
+        return self.n
+
+
+    def add(self, contact):
+        """
+        Add a newly created contact to the bank, in the row the registry
+        gave it. Must be called after the contact is added to the registry.
+
+        Keyword arguments:
+        contact -- the Contact object to add
+        """
+
+        if self.n == self.capacity:
+            self._allocate(2*self.capacity)
+
+        i = self.registry.row(contact.id)
+        self.n += 1
+
+        for kf in contact.filter_bank.filters:
+            m = MODEL_INDEX[kf.filter_type]
+            if kf.filter_type == 'first':
+                self.spectral_density[i, m] = contact.vel_var
+            else:
+                self.spectral_density[i, m] = contact.acc_var
+
+        self.sync(contact)
+
+
+    def sync(self, contact):
+        """
+        Copy a contact's posterior filter states, mode probabilities and time
+        of last measurement into the bank. Must be called after every update
+        of the contact.
+
+        Keyword arguments:
+        contact -- the Contact object to copy from
+        """
+
+        i = self.registry.row(contact.id)
+        for k, kf in enumerate(contact.filter_bank.filters):
+            m = MODEL_INDEX[kf.filter_type]
+            self.x[i, m] = kf.x
+            self.P[i, m] = kf.P
+            self.mu[i, m] = contact.filter_bank.mu[k]
+
+        self.last_measured[i] = contact.last_measured
+
+
+    def remove(self, contact_id):
+        """
+        Remove a contact from the bank, moving the last row into its place
+        as the registry moves the last contact. Must be called before the
+        contact is removed from the registry.
+
+        Keyword arguments:
+        contact_id -- handle of the contact to remove
+        """
+
+        i = self.registry.row(contact_id)
+        last = self.n - 1
+
+        if i != last:
+            self.x[i] = self.x[last]
+            self.P[i] = self.P[last]
+            self.last_measured[i] = self.last_measured[last]
+            self.spectral_density[i] = self.spectral_density[last]
+            self.mu[i] = self.mu[last]
+
+        self.n = last
+
+
+    def predict_priors(self, stamp):
+        """
+        Predict the prior of every filter of every contact at the time of
+        the measurement into self.x_prior and self.P_prior, and the time
+        since each contact was last measured into self.dt. Nothing is handed
+        to the contacts or their filters: bind() does that for the rows the
+        measurement is tested against.
+
+        As with ContactKalmanFilter.predict_prior, this does NOT touch the
+        x and P of any filter.
+
+        Keyword arguments:
+        stamp -- time of the measurement, in seconds
+        """
+
+        n = self.n
+        if n == 0:
+            return
+
+        self.dt, self.x_prior, self.P_prior = self._predict(slice(0, n), stamp)
+
+
+    def predict_rows(self, rows, stamp):
+        """
+        Same as predict_priors, but for some rows only. Their priors and dt
+        are written into the arrays of the last predict_priors, in place.
+
+        Keyword arguments:
+        rows -- array of the rows to predict
+        stamp -- time of the measurement, in seconds
+        """
+
+        if len(rows) == 0:
+            return
+        self.dt[rows], self.x_prior[rows], self.P_prior[rows] = self._predict(rows, stamp)
+
+
+    def bind(self, rows):
+        """
+        Hand the filters of some rows views of their own x_prior and P_prior,
+        and the contacts of the rows their dt, as last predicted. The F and
+        Q the filters need for their own predict are looked up once a
+        contact is associated.
+
+        Keyword arguments:
+        rows -- iterable of the rows
+
+        Returns: list of the contacts of the rows
+        """
+
+        contacts = []
+        for i in rows:
+            c = self.contacts[i]
+            c.dt = self.dt[i]
+            for kf in c.filter_bank.filters:
+                m = MODEL_INDEX[kf.filter_type]
+                kf.x_prior = self.x_prior[i, m]
+                kf.P_prior = self.P_prior[i, m]
+            contacts.append(c)
+
+        return contacts
+
+
+    def predict_states(self, rows, stamp):
+        """
+        Predict the filters of some rows to a common time. Rows last measured
+        after that time are left where they are. Nothing is handed to the
+        contacts or their filters.
+
+        Keyword arguments:
+        rows -- slice or list of the rows to predict
+        stamp -- time to predict to, in seconds
+
+        Returns: x of shape (k, 2, 6) and P of shape (k, 2, 6, 6) of the
+        filters of each row
+        """
+
+        dt = np.maximum(stamp - self.last_measured[rows], 0.0)
+        return predict_priors(self.models.quantize(dt),
+                              self.spectral_density[rows],
+                              self.x[rows], self.P[rows])
+
+
+    def predict_combined(self, stamp):
+        """
+        Predict every filter of every contact to a common time, and combine
+        the filters of each contact weighted by its mode probabilities, as
+        the IMM estimator combines them. Nothing is handed to the contacts
+        or their filters.
+
+        Keyword arguments:
+        stamp -- time to predict to, in seconds
+
+        Returns: x of shape (n, 6) and P of shape (n, 6, 6) of the combined
+        estimate of each contact
+        """
+
+        n = self.n
+        xs, Ps = self.predict_states(slice(0, n), stamp)
+
+        # x = sum_m mu_m x_m, P = sum_m mu_m ((x_m - x)(x_m - x)' + P_m)
+        mu = self.mu[:n]
+        x = np.einsum('nm,nmi->ni', mu, xs)
+        y = xs - x[:, np.newaxis, :]
+        P = np.einsum('nm,nmij->nij', mu, Ps + y[..., :, np.newaxis]*y[..., np.newaxis, :])
+        return x, P
+
+
+    def predict_contact(self, contact, stamp):
+        """
+        Predict the priors of a single contact with predict_rows, and bind them.
+
+        Keyword arguments:
+        contact -- the Contact object to predict
+        stamp -- time of the measurement, in seconds
+        """
+
+        i = self.registry.row(contact.id)
+        self.predict_rows([i], stamp)
+        self.bind([i])
+
+
+    def _predict(self, rows, stamp):
+        """
+        Predict the priors of some rows.
+
+        Keyword arguments:
+        rows -- slice or array of the rows to predict
+        stamp -- time of the measurement, in seconds
+
+        Returns: dt, x_prior and P_prior arrays of the rows
+        """
+
+        # Time steps are rounded as the process model cache rounds them, so
+        # the priors match the F and Q the filters later predict with.
+        dt = stamp - self.last_measured[rows]
+        x_prior, P_prior = predict_priors(self.models.quantize(dt),
+                                          self.spectral_density[rows],
+                                          self.x[rows], self.P[rows])
+        return dt, x_prior, P_prior
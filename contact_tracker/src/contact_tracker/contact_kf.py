@@ -15,7 +15,94 @@ from filterpy.common import Q_continuous_white_noise
 import numpy as np
 from numpy import zeros
 
-DEBUG = True 
+from contact_tracker.innovation import INNOVATION_KERNELS
+from contact_tracker.innovation import LOG_2PI
+from contact_tracker.innovation import make_innovation
+from contact_tracker.model_cache import PROCESS_MODELS
+from contact_tracker.model_cache import MEASUREMENT_MODELS
+from contact_tracker.model_cache import H_POSITION
+from contact_tracker.model_cache import H_POSITION_VELOCITY
+
+
+class UpdateBuffers:
+    """
+    Class to hold the arrays that one filter's in-place update writes into
+    for one dimension of measurement: the residual, the system uncertainty,
+    its inverse, the gain and the posterior. It also holds the views of the
+    filter's x and P that the update reads, made again only when the filter
+    is given another x or P.
+    """
+
+    def __init__(self, dim_x, dim_z):
+        """
+        Define the constructor.
+
+        dim_x -- dimension of the state
+        dim_z -- dimension of the measurement
+        """
+
+        self.dim_z = dim_z
+        self.y = np.zeros(dim_z)
+        self.S = np.zeros((dim_z, dim_z))
+        self.SI = np.zeros((dim_z, dim_z))
+        self.SI_y = np.zeros(dim_z)
+        self.PHT_T_copy = np.zeros((dim_z, dim_x))
+        self.KT = np.zeros((dim_z, dim_x))
+        self.K = self.KT.T
+        self.KR = np.zeros((dim_x, dim_z))
+        self.x_post = np.zeros(dim_x)
+        self.P_post = np.zeros((dim_x, dim_x))
+
+        self.x = None
+        self.P = None
+
+
+    def bind(self, x, P):
+        """
+        Make the views of x and P the update reads, unless they are already
+        of these very arrays. H picks the leading dim_z states, so Hx, PH'
+        and HPH' are slices of x and P.
+
+        Keyword arguments:
+        x -- the filter's state
+        P -- the filter's covariance
+        """
+
+        if x is not self.x:
+            self.x = x
+            self.Hx = x[:self.dim_z]
+        if P is not self.P:
+            self.P = P
+            self.PHT_T = P[:, :self.dim_z].T
+            self.HPHT = P[:self.dim_z, :self.dim_z]
+
+
+class JosephScratch:
+    """
+    Class to hold the temporaries of the Joseph form covariance update.
+    Their values do not outlive an update, so one set is shared by every
+    filter with the same dimension of state. Filters are updated one at a
+    time, under the tracker's lock.
+    """
+
+    def __init__(self, dim_x):
+        """
+        Define the constructor.
+
+        dim_x -- dimension of the state
+        """
+
+        self.Ky = np.zeros(dim_x)
+        self.KH = np.zeros((dim_x, dim_x))
+        self.I_KH = np.zeros((dim_x, dim_x))
+        self.I_KH_T = self.I_KH.T
+        self.I_KH_P = np.zeros((dim_x, dim_x))
+        self.KRK = np.zeros((dim_x, dim_x))
+
+
+# Joseph form temporaries, by dimension of state.
+JOSEPH_SCRATCH = {}
+
 
 class ContactKalmanFilter(KalmanFilter):
     """
@@ -34,6 +121,27 @@ class ContactKalmanFilter(KalmanFilter):
         self.filter_type = filter_type 
         self.bayes_factor = 0.0
         self.ll = 0.0
+        self.innovation = None
+        self.update_buffers = {}
+
+
+    def copy(self):
+        """
+        Returns: a new filter with the same values as this one. Every
+        writeable array is copied, while read-only ones, such as the
+        matrices from the model caches, are shared.
+        """
+
+        state = dict(vars(self))
+        for name, value in state.items():
+            if isinstance(value, np.ndarray) and value.flags.writeable:
+                state[name] = value.copy()
+
+        kf = self.__class__.__new__(self.__class__)
+        kf.__dict__ = state
+        kf.innovation = None
+        kf.update_buffers = {}
+        return kf
 
 
     def predict_prior(self, u=None, B=None, F=None, Q=None):
@@ -81,6 +189,170 @@ class ContactKalmanFilter(KalmanFilter):
         self.P_prior = self._alpha_sq * np.dot(np.dot(F, self.P), F.T) + Q
 
 
+    def get_innovation(self, z, x=None, P=None, H=None, R=None):
+        """
+        Return the Innovation of this filter against the measurement z,
+        reusing the last one if it was computed from the very same arrays.
+        By default the measurement is compared against the prior.
+
+        Keyword arguments:
+        z -- the measurement
+        x -- state to compare against, default self.x_prior
+        P -- covariance of that state, default self.P_prior
+        H -- measurement function, default self.H
+        R -- measurement noise matrix, default self.R
+        """
+
+        if x is None:
+            x = self.x_prior
+        if P is None:
+            P = self.P_prior
+        if H is None:
+            H = self.H
+        if R is None:
+            R = self.R
+
+        inn = self.innovation
+        if inn is None or not inn.is_for(H, x, P, R, z):
+            inn = make_innovation(H, x, P, R, z)
+            self.innovation = inn
+
+        return inn
+
+
+    def update(self, z, R=None, H=None):
+        """
+        Add a new measurement (z) to the Kalman filter. Same as
+        KalmanFilter.update, except that the residual, system uncertainty
+        and likelihood come from an Innovation, so S is inverted
+        once, and that the dimension of z follows H.
+
+        Position and position plus velocity measurements of a filter whose
+        x is a flat array are incorporated by update_in_place() instead.
+
+        Parameters
+        ----------
+
+        z : array_like
+            measurement for this update.
+
+        R : np.array, scalar, or None
+            Optionally provide R to override the measurement noise for this
+            one call, otherwise  self.R will be used.
+
+        H : np.array, or None
+            Optionally provide H to override the measurement function for this
+            one call, otherwise self.H will be used.
+        """
+
+        if z is None or H is not None or (R is not None and np.isscalar(R)):
+            KalmanFilter.update(self, z, R, H)
+            return
+
+        if (self.H is H_POSITION or self.H is H_POSITION_VELOCITY) and self.x.ndim == 1:
+            self.update_in_place(z, self.R if R is None else R)
+            return
+
+        inn = self.get_innovation(z, self.x, self.P, R=R)
+        H = inn.H
+        R = inn.R
+
+        self.y = inn.y
+        self.S = inn.S
+        self.K = inn.gain()
+
+        # x = x + Ky
+        self.x = self.x + np.dot(self.K, self.y)
+
+        # P = (I-KH)P(I-KH)' + KRK'
+        I_KH = self._I - np.dot(self.K, H)
+        self.P = np.dot(np.dot(I_KH, self.P), I_KH.T) + np.dot(np.dot(self.K, R), self.K.T)
+
+        self._log_likelihood = inn.log_likelihood()
+        self._likelihood = None
+        self._mahalanobis = math.sqrt(inn.mahalanobis_sq())
+
+        # save measurement and posterior state
+        self.z = z
+        self.x_post = self.x.copy()
+        self.P_post = self.P.copy()
+
+
+    def update_in_place(self, z, R):
+        """
+        Incorporate a position or a position plus velocity measurement
+        without allocating any array. x and P are written in place, and y,
+        S, SI, K and the posterior copies are arrays of this filter that
+        are allocated on its first update with each dimension of measurement.
+        The products are those of update(), in the same order, so the
+        results are the same to the last bit.
+
+        Keyword arguments:
+        z -- the measurement, of the dimension of self.H
+        R -- the measurement noise matrix
+        """
+
+        H = self.H
+        dim_z = H.shape[0]
+        b = self.update_buffers.get(dim_z)
+        if b is None:
+            b = self.update_buffers[dim_z] = UpdateBuffers(self.dim_x, dim_z)
+        t = JOSEPH_SCRATCH.get(self.dim_x)
+        if t is None:
+            t = JOSEPH_SCRATCH[self.dim_x] = JosephScratch(self.dim_x)
+        b.bind(self.x, self.P)
+
+        # y = z - Hx, S = HPH' + R
+        for k in range(dim_z):
+            b.y[k] = z[k]
+        b.y -= b.Hx
+        np.copyto(b.S, b.HPHT)
+        b.S += R
+        det_S = INNOVATION_KERNELS[dim_z].invert(b.S, b.SI)
+
+        # K = PH' S^-1, as the transpose of S^-1 HP'. np.dot copies a
+        # strided operand, so it is given a contiguous copy.
+        np.copyto(b.PHT_T_copy, b.PHT_T)
+        np.dot(b.SI, b.PHT_T_copy, out=b.KT)
+
+        # Log likelihood and Mahalanobis distance of the residual
+        np.dot(b.SI, b.y, out=b.SI_y)
+        mahalanobis_sq = float(np.dot(b.y, b.SI_y))
+
+        # x = x + Ky
+        np.dot(b.K, b.y, out=t.Ky)
+        self.x += t.Ky
+
+        # P = (I-KH)P(I-KH)' + KRK'
+        np.dot(b.K, H, out=t.KH)
+        np.subtract(self._I, t.KH, out=t.I_KH)
+        np.dot(t.I_KH, self.P, out=t.I_KH_P)
+        np.dot(b.K, R, out=b.KR)
+        np.dot(b.KR, b.KT, out=t.KRK)
+        np.dot(t.I_KH_P, t.I_KH_T, out=self.P)
+        self.P += t.KRK
+
+        self.y = b.y
+        self.S = b.S
+        self.SI = b.SI
+        self.K = b.K
+
+        self._log_likelihood = -0.5*(mahalanobis_sq + math.log(det_S) + dim_z*LOG_2PI)
+        self._likelihood = None
+        self._mahalanobis = math.sqrt(mahalanobis_sq)
+
+        # x and P changed under any innovation computed from them.
+        self.innovation = None
+
+        # save measurement and posterior state. z is not copied, as
+        # measurements are replaced rather than changed.
+        self.z = z
+        np.copyto(b.x_post, self.x)
+        np.copyto(b.P_post, self.P)
+        self.x_post = b.x_post
+        self.P_post = b.P_post
+
+
     def get_log_likelihood(self):
         """
         Returns: Log Likelihood of this filter.
@@ -103,12 +375,9 @@ class ContactKalmanFilter(KalmanFilter):
         contact -- the contact object for which to retrieve the likelihood given the current measurement. 
         """
 
-        S = np.dot(self.H, np.dot(self.P_prior, self.H.T)) + self.R
-        invS = np.linalg.inv(S) 
+        inn = self.get_innovation(contact.Z)
 
-        ZHX0 = contact.Z - np.dot(self.H, self.x_prior) 
-
-        log_likelihoodM0 = -0.5*(np.dot(ZHX0.T, np.dot(invS, ZHX0)))
+        log_likelihoodM0 = -0.5*inn.mahalanobis_sq()
         self.ll = log_likelihoodM0
 
 
@@ -166,11 +435,12 @@ class ContactKalmanFilter(KalmanFilter):
         # the uncertainty of the model, P, propagated to the measurement
         # time and the uncertaint of the measurement, R.
         # Note, if K.predict() has already been called, the result of this
-        # calculation would be available in K.S. Calculating it explicitly
-        # here allows us to delay propagating the model in the event that
-        # we decide not the include the measurement.
-        S = np.dot(self.H, np.dot(self.P_prior, self.H.T)) + self.R
-        invS = np.linalg.inv(S) # Error is occurring because it's the same transposed.
+        # calculation would be available in K.S. Calculating it from the
+        # prior here allows us to delay propagating the model in the event
+        # that we decide not the include the measurement. The innovation
+        # holds S and its factorization, and is shared with
+        # set_log_likelihood.
+        inn = self.get_innovation(contact.Z)
 
         # h will be an offset from the current model providing an alternative
         # hypothesis. It is calculated as testfactor * model's uncertainty
@@ -191,36 +461,20 @@ class ContactKalmanFilter(KalmanFilter):
         # ensure the model shifts away from the measurement values relative to
         # the estimate. This calcualtion is done in piece-meal steps to
         # make it more clear and easier to debug.
-        ZHX0 = contact.Z - np.dot(self.H, self.x_prior) # shouldn't this be abs?
-        '''print('Z: ', contact.Z)
-        print('x: ', self.x)'''
+        ZHX0 = inn.y # shouldn't this be abs?
 
         # Here we need to apply a different alternate hypothesis for each
         # state variable depending on where the measurement falls (< or >)
         # relative to it.
-        multiplier = [1.0 if x < 0 else -1.0 for x in (contact.Z - np.dot(self.H, self.x_prior))]
-        ZHX1 = np.abs(contact.Z - np.dot(self.H, self.x_prior)) + multiplier * np.dot(self.H, h)
+        multiplier = np.where(ZHX0 < 0, 1.0, -1.0)
+        ZHX1 = np.abs(ZHX0) + multiplier * np.dot(self.H, h)
 
-        log_likelihoodM0 = -0.5*(np.dot(ZHX0.T, np.dot(invS, ZHX0)))
-        log_likelihoodM1 = -0.5*(np.dot(ZHX1.T, np.dot(invS, ZHX1)))
+        # Both quadratic forms with inv(S) in one call.
+        d2 = inn.quadratic_forms(np.column_stack((ZHX0, ZHX1)))
+        log_likelihoodM0 = -0.5*d2[0]
+        log_likelihoodM1 = -0.5*d2[1]
 
         # Calculate the Log Bayes Factor
-        '''print('_________________________________________')
-        print('invS: ', invS)
-        print('+++++++++++++++++++++++++++++++++++++++++')
-        print('ZHX0: ', ZHX0)
-        print('invS * ZHX0: ', np.dot(invS, ZHX0))
-        print('np.dot(ZHX0, ans): ', np.dot(ZHX0.T, np.dot(invS, ZHX0))) 
-        print('-0.5*ans: ', np.dot(ZHX0.T, np.dot(invS, ZHX0)))
-        print('log_likelihoodM0: ', log_likelihoodM0)
-        print('+++++++++++++++++++++++++++++++++++++++++')
-        print('ZHX1: ', ZHX1)
-        print('invS * ZHX1: ', np.dot(invS, ZHX1))
-        print('np.dot(ZHX1, ans): ', np.dot(ZHX1.T, np.dot(invS, ZHX1)))  
-        print('-0.5*ans: ', np.dot(ZHX1.T, np.dot(invS, ZHX1))) 
-        print('loglikelihoodM1: ', log_likelihoodM1)
-        print('+++++++++++++++++++++++++++++++++++++++++')
-        '''
         log_BF = log_likelihoodM0 - log_likelihoodM1
 
         self.bayes_factor = log_BF
@@ -261,7 +515,9 @@ class ContactKalmanFilter(KalmanFilter):
     def set_F(self, contact):
         """
         Recompute the value of F (process model matrix) for the Kalman 
-        filters in this Contact.
+        filters in this Contact. The matrices come from the shared process
+        model cache and are read-only. The first order filter's F zeroes
+        the acceleration.
 
         Keyword arguments:
         contact -- contact object for which to recompute F 
@@ -269,76 +525,41 @@ class ContactKalmanFilter(KalmanFilter):
 
         for kf in contact.filter_bank.filters:
             if kf.filter_type == 'first':
-                kf.F = np.array([
-                    [1., .0, contact.dt, .0, 0.5*contact.dt**2, .0],
-                    [.0, 1., .0, contact.dt, .0, 0.5*contact.dt**2],
-                    [.0, .0, 1., .0, contact.dt, .0],
-                    [.0, .0, .0, 1., .0, contact.dt],
-                    [.0, .0, .0, .0, .0, .0],
-                    [.0, .0, .0, .0, .0, .0]])
+                kf.F = PROCESS_MODELS.get('first', contact.dt, contact.vel_var)[0]
                 
             elif kf.filter_type == 'second':
-                kf.F = np.array([
-                    [1., .0, contact.dt, .0, 0.5*contact.dt**2, .0],
-                    [.0, 1., .0, contact.dt, .0, 0.5*contact.dt**2],
-                    [.0, .0, 1., .0, contact.dt, .0],
-                    [.0, .0, .0, 1., .0, contact.dt],
-                    [.0, .0, .0, .0, 1., .0],
-                    [.0, .0, .0, .0, .0, 1.]])
+                kf.F = PROCESS_MODELS.get('second', contact.dt, contact.acc_var)[0]
 
 
     def set_H(self, contact, detect_info):
         """
         Recompute the values of H for the Kalman filters in this Contact.
+        H is a read-only matrix shared through the measurement model cache.
 
         Keyword arguments:
         contact -- contact object for which to recompute H 
+        detect_info -- the dictionary containing the detect info being checked
         """
 
+        H = MEASUREMENT_MODELS.get(detect_info)[0]
         for kf in contact.filter_bank.filters:
-            if math.isnan(detect_info['x_vel']):
-                '''
-                kf.H = np.array([
-                    [1., .0, .0, .0, .0, .0],
-                    [.0, 1., .0, .0, .0, .0],
-                    [.0, .0, .0, .0, .0, .0],
-                    [.0, .0, .0, .0, .0, .0]])
-                '''
-                kf.H = np.array([
-                    [1., .0, .0, .0, .0, .0],
-                    [.0, 1., .0, .0, .0, .0]])
-
-            else:
-                kf.H = np.array([
-                    [1., .0, .0, .0, .0, .0],
-                    [.0, 1., .0, .0, .0, .0],
-                    [.0, .0, 1., .0, .0, .0],
-                    [.0, .0, .0, 1., .0, .0]])
+            kf.H = H
 
 
     def set_R(self, contact, detect_info):
         """
         Set each filter's R value for this contact besed on the pos_covar field from  
-        a Detect message.
+        a Detect message. R is a read-only matrix shared through the 
+        measurement model cache.
 
         Keyword arguments:
         contact -- contact object for which to set R 
         detect_info -- the dictionary containing the detect info being checked
         """
         
-        pc = detect_info['pos_covar']
-        tc = detect_info['twist_covar']
-
+        R = MEASUREMENT_MODELS.get(detect_info)[1]
         for kf in contact.filter_bank.filters:
-            if math.isnan(detect_info['x_vel']):
-                kf.R = np.array([[pc[0], .0],
-                                 [.0, pc[7]]])
-            
-            else:
-                kf.R = np.array([[pc[0], .0, .0, .0],
-                                 [.0, pc[7], .0, .0],
-                                 [.0, .0, tc[0], .0],
-                                 [.0, .0, .0, tc[7]]])
+            kf.R = R
                 
 
        
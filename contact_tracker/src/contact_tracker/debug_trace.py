@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# Debug trace of the tracker's decisions, written as one line per record to
+# a file. Records are kept as tuples and only formatted when the buffer is
+# written out, so tracing costs a tuple and an append per record.
+
+import io
+
+
+class DebugTrace:
+    """
+    Class to buffer debug records and write them to a file in batches.
+
+    A record is a kind followed by any number of fields, written as one
+    line of space separated values. Callers check enabled before building
+    a record, so that nothing is computed or formatted while tracing is off.
+    """
+
+    def __init__(self, path=None, flush_records=4096):
+        """
+        Define the constructor.
+
+        path -- file records are appended to, None to buffer nothing
+        flush_records -- number of records buffered before they are written out
+        """
+
+        self.path = path
+        self.flush_records = flush_records
+        self.enabled = False
+        self.records = []
+        self.written = 0
+
+
+    def configure(self, enabled, path):
+        """
+        Turn tracing on or off, and change the file written to. Records
+        buffered for the old file are written out first.
+
+        Keyword arguments:
+        enabled -- whether to record anything
+        path -- file records are appended to
+        """
+
+        if not enabled or path != self.path:
+            self.flush()
+        self.path = path
+        self.enabled = enabled and bool(path)
+
+
+    def record(self, kind, *fields):
+        """
+        Buffer a record, writing the buffer out once it is full.
+
+        Keyword arguments:
+        kind -- short name of what is recorded
+        fields -- values recorded, formatted with str()
+        """
+
+        self.records.append((kind,) + fields)
+        if len(self.records) >= self.flush_records:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Write every buffered record to the file.
+        """
+
+        records, self.records = self.records, []
+        if not records or not self.path:
+            return
+
+        lines = [u' '.join([str(f) for f in r]) + u'\n' for r in records]
+        with io.open(self.path, 'a', encoding='utf-8') as f:
+            f.write(u''.join(lines))
+        self.written += len(records)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# Columnar log of detects on disk: a directory holding a raw little-endian
+# file per field the tracker reads, and a small JSON index. The log is read
+# through memory maps, in chunks that are views into them.
+
+import io
+import os
+import json
+
+import numpy as np
+
+from contact_tracker.replay import covariances
+
+# Fields of a detect kept in the log, and their types on disk. sensor is
+# the index of the detect's sensor_id in the log's list of sensor ids. The
+# variances are the diagonal terms of the 6x6 pose and twist covariances
+# that the measurement models read, and xy_covar the x-y term of the pose
+# covariance that a contact's initial state covariance reads.
+COLUMNS = [('stamp', '<f8'),
+           ('sensor', '<u2'),
+           ('x_pos', '<f8'),
+           ('y_pos', '<f8'),
+           ('x_vel', '<f8'),
+           ('y_vel', '<f8'),
+           ('x_var', '<f8'),
+           ('y_var', '<f8'),
+           ('xy_covar', '<f8'),
+           ('x_vel_var', '<f8'),
+           ('y_vel_var', '<f8')]
+
+INDEX_FILE = 'index.json'
+VERSION = 1
+
+# Most distinct covariances whose lists are shared between detects read.
+SHARED_COVARIANCES = 1024
+
+
+def write_log(detects, path, chunk_size=65536):
+    """
+    Write detects to a new log.
+
+    Keyword arguments:
+    detects -- iterable of the dictionaries containing the detect info
+    path -- directory of the log
+    chunk_size -- number of detects held in memory before they are written
+
+    Returns: number of detects written
+    """
+
+    writer = DetectLogWriter(path, chunk_size)
+    for detect_info in detects:
+        writer.append(detect_info)
+    return writer.close()
+
+
+class DetectLogWriter:
+    """
+    Class to write detects to a new log, a chunk at a time. The index, which
+    holds the number of detects, is written last, so a log whose writer was
+    not closed reads back as holding only the detects of the last index written.
+    """
+
+    def __init__(self, path, chunk_size=65536):
+        """
+        Define the constructor.
+
+        path -- directory of the log, created if it does not exist
+        chunk_size -- number of detects held in memory before they are written
+        """
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.files = [io.open(os.path.join(path, name), 'wb') for name, dtype in COLUMNS]
+        self.rows = [[] for _ in COLUMNS]
+        self.sensor_ids = []
+        self.sensors = {}
+        self.n = 0
+
+
+    def append(self, detect_info):
+        """
+        Add a detect to the log.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info
+        """
+
+        sensor = self.sensors.get(detect_info['sensor_id'])
+        if sensor is None:
+            sensor = self.sensors[detect_info['sensor_id']] = len(self.sensor_ids)
+            self.sensor_ids.append(detect_info['sensor_id'])
+
+        pc = detect_info['pos_covar']
+        tc = detect_info['twist_covar']
+        row = (detect_info['stamp'], sensor,
+               detect_info['x_pos'], detect_info['y_pos'],
+               detect_info['x_vel'], detect_info['y_vel'],
+               pc[0], pc[7], pc[6], tc[0], tc[7])
+        for values, value in zip(self.rows, row):
+            values.append(value)
+
+        self.n += 1
+        if len(self.rows[0]) >= self.chunk_size:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Write the detects held in memory, and an index covering them.
+        """
+
+        for f, values, (name, dtype) in zip(self.files, self.rows, COLUMNS):
+            f.write(np.array(values, dtype=dtype).tobytes())
+            f.flush()
+            del values[:]
+
+        index = {'version': VERSION,
+                 'count': self.n,
+                 'columns': COLUMNS,
+                 'sensor_ids': self.sensor_ids}
+        with io.open(os.path.join(self.path, INDEX_FILE), 'wb') as f:
+            f.write(json.dumps(index).encode('utf-8'))
+
+
+    def close(self):
+        """
+        Write what is left and close the log.
+
+        Returns: number of detects in the log
+        """
+
+        self.flush()
+        for f in self.files:
+            f.close()
+        return self.n
+
+
+class DetectLog:
+    """
+    Class to read a log of detects through memory maps, so that a log of
+    any size streams from disk without being loaded into memory.
+    """
+
+    def __init__(self, path):
+        """
+        Define the constructor.
+
+        path -- directory of the log
+        """
+
+        with io.open(os.path.join(path, INDEX_FILE), 'rb') as f:
+            index = json.loads(f.read().decode('utf-8'))
+        if index['version'] != VERSION:
+            raise ValueError('%s is a version %d detect log, expected %d' %
+                             (path, index['version'], VERSION))
+
+        self.n = index['count']
+        self.sensor_ids = [str(s) for s in index['sensor_ids']]
+        self.columns = {}
+        for name, dtype in index['columns']:
+            if self.n == 0:
+                self.columns[name] = np.zeros(0, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(os.path.join(path, name), dtype=dtype,
+                                               mode='r', shape=(self.n,))
+
+
+    def __len__(self):
+        return self.n
+
+
+    def chunks(self, size=65536):
+        """
+        Returns: generator of dictionaries of the columns, by name, of
+        consecutive chunks of the log. Each column is a read-only view into
+        the memory map of its file, so nothing is copied.
+        """
+
+        for start in range(0, self.n, size):
+            yield dict((name, column[start:start + size])
+                       for name, column in self.columns.items())
+
+
+    def detects(self, chunk_size=65536):
+        """
+        Read the detects of the log as the dictionaries the tracking engine
+        takes, a chunk at a time. Detects with the same covariance terms
+        share the same covariance lists, which must not be changed.
+
+        Keyword arguments:
+        chunk_size -- number of detects read from the memory maps at a time
+
+        Returns: generator of the dictionaries containing the detect info
+        """
+
+        shared = {}
+        for chunk in self.chunks(chunk_size):
+            sensors = chunk['sensor'].tolist()
+            rows = zip(*[chunk[name].tolist() for name, dtype in COLUMNS if name != 'sensor'])
+            for sensor, row in zip(sensors, rows):
+                terms = row[5:]
+                covar = shared.get(terms)
+                if covar is None:
+                    if len(shared) >= SHARED_COVARIANCES:
+                        shared.clear()
+                    covar = shared[terms] = covariances(*terms)
+                yield {'stamp': row[0],
+                       'sensor_id': self.sensor_ids[sensor],
+                       'x_pos': row[1],
+                       'y_pos': row[2],
+                       'x_vel': row[3],
+                       'y_vel': row[4],
+                       'pos_covar': covar[0],
+                       'twist_covar': covar[1]}
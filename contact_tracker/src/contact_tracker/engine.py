@@ -0,0 +1,1011 @@
+#!/usr/bin/env python
+# The tracking pipeline without ROS: association, contact creation and
+# update, stale deletion and merging of detects given as dictionaries with
+# float timestamps. The tracker node is an adapter around it.
+
+import math
+
+import numpy as np
+
+from contact_tracker.association import chi_square_gate
+from contact_tracker.association import chi_square_gate_2d
+from contact_tracker.association import mahalanobis_sq_2d
+from contact_tracker.association import solve_assignment
+from contact_tracker.contact_bank import ContactBank
+from contact_tracker.debug_trace import DebugTrace
+from contact_tracker.expiry import ExpiryQueue
+from contact_tracker.flight_recorder import Evaluations
+from contact_tracker.flight_recorder import FlightRecorder
+from contact_tracker.flight_recorder import NO_EVALUATIONS
+from contact_tracker.merge import fuse_contacts
+from contact_tracker.merge import merge_candidates
+from contact_tracker.merge import select_merges
+from contact_tracker.model_cache import MEASUREMENT_MODELS
+from contact_tracker.model_cache import PROCESS_MODELS
+from contact_tracker.registry import ContactRegistry
+from contact_tracker.spatial_index import SpatialGrid
+from contact_tracker.spawn import ContactTemplate
+from contact_tracker.stage_timers import StageTimers
+from contact_tracker.tentative import TentativeTracks
+from contact_tracker.track_history import TrackHistory
+
+
+def detect_from_msg(data):
+    """
+    Build the detect info dictionary the engine takes from a
+    marine_msgs/Detect message, or anything with the same fields. The
+    message's header is kept under 'header' for building output messages.
+
+    Keyword arguments:
+    data -- the Detect message
+
+    Returns: the dictionary containing the detect info
+    """
+
+    detect_info = {
+            'header': data.header,
+            'stamp': data.header.stamp.to_sec(),
+            'sensor_id': data.sensor_id,
+            'pos_covar': data.pose.covariance,
+            'twist_covar': data.twist.covariance,
+            'x_pos': float('nan'),
+            'x_vel': float('nan'),
+            'y_pos': float('nan'),
+            'y_vel': float('nan'),
+            }
+
+    # Assign values only if they are not NaNs
+    if not math.isnan(data.pose.pose.position.x):
+        detect_info['x_pos'] = float(data.pose.pose.position.x)
+
+    if not math.isnan(data.pose.pose.position.y):
+        detect_info['y_pos'] = float(data.pose.pose.position.y)
+
+    if not math.isnan(data.twist.twist.linear.x):
+        detect_info['x_vel'] = float(data.twist.twist.linear.x)
+
+    if not math.isnan(data.twist.twist.linear.y):
+        detect_info['y_vel'] = float(data.twist.twist.linear.y)
+
+    return detect_info
+
+
+def check_detect(detect_info):
+    """
+    Check that a detect's position, and its velocity, are either both
+    given or both NaN in x and y.
+
+    Keyword arguments:
+    detect_info -- the dictionary containing the detect info to be checked
+
+    Returns: None if the detect can be used, otherwise what is wrong with it
+    """
+
+    if math.isnan(detect_info['x_pos']) != math.isnan(detect_info['y_pos']):
+        return 'x_pos and y_pos both were not nans'
+    if math.isnan(detect_info['x_vel']) != math.isnan(detect_info['y_vel']):
+        return 'x_vel and y_vel both were not nans'
+    return None
+
+
+class TrackingEngine:
+    """
+    Class to track contacts from detects without ROS.
+
+    A detect is a dictionary with the keys:
+    stamp -- time of the detect, in seconds
+    sensor_id -- name of the sensor that made it
+    x_pos, y_pos -- position, NaN if not measured
+    x_vel, y_vel -- velocity, NaN if not measured
+    pos_covar, twist_covar -- row-major 6x6 covariances of the position
+                              and velocity, of which the x and y variances
+                              and the x-y covariance are used
+    Other keys are carried through to the updates untouched.
+
+    Detects are passed to process() in time order, and each call returns
+    the updates it made to contacts. Stale contacts are deleted, and
+    duplicate contacts merged, only when delete_stale_contacts() and
+    merge_contacts() are called. Times are only ever taken from the
+    detects and from the callers of these methods, never from a clock.
+    The engine is not thread safe.
+    """
+
+    def __init__(self, history_depth=0, flight_recorder_size=20000):
+        """
+        Define the constructor.
+
+        history_depth -- number of detects to remember in each contact's history, 0 for none
+        flight_recorder_size -- number of association decisions kept by the flight recorder
+        """
+
+        self.all_contacts = ContactRegistry()
+        self.all_contact_history = {}
+        self.history_depth = history_depth
+        self.keep_retired_history = True
+        self.max_stale_contact_time = 1.0
+        self.initial_velocity = 1.0
+        self.scan_window = 0.0
+        self.scan_detects = []
+        self.bank = ContactBank(self.all_contacts)
+        self.grid = SpatialGrid()
+        self.gate_sigma = 5.0
+        self.pregate_confidence = 0.9999
+        self.pregate = chi_square_gate_2d(self.pregate_confidence)
+        self.gate_counts = {'pairs': 0, 'spatial_rejected': 0, 'chi_square_rejected': 0,
+                            'bayes_factor_rejected': 0, 'candidates': 0}
+        self.expiry = ExpiryQueue()
+        self.template = ContactTemplate()
+        self.tentative = TentativeTracks()
+        self.confirm_hits = 1
+        self.confirm_scans = 3
+        self.tentative_scan_period = 1.0
+        self.tentative_max_speed = 20.0
+        self.scan_count = 0
+        self.merge_confidence = 0.95
+        self.merge_gate = chi_square_gate(self.merge_confidence, 4)
+        self.merge_counts = {'passes': 0, 'pairs': 0, 'merged': 0}
+        self.timers = StageTimers()
+        self.trace = DebugTrace()
+        self.recorder = FlightRecorder(flight_recorder_size)
+        self.updates = []
+
+
+    def configure(self, config):
+        """
+        Set the engine's parameters from a dictionary holding those of
+        cfg/contact_tracker.cfg. The rates of the periodic tasks are left
+        to the caller.
+
+        Keyword arguments:
+        config -- dictionary of the parameters
+        """
+
+        self.max_stale_contact_time = config['max_stale_contact_time']
+        self.initial_velocity = config['initial_velocity']
+        self.gate_sigma = config['gate_sigma']
+        self.pregate_confidence = config['pregate_confidence']
+        self.pregate = chi_square_gate_2d(self.pregate_confidence)
+        self.scan_window = config['scan_window']
+        self.confirm_hits = config['confirm_hits']
+        self.confirm_scans = max(config['confirm_scans'], config['confirm_hits'])
+        self.tentative_scan_period = config['tentative_scan_period']
+        self.tentative_max_speed = config['tentative_max_speed']
+        self.timers.enabled = config['stage_timing']
+        self.trace.configure(config['debug_trace'], config['debug_trace_file'])
+        self.merge_confidence = config['merge_confidence']
+        self.merge_gate = chi_square_gate(self.merge_confidence, 4)
+        PROCESS_MODELS.configure(config['model_cache_size'], config['dt_tolerance'])
+        if config['grid_cell_size'] != self.grid.cell_size:
+            self.grid = SpatialGrid(config['grid_cell_size'])
+
+
+    def process(self, detects):
+        """
+        Track a batch of detects, in the order given. In scan mode, detects
+        are collected until one arrives stamped past the scan window, which
+        closes the scan and starts the next; the detects of a closed scan are
+        associated all at once. Otherwise each is associated on its own.
+
+        Keyword arguments:
+        detects -- list of the dictionaries containing the detect info
+
+        Returns: list of the updates made to contacts, one for each detect
+        that started or updated a contact, as made by make_update()
+        """
+
+        self.updates = []
+        for detect_info in detects:
+            if self.scan_window > 0:
+                # A detect past the window closes the scan and starts the next.
+                if (len(self.scan_detects) > 0 and
+                        detect_info['stamp'] - self.scan_detects[0]['stamp'] >= self.scan_window):
+                    t = self.timers.start()
+                    self.process_scan()
+                    self.timers.stop('process_scan', t)
+                self.scan_detects.append(detect_info)
+
+            else:
+                self.process_detect(detect_info)
+
+        return self.updates
+
+
+    def make_update(self, c, detect_info, new):
+        """
+        Build the update of a contact that was just started or updated by a
+        detect. It holds copies of everything that may change later.
+
+        Keyword arguments:
+        c -- the Contact object
+        detect_info -- the dictionary containing the detect info
+        new -- whether the detect started the contact
+
+        Returns: dictionary with the contact's handle and name, whether it is
+        new, the detect, and the contact's combined state and each filter's
+        covariance, keyed by filter type
+        """
+
+        return {
+                'id': c.id,
+                'name': c.name,
+                'new': new,
+                'detect_info': detect_info,
+                'x': np.array(c.filter_bank.x),
+                'P': dict((kf.filter_type, kf.P.copy()) for kf in c.filter_bank.filters),
+                }
+
+
+    def dump_detect(self, detect_info):
+        """
+        Print the contents of a contact's detect_info dictionary for debugging purposes.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info to be printed
+        """
+
+        print('+++++++ DETECT +++++++')
+        for k, v in detect_info.items():
+            print(k, ': ', v)
+
+
+    def dump_contacts(self):
+        """
+        Print the contents of the all_contacts dictionary for debugging purposes.
+        """
+
+        print('+++++++ CONTACTS +++++++')
+        for k in self.all_contacts.items():
+            print(k)
+        print('++++++++++++++++++++++++')
+
+
+    def check_all_contacts_by_distance(self, detect_info):
+        """
+        FOR DEBUGGING PURPOSES
+        Iterate over every contact in the dictionary and return the contact
+        the current detect is most likely associated with by checking Euclidean
+        distance between the prediction and the measurement. If no contact
+        is asociated with this detect, return the timestamp of the current detect
+        message as the new hash_key for the new contact that will be made.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info to be checked
+
+        Returns:
+        None if no appropriate contacts are found, otherwise the found contact's id
+        """
+
+        greatest_pred = float('inf')
+        return_contact_id = None
+
+        for contact in self.all_contacts:
+            c = self.all_contacts[contact]
+
+            # Get the distance between the measurement and the prediction for each filter.
+            side1a = abs(detect_info['x_pos'] - c.filter_bank.filters[0].x[0])
+            side1b = abs(detect_info['y_pos'] - c.filter_bank.filters[0].x[1])
+            side2a = abs(detect_info['x_pos'] - c.filter_bank.filters[1].x[0])
+            side2b = abs(detect_info['y_pos'] - c.filter_bank.filters[1].x[1])
+
+            H1 = math.sqrt(side1a**2 + side1b**2)
+            H2 = math.sqrt(side2a**2 + side2b**2)
+
+            # If both filters have predictions within 10 of the measurement, incorporate
+            # the measurement into the filter.
+            if H1 <= 10 and H2 <= 10:
+                if H1 + H2 <= greatest_pred:
+                    greatest_pred = H1 + H2
+                    return_contact_id = c.id
+
+        return return_contact_id
+
+
+    def check_all_contacts_by_likelihood(self, detect_info):
+        """
+        FOR DEBUGGING PURPOSES
+        Iterate over every contact in the dictionary and return the contact
+        the current detect is most likely associated with by checking log
+        likilehood of each Kalman filter in the contact. If no contact
+        is asociated with this detect, return the timestamp of the current detect
+        message as the new hash_key for the new contact that will be made.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info to be checked
+
+        Returns:
+        None if no appropriate contacts are found, otherwise the found contact's id
+        """
+
+        greatest_likelihood = 0.0
+        return_contact_id = None
+
+        for contact_id in self.all_contacts:
+            c = self.all_contacts[contact_id]
+            
+            for kf in c.filter_bank.filters:
+                kf.set_log_likelihood(c)
+
+                if self.trace.enabled:
+                    self.trace.record('likelihood', detect_info['stamp'],
+                                      detect_info['sensor_id'], c.name, kf.filter_type,
+                                      kf.get_log_likelihood())
+
+            # L1 = c.filter_bank.filters[0].get_log_likelihood()
+            # L2 = c.filter_bank.filters[1].get_log_likelihood()
+
+            # EXPERIMENTAL
+            # Here only the second order filter is being evaluated, as it
+            # accommodates the largest changes. I'm using the likelihood rather
+            # than the log liklihood, which is equivalent, but easier to
+            # understand.
+
+            for kf in c.filter_bank.filters:
+                if kf.filter_type == 'second':
+                    L = np.exp(kf.get_log_likelihood())
+                    #print("Contact: %s L: %0.4f Last dT: %f" %
+                    #      (contact_id,L,c.dt))
+
+                   # This requires the measurement to be somewhat likely (1/20).
+                   # Otherwise the measurement is not considered to be a candidate
+                   # measurement of the contact.
+                    if L > 0.05:
+                        # Here we keep track of the contact for whom the measurement
+                        # has the greatest likelihood.
+                        if L > greatest_likelihood:
+                            greatest_likelihood = L
+                            return_contact_id = contact_id
+
+
+
+            # Not sure about this condition
+            #if L1 / L2 > 0.5:
+            #    if L1 / L2 > greatest_likelihood:
+            #        greatest_likelihood = L1 / L2
+            #        return_contact_id = c.id
+        if self.trace.enabled:
+            self.trace.record('greatest_likelihood', detect_info['stamp'],
+                              greatest_likelihood, return_contact_id)
+        return return_contact_id
+
+
+    def gate_contacts(self, detect_info):
+        """
+        Return the rows of the bank whose contacts pass both cheap association
+        gates, so that only they go on to the Bayes factor test:
+
+        1. The spatial gate: the contact's predicted position, plus gate_sigma
+           standard deviations of the second order filter's prior, overlaps
+           the detect's position plus gate_sigma standard deviations of its
+           own uncertainty.
+        2. The chi-square gate: the squared Mahalanobis distance of the
+           position residual, under the second order filter's prior position
+           covariance plus the detect's, is within the chi-square quantile
+           for pregate_confidence.
+
+        If the detect has no position, every row is returned.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info to be checked
+
+        Returns: array of the rows of the bank
+        """
+
+        n = len(self.bank)
+        self.gate_counts['pairs'] += n
+
+        if math.isnan(detect_info['x_pos']):
+            return np.arange(n)
+
+        pc = detect_info['pos_covar']
+        radius = self.gate_sigma * math.sqrt(max(pc[0], pc[7]))
+        rows = self.grid.query(detect_info['x_pos'], detect_info['y_pos'], radius)
+        self.gate_counts['spatial_rejected'] += n - len(rows)
+
+        return self.pregate_rows(detect_info, rows)
+
+
+    def gate_scan_contacts(self, detect_info):
+        """
+        Same as gate_contacts, but for a detect of a scan indexed by
+        index_scan(). Only the contacts the grid finds for the detect are
+        predicted to its time, and their discs are tested again with those
+        predictions, so the gates pass the same contacts as gate_contacts.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info to be checked
+
+        Returns: array of the rows of the bank
+        """
+
+        n = len(self.bank)
+        self.gate_counts['pairs'] += n
+
+        if math.isnan(detect_info['x_pos']):
+            rows = np.arange(n)
+            self.bank.predict_rows(rows, detect_info['stamp'])
+            return rows
+
+        pc = detect_info['pos_covar']
+        radius = self.gate_sigma * math.sqrt(max(pc[0], pc[7]))
+        rows = self.grid.query(detect_info['x_pos'], detect_info['y_pos'], radius)
+        self.bank.predict_rows(rows, detect_info['stamp'])
+
+        dx = self.bank.x_prior[rows, 1, 0] - detect_info['x_pos']
+        dy = self.bank.x_prior[rows, 1, 1] - detect_info['y_pos']
+        limit = self.gating_radii(self.bank.P_prior[rows]) + radius
+        rows = rows[dx*dx + dy*dy <= limit*limit]
+        self.gate_counts['spatial_rejected'] += n - len(rows)
+
+        return self.pregate_rows(detect_info, rows)
+
+
+    def pregate_rows(self, detect_info, rows):
+        """
+        Apply the chi-square gate of gate_contacts to some rows of the bank,
+        whose priors are at the time of the detect.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info to be checked
+        rows -- array of the rows of the bank
+
+        Returns: array of the rows that pass
+        """
+
+        if len(rows) > 0 and self.pregate < float('inf'):
+            R = MEASUREMENT_MODELS.get(detect_info)[1]
+            S = self.bank.P_prior[rows, 1, 0:2, 0:2] + R[0:2, 0:2]
+            residuals = (np.array([detect_info['x_pos'], detect_info['y_pos']]) -
+                         self.bank.x_prior[rows, 1, 0:2])
+            passed = mahalanobis_sq_2d(residuals, S) <= self.pregate
+            self.gate_counts['chi_square_rejected'] += len(rows) - int(np.count_nonzero(passed))
+            rows = rows[passed]
+
+        return rows
+
+
+    def check_all_contacts_by_BF(self, detect_info):
+        """
+        Iterate over every contact that passes the association gates and return the contact
+        the current detect is most likely associated with by checking the
+        Bayes factor of each Kalman filter in the contact. If no contact
+        is asociated with this detect, return None so that a new contact
+        will be made.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info to be checked
+
+        Returns:
+        None if no appropriate contacts are found, otherwise the found contact's id
+        """
+
+        greatest_logBF = 0
+        return_contact_id = None
+
+        candidates, evaluations = self.bayes_factor_candidates(detect_info)
+        for c, logBF in candidates:
+            if logBF > greatest_logBF:
+                greatest_logBF = logBF
+                return_contact_id = c.id
+
+        self.recorder.record(detect_info, evaluations, return_contact_id)
+        return return_contact_id
+
+
+    def bayes_factor_candidates(self, detect_info, rows=None):
+        """
+        Compute the Bayes factor of each Kalman filter of every contact that
+        passes the association gates, and return the contacts the detect could
+        be associated with: those where both filters have a log Bayes
+        factor above 2. The Evaluations of every contact evaluated, rejected
+        or not, are returned too, for the flight recorder.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info to be checked
+        rows -- rows of the bank that passed the gates, default those
+                gate_contacts() returns
+
+        Returns:
+        list of (contact, sum of the log Bayes factors of its filters) of
+        the candidate contacts, and the Evaluations
+        """
+
+        candidates = []
+        evaluations = Evaluations()
+        if rows is None:
+            rows = self.gate_contacts(detect_info)
+        gated = self.setup_contacts(rows, detect_info)
+        self.timers.record('contacts_evaluated', len(gated))
+
+        for c in gated:
+            
+            for kf in c.filter_bank.filters:
+                if self.trace.enabled and kf.filter_type == 'second':
+                    self.trace.record('prior', detect_info['stamp'], c.name,
+                                      np.sqrt(kf.P_prior[0,0]), np.sqrt(kf.P_prior[1,1]))
+
+                kf.set_bayes_factor(c, 2.0)
+
+                if self.trace.enabled:
+                    self.trace.record('bf', detect_info['stamp'],
+                                      detect_info['sensor_id'], c.name, kf.filter_type,
+                                      kf.get_bayes_factor())
+
+            logBF1 = c.filter_bank.filters[0].get_bayes_factor()
+            logBF2 = c.filter_bank.filters[1].get_bayes_factor()
+
+            if logBF1 > 2 and logBF2 > 2:
+                candidates.append((c, logBF1 + logBF2))
+                evaluations.add(c.id, logBF1 + logBF2, False)
+            else:
+                evaluations.add(c.id, logBF1 + logBF2, True)
+
+        self.gate_counts['bayes_factor_rejected'] += evaluations.evaluated - evaluations.candidates
+        self.gate_counts['candidates'] += len(candidates)
+        return candidates, evaluations
+
+
+    def process_scan(self):
+        """
+        Associate every detect collected in the current scan window at once.
+        Each detect is scored against the contacts that pass its gates, and
+        the gated pairs are assigned globally so that every contact takes
+        at most one detect per scan and the result does not depend on the
+        order the detects arrived in. Detects are then incorporated in time
+        order; those left unassigned go to the tentative tracks.
+
+        The contacts are indexed once for the whole scan, and each detect
+        predicts and sets up only the contacts the index finds for it.
+        """
+
+        scan = sorted(self.scan_detects, key=lambda d: d['stamp'])
+        self.scan_detects = []
+        self.scan_count += 1
+
+        detects = []
+        contacts = []
+        costs = []
+        candidates = [[] for detect_info in scan]
+        evaluations = [NO_EVALUATIONS for detect_info in scan]
+        if len(self.all_contacts) > 0:
+            self.index_scan(scan[0]['stamp'], scan[-1]['stamp'])
+
+            for j, detect_info in enumerate(scan):
+                rows = self.gate_scan_contacts(detect_info)
+                candidates[j], evaluations[j] = self.bayes_factor_candidates(detect_info, rows)
+                for c, logBF in candidates[j]:
+                    detects.append(j)
+                    contacts.append(c.id)
+                    costs.append(-logBF)
+
+            # A kept history records every contact's prior for the last
+            # detect of the scan.
+            if self.history_depth > 0:
+                self.setup_contacts_for_detect(scan[-1])
+
+        assignment = solve_assignment(detects, contacts, costs)
+
+        for j, detect_info in enumerate(scan):
+            contact_id = assignment.get(j)
+            self.recorder.record(detect_info, evaluations[j], contact_id)
+            if contact_id is not None:
+                # The priors left over from scoring may be for another
+                # detect of the scan, so predict this contact again for its own.
+                self.setup_contact_for_detect(self.all_contacts[contact_id], detect_info)
+            self.apply_detect(detect_info, contact_id)
+
+
+    def setup_contacts_for_detect(self, detect_info):
+        """ 
+        Predicts the location of every contact at the measurement time in one
+        batch, into the stacked arrays of the bank, and indexes the
+        predictions for the gates. Only the contacts that pass the gates are
+        then set up to be tested against the detect, by setup_contacts(),
+        unless a history is kept, which records every contact's prior.
+
+        These steps are required prior to evaulating whether the received detect
+        is likely a measure of a given contact, or a new contact altogether.
+
+        NB. The prediction step done here populates ONLY KF.x_prior and
+        KF.P_prior, and NOT KF.x and KF.P. This detail is important, because
+        the "prior" variables allow us to use these predicted states to
+        test for whether a measurement should be associated with the contact
+        without actually modifying the contact's state (just in case the test
+        fails).
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info to use 
+        """ 
+
+        # This does not update the state, x. Just x_prior.
+        self.bank.predict_priors(detect_info['stamp'])
+        self.index_predictions()
+
+        if self.history_depth > 0:
+            self.setup_contacts(range(len(self.bank)), detect_info)
+
+
+    def setup_contacts(self, rows, detect_info):
+        """
+        Hand the contacts of some rows of the bank their priors and dt, as
+        last predicted, and populate Z, and the H and R built once for this
+        detect and shared by every filter.
+
+        Keyword arguments:
+        rows -- iterable of the rows of the bank
+        detect_info -- the dictionary containing the detect info to use 
+
+        Returns: list of the contacts of the rows
+        """
+
+        contacts = self.bank.bind(rows)
+        H, R = MEASUREMENT_MODELS.get(detect_info)
+
+        for c in contacts:
+            c.set_Z(detect_info)
+
+            for kf in c.filter_bank.filters:
+                kf.H = H
+                kf.R = R
+
+        return contacts
+
+
+    def setup_contact_for_detect(self, c, detect_info):
+        """
+        Same as setup_contacts_for_detect, but for a single contact.
+
+        Keyword arguments:
+        c -- the Contact object to set up
+        detect_info -- the dictionary containing the detect info to use 
+        """
+
+        self.bank.predict_contact(c, detect_info['stamp'])
+
+        H, R = MEASUREMENT_MODELS.get(detect_info)
+        c.set_Z(detect_info)
+        for kf in c.filter_bank.filters:
+            kf.H = H
+            kf.R = R
+
+
+    def index_predictions(self):
+        """
+        Rebuild the spatial index over the second order filter's predicted
+        position of every contact, with a gating radius of gate_sigma standard
+        deviations of its prior.
+        """
+
+        n = len(self.bank)
+        if n == 0:
+            self.grid.rebuild(np.zeros((0, 2)), np.zeros(0))
+            return
+
+        self.grid.rebuild(self.bank.x_prior[:, 1, 0:2], self.gating_radii(self.bank.P_prior))
+
+
+    def index_scan(self, start, end):
+        """
+        Rebuild the spatial index so that each contact's disc covers the
+        disc index_predictions() would give it at any time of a scan. The
+        contacts are predicted to the start and the end of the scan. The
+        second order filter's predicted position follows a parabola
+        between the two, which strays from the line joining them by at
+        most |a| T^2 / 8 over a time T. The disc is centered between the
+        two positions and takes the larger of the two gating radii.
+
+        Keyword arguments:
+        start -- time of the first detect of the scan, in seconds
+        end -- time of the last detect of the scan, in seconds
+        """
+
+        self.bank.predict_priors(start)
+        start_positions = self.bank.x_prior[:, 1, 0:2]
+        start_radii = self.gating_radii(self.bank.P_prior)
+
+        self.bank.predict_priors(end)
+        end_positions = self.bank.x_prior[:, 1, 0:2]
+        end_radii = self.gating_radii(self.bank.P_prior)
+
+        # Time steps are rounded, which can stretch the scan by a step.
+        span = end - start + self.bank.models.dt_tolerance
+        a = self.bank.x_prior[:, 1, 4:6]
+        d = end_positions - start_positions
+        radii = (0.5*np.hypot(d[:, 0], d[:, 1]) +
+                 np.maximum(start_radii, end_radii) +
+                 np.hypot(a[:, 0], a[:, 1])*span**2/8.0)
+        self.grid.rebuild(0.5*(start_positions + end_positions), radii)
+
+
+    def gating_radii(self, P_prior):
+        """
+        Returns: gate_sigma standard deviations of the second order filter's
+        prior position, the larger of x and y, for each row of P_prior
+        """
+
+        P = P_prior[:, 1]
+        return self.gate_sigma * np.sqrt(np.maximum(P[:, 0, 0], P[:, 1, 1]))
+
+
+    def retire_contact(self, contact_id):
+        """
+        Remove a contact from every structure that holds it.
+
+        Keyword arguments:
+        contact_id -- handle of the contact to remove
+        """
+
+        self.bank.remove(contact_id)
+        del self.all_contacts[contact_id]
+        self.expiry.remove(contact_id)
+        if not self.keep_retired_history:
+            self.all_contact_history.pop(contact_id, None)
+
+
+    def confirm_detect(self, detect_info):
+        """
+        Pass a detect that no contact took to the tentative tracks. It either
+        starts a tentative track or is a hit on the nearest one within its
+        gate. A track with confirm_hits hits, at most one per scan, within
+        confirm_scans scans of its first detect is confirmed and removed, and
+        the detect then starts a contact. With confirm_hits at 1, and for
+        detects without a position, every detect starts a contact.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info to use
+
+        Returns: True if the detect should start a new contact
+        """
+
+        # In scan mode a scan is a scan window; otherwise detects are
+        # grouped into scans by time.
+        stamp = detect_info['stamp']
+        if self.scan_window > 0:
+            scan = self.scan_count
+        else:
+            scan = int(math.floor(stamp / self.tentative_scan_period))
+
+        self.tentative.expire(scan, self.confirm_scans)
+
+        if self.confirm_hits <= 1 or math.isnan(detect_info['x_pos']):
+            return True
+
+        z = (detect_info['x_pos'], detect_info['y_pos'])
+        v = (detect_info['x_vel'], detect_info['y_vel'])
+        pc = detect_info['pos_covar']
+        variance = max(pc[0], pc[7])
+
+        i = self.tentative.find(z, variance, stamp, self.gate_sigma, self.tentative_max_speed)
+        if i is None:
+            self.tentative.add(z, v, variance, stamp, scan)
+            return False
+
+        if self.tentative.hit(i, z, v, variance, stamp, scan) < self.confirm_hits:
+            return False
+
+        self.tentative.confirm(i)
+        return True
+
+
+    def add_contact(self, detect_info):
+        """
+        Initialize new contact from the contact template and add it to
+        all_contacts. The contact is named after the stamp of the detect
+        that created it, in integer nanoseconds as rospy.Time prints it.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info to use 
+
+        Returns: the new contact's handle
+        """
+
+        c = self.template.spawn(detect_info, int(round(detect_info['stamp']*1e9)))
+        cid = self.all_contacts.add(c)
+        self.bank.add(c)
+        self.expiry.touch(cid, c.last_measured)
+        if self.trace.enabled:
+            self.trace.record('new', c.last_measured, c.name,
+                              detect_info['x_pos'], detect_info['y_pos'],
+                              detect_info['x_vel'], detect_info['y_vel'])
+        return cid
+
+
+    def process_detect(self, detect_info):
+        """
+        Associate a single detect with the contact it most likely belongs to,
+        or start a new contact with it.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info to use 
+        """
+
+        #  If there are no contacts yet, no need to traverse empty dictionary
+        #  Otherwise, we have to check each contact in the dictionary to see if
+        #  it is a potential match for our current detect message.
+        t = self.timers.start()
+        self.setup_contacts_for_detect(detect_info)
+        t = self.timers.stop('setup_contacts_for_detect', t)
+
+        contact_id = None
+        if len(self.all_contacts) > 0:
+            contact_id = self.check_all_contacts_by_BF(detect_info)
+            self.timers.stop('check_all_contacts_by_BF', t)
+        else:
+            self.recorder.record(detect_info, NO_EVALUATIONS, None)
+
+        self.apply_detect(detect_info, contact_id)
+
+
+    def apply_detect(self, detect_info, contact_id):
+        """
+        Incorporate a detect into the contact it was associated with, or pass
+        it to the tentative tracks, which may start a new contact with it,
+        and queue an update for the contact. Then record the state of every
+        contact if a history is kept.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info to use 
+        contact_id -- handle of the associated contact, or None to start a new one
+        """
+
+        #######################################################
+        ####### CREATE OR UPDATE CONTACT WITH VARIABLES #######
+        #######################################################
+
+        if contact_id is None:
+            if self.confirm_detect(detect_info):
+                contact_id = self.add_contact(detect_info)
+                c = self.all_contacts[contact_id]
+                c.set_Z(detect_info)
+                self.updates.append(self.make_update(c, detect_info, True))
+        
+        else:
+            c = self.all_contacts[contact_id]
+            c.info = detect_info
+
+            if not math.isnan(detect_info['x_pos']):
+                c.last_xpos = detect_info['x_pos']
+                c.last_ypos = detect_info['y_pos']
+
+            if not math.isnan(detect_info['x_vel']):
+                c.last_xvel = detect_info['x_vel']
+                c.last_yvel = detect_info['y_vel']
+
+            # Incorporate with filters in the filter_bank.
+            c.set_Q()                           # sets Q for all filters.
+            c.filter_bank.filters[0].set_F(c)   # sets F for all filters.
+            t = self.timers.start()
+            c.filter_bank.predict()
+            c.filter_bank.update(c.Z)
+            self.timers.stop('imm_predict_update', t)
+            c.last_measured = detect_info['stamp']
+            self.bank.sync(c)
+            self.expiry.touch(contact_id, c.last_measured)
+            self.updates.append(self.make_update(c, detect_info, False))
+
+
+        ##################################################
+        # Record the state of every contact for plotting. #
+        ##################################################
+        if self.history_depth == 0:
+            return
+
+        stamp = detect_info['stamp']
+        for cid in self.all_contacts:
+            # Each contact keeps a fixed number of detects, so memory stays
+            # bounded however long the mission runs.
+            if cid not in self.all_contact_history:
+                self.all_contact_history[cid] = TrackHistory(self.history_depth,
+                                                             self.all_contacts[cid].name)
+
+            self.all_contact_history[cid].append(stamp,
+                                                 self.all_contacts[cid],
+                                                 cid == contact_id)
+
+
+    def delete_stale_contacts(self, now):
+        """
+        Remove contacts that have not been measured within
+        max_stale_contact_time of a given time. Contacts are held in a heap by
+        the time they were last measured, so only the expired ones are visited.
+
+        Keyword arguments:
+        now -- the current time, in seconds
+
+        Returns: list of the names of the contacts removed
+        """
+
+        cutoff = now - self.max_stale_contact_time*60.0
+        names = []
+        for contact_id, last_measured in self.expiry.pop_expired(cutoff):
+            names.append(self.all_contacts[contact_id].name)
+            if self.trace.enabled:
+                self.trace.record('stale', now, names[-1], (now - last_measured) / 60.0)
+            self.retire_contact(contact_id)
+        return names
+
+
+    def merge_contacts(self, now):
+        """
+        Merge contacts that are most likely the same target. Every contact
+        is predicted to the given time, and pairs whose position and
+        velocity are within the chi-square quantile for merge_confidence of
+        each other are fused into the contact with the smaller position
+        uncertainty; the other is retired. Only pairs that are close in the
+        spatial grid are compared, and each contact takes part in at most
+        one merge per pass.
+
+        Keyword arguments:
+        now -- the current time, in seconds
+
+        Returns: list of (name of the contact kept, name of the contact
+        merged into it)
+        """
+
+        self.merge_counts['passes'] += 1
+        n = len(self.bank)
+        if n < 2:
+            return []
+
+        x, P = self.bank.predict_combined(now)
+        i, j, d2, tested = merge_candidates(x, P, self.grid.cell_size, self.merge_gate)
+        self.merge_counts['pairs'] += tested
+
+        # Rows move as contacts are retired, so hold on to the contacts.
+        contacts = self.bank.contacts[:n]
+        merged = []
+        for a, b in select_merges(i, j, d2):
+            if P[a, 0, 0] + P[a, 1, 1] > P[b, 0, 0] + P[b, 1, 1]:
+                a, b = b, a
+            keep = contacts[a]
+            drop = contacts[b]
+            merged.append((keep.name, drop.name))
+
+            fuse_contacts(self.bank, keep, drop)
+            self.expiry.touch(keep.id, keep.last_measured)
+            self.retire_contact(drop.id)
+            self.merge_counts['merged'] += 1
+
+        return merged
+
+
+    def close_scan(self, now):
+        """
+        Process the current scan if its window has passed by a given time
+        without another detect arriving to close it.
+
+        Keyword arguments:
+        now -- the current time, in seconds
+
+        Returns: list of the updates made, as returned by process()
+        """
+
+        self.updates = []
+        if len(self.scan_detects) > 0 and now - self.scan_detects[0]['stamp'] >= self.scan_window:
+            self.process_scan()
+        return self.updates
+
+
+    def diagnostics(self):
+        """
+        Returns: list of (key, value) pairs describing the engine's state:
+        the number of contacts and tentative tracks, the backlog of the scan,
+        the association, tentative track and merge counts, and the
+        percentiles of every timed stage and sample, in ms.
+        """
+
+        values = [('contacts', len(self.all_contacts)),
+                  ('tentative_tracks', len(self.tentative)),
+                  ('scan_backlog', len(self.scan_detects))]
+
+        for counts, prefix in [(self.gate_counts, 'gate_'),
+                               (self.tentative.counts, 'tentative_'),
+                               (self.merge_counts, 'merge_')]:
+            for key, value in sorted(counts.items()):
+                values.append((prefix + key, value))
+
+        for name, summary in sorted(self.timers.summary().items()):
+            values.append((name + '_count', summary['count']))
+            for p in ['p50', 'p95', 'p99']:
+                values.append(('%s_%s' % (name, p), '%0.3f' % summary[p]))
+
+        return values
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Min-heap of contacts keyed on the time they were last measured, so that
+# the stale ones can be found without looking at every contact.
+
+import heapq
+import itertools
+
+
+class ExpiryQueue:
+    """
+    Class to keep track of when each contact was last measured and hand out
+    the ones that have not been measured since a cutoff time.
+
+    Touching a key pushes a new heap entry rather than moving the old one;
+    outdated entries are skipped when they reach the top, and the heap is
+    rebuilt whenever they make up most of it.
+    """
+
+    def __init__(self):
+        """
+        Define the constructor.
+        """
+
+        self.heap = []
+        self.latest = {}
+        self.counter = itertools.count()
+
+
+    def __len__(self):
+        return len(self.latest)
+
+
+    def touch(self, key, last_measured):
+        """
+        Record that a contact was measured.
+
+        Keyword arguments:
+        key -- id of the contact
+        last_measured -- time the contact was last measured, in s
+        """
+
+        self.latest[key] = last_measured
+        heapq.heappush(self.heap, (last_measured, next(self.counter), key))
+
+        if len(self.heap) > 2*len(self.latest) + 64:
+            self._compact()
+
+
+    def remove(self, key):
+        """
+        Stop tracking a contact.
+
+        Keyword arguments:
+        key -- id of the contact
+        """
+
+        self.latest.pop(key, None)
+
+
+    def pop_expired(self, cutoff):
+        """
+        Stop tracking and return every contact last measured before a cutoff.
+        Costs O(k log n) for k expired contacts.
+
+        Keyword arguments:
+        cutoff -- contacts last measured before this time are expired, in s
+
+        Returns: list of (key, last_measured) of the expired contacts
+        """
+
+        expired = []
+        while self.heap and self.heap[0][0] < cutoff:
+            last_measured, _, key = heapq.heappop(self.heap)
+            if self.latest.get(key) == last_measured:
+                del self.latest[key]
+                expired.append((key, last_measured))
+
+        return expired
+
+
+    def _compact(self):
+        """
+        Rebuild the heap from the current entries only.
+        """
+
+        self.heap = [(t, next(self.counter), key) for key, t in self.latest.items()]
+        heapq.heapify(self.heap)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# Flight recorder of the tracker's association decisions: a fixed-size ring
+# buffer of binary records, each holding a detect, the contacts that were
+# evaluated for it and the contact it was associated with.
+
+import struct
+
+import numpy as np
+
+# Number of evaluated contacts kept per record, those with the greatest log
+# Bayes factors whether they were candidates or rejected. A record also
+# holds the numbers of candidates and of contacts evaluated, so it shows
+# when some were left out.
+MAX_CANDIDATES = 4
+
+# Layout of a record, as packed and as read back from a dump.
+RECORD = struct.Struct('<d8s6dHHq%dq%dd%d?' % (MAX_CANDIDATES, MAX_CANDIDATES, MAX_CANDIDATES))
+RECORD_DTYPE = np.dtype([('stamp', '<f8'),
+                         ('sensor_id', 'S8'),
+                         ('x_pos', '<f8'),
+                         ('y_pos', '<f8'),
+                         ('x_vel', '<f8'),
+                         ('y_vel', '<f8'),
+                         ('x_var', '<f8'),
+                         ('y_var', '<f8'),
+                         ('candidates', '<u2'),
+                         ('evaluated', '<u2'),
+                         ('chosen', '<i8'),
+                         ('candidate_ids', '<i8', (MAX_CANDIDATES,)),
+                         ('log_bf', '<f8', (MAX_CANDIDATES,)),
+                         ('rejected', '?', (MAX_CANDIDATES,))])
+
+# Contact ids, log Bayes factors and rejected flags of a record with no
+# contacts evaluated, and the padding of one with fewer than MAX_CANDIDATES.
+NO_CANDIDATES = (-1,)*MAX_CANDIDATES + (np.nan,)*MAX_CANDIDATES + (False,)*MAX_CANDIDATES
+
+
+class Evaluations:
+    """
+    Class to count the contacts evaluated for a detect as they are
+    evaluated, and keep the MAX_CANDIDATES with the greatest log Bayes
+    factors in the order and layout a record packs them in, so that
+    recording the decision does no work that grows with their number.
+    Contacts with equal log Bayes factors are kept in the order they were
+    evaluated.
+    """
+
+    def __init__(self):
+        """
+        Define the constructor.
+        """
+
+        self.candidates = 0
+        self.evaluated = 0
+        self.kept = 0
+        self.slots = list(NO_CANDIDATES)
+
+
+    def add(self, contact_id, logBF, rejected):
+        """
+        Count an evaluated contact, and keep it if its log Bayes factor is
+        among the greatest.
+
+        Keyword arguments:
+        contact_id -- handle of the contact
+        logBF -- sum of the log Bayes factors of its filters
+        rejected -- whether it failed the Bayes factor test
+        """
+
+        self.evaluated += 1
+        if not rejected:
+            self.candidates += 1
+
+        # A log Bayes factor that is NaN is kept after every other.
+        s = self.slots
+        if self.kept == MAX_CANDIDATES:
+            if logBF != logBF or s[2*MAX_CANDIDATES - 1] >= logBF:
+                return
+            k = MAX_CANDIDATES - 1
+        else:
+            k = self.kept
+            self.kept += 1
+
+        # Move the kept contacts with smaller log Bayes factors down a slot.
+        while k > 0 and logBF == logBF and not s[MAX_CANDIDATES + k - 1] >= logBF:
+            s[k] = s[k - 1]
+            s[MAX_CANDIDATES + k] = s[MAX_CANDIDATES + k - 1]
+            s[2*MAX_CANDIDATES + k] = s[2*MAX_CANDIDATES + k - 1]
+            k -= 1
+
+        s[k] = contact_id
+        s[MAX_CANDIDATES + k] = logBF
+        s[2*MAX_CANDIDATES + k] = rejected
+
+
+# Evaluations of a detect no contact was evaluated for. Never added to.
+NO_EVALUATIONS = Evaluations()
+
+
+class FlightRecorder:
+    """
+    Class to record every association decision in a ring buffer of fixed
+    size, overwriting the oldest records once it is full, and to dump the
+    records to a file on demand.
+
+    A record is packed straight into the buffer with a precompiled struct,
+    from Evaluations kept as the contacts were evaluated, so recording
+    costs the same however many contacts were. Contact ids are the
+    contacts' handles, and -1 where there is no contact.
+    """
+
+    def __init__(self, size=20000):
+        """
+        Define the constructor.
+
+        size -- number of records kept
+        """
+
+        self.size = size
+        self.buffer = bytearray(size*RECORD.size)
+        self.n = 0
+        self.sensor_ids = {}
+
+
+    def record(self, detect_info, evaluations, chosen):
+        """
+        Record the association of a detect.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info
+        evaluations -- Evaluations of the contacts evaluated for the detect
+        chosen -- handle of the contact the detect was associated with, or None
+        """
+
+        sensor_id = self.sensor_ids.get(detect_info['sensor_id'])
+        if sensor_id is None:
+            sensor_id = str(detect_info['sensor_id']).encode('utf-8')[:8]
+            self.sensor_ids[detect_info['sensor_id']] = sensor_id
+
+        pc = detect_info['pos_covar']
+        RECORD.pack_into(self.buffer, (self.n % self.size)*RECORD.size,
+                         detect_info['stamp'], sensor_id,
+                         detect_info['x_pos'], detect_info['y_pos'],
+                         detect_info['x_vel'], detect_info['y_vel'],
+                         pc[0], pc[7],
+                         min(evaluations.candidates, 0xffff), min(evaluations.evaluated, 0xffff),
+                         -1 if chosen is None else chosen, *evaluations.slots)
+        self.n += 1
+
+
+    def __len__(self):
+        return min(self.n, self.size)
+
+
+    def records(self):
+        """
+        Returns: structured array of the records held, oldest first, with
+        fields as in RECORD_DTYPE.
+        """
+
+        records = np.frombuffer(bytes(self.buffer), dtype=RECORD_DTYPE)
+        if self.n <= self.size:
+            return records[:self.n].copy()
+        return np.roll(records, -(self.n % self.size))
+
+
+    def dump(self, path):
+        """
+        Write the records held, oldest first, to a .npy file, which
+        numpy.load reads back as a structured array.
+
+        Keyword arguments:
+        path -- file to write
+
+        Returns: number of records written
+        """
+
+        records = self.records()
+        with open(path, 'wb') as f:
+            np.save(f, records)
+        return len(records)
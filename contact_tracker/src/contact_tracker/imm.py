@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# Interacting multiple model estimator specialised for the contact's two
+# 6-state filters, working in preallocated buffers instead of allocating
+# new arrays on every predict and update.
+
+import copy
+
+import numpy as np
+
+
+class ContactIMMEstimator:
+    """
+    Class to run the IMM estimator of a contact. Gives the same results as
+    filterpy's IMMEstimator for the same filters, and keeps its x, P, mu,
+    M, cbar, omega, likelihood and filters attributes, but all of them are
+    arrays allocated once here and then updated in place.
+
+    The x and P of each filter are rows of self.xs and self.Ps, so that
+    mixing, prediction and the filters' own update can write straight into
+    them. The rows, and every other view the steps go through, are made
+    once, so that an update with a position or a position and velocity
+    measurement allocates nothing.
+    """
+
+    def __init__(self, filters, mu, M):
+        """
+        Define the constructor.
+
+        filters -- list of the two ContactKalmanFilters of the contact
+        mu -- initial mode probabilities, normalized here
+        M -- Markov chain transition matrix between the two filters
+        """
+
+        if len(filters) != 2:
+            raise ValueError('filters must contain exactly two filters')
+
+        self.filters = filters
+        self.N = len(filters)
+        dim_x = np.size(filters[0].x)
+
+        self.mu = np.array(mu, dtype=float)
+        self.mu /= np.sum(self.mu)
+        self.M = np.array(M, dtype=float)
+        self.cbar = np.zeros(self.N)
+        self.omega = np.zeros((self.N, self.N))
+        self.likelihood = np.zeros(self.N)
+
+        # Filter states, and the mixed initial conditions of each filter.
+        self.xs = np.zeros((self.N, dim_x))
+        self.Ps = np.zeros((self.N, dim_x, dim_x))
+        self.xs_mixed = np.zeros((self.N, dim_x))
+        self.Ps_mixed = np.zeros((self.N, dim_x, dim_x))
+        self.xs_prior = np.zeros((self.N, dim_x))
+        self.Ps_prior = np.zeros((self.N, dim_x, dim_x))
+
+        self.x = np.zeros(dim_x)
+        self.P = np.zeros((dim_x, dim_x))
+        self.x_prior = np.zeros(dim_x)
+        self.P_prior = np.zeros((dim_x, dim_x))
+        self.x_post = np.zeros(dim_x)
+        self.P_post = np.zeros((dim_x, dim_x))
+
+        # Scratch space.
+        self._y = np.zeros(dim_x)
+        self._yy = np.zeros((dim_x, dim_x))
+        self._FP = np.zeros((dim_x, dim_x))
+        self._ones = np.ones(self.N)
+        self._total = np.zeros(())
+
+        self._make_views()
+        self._compute_mixing_probabilities()
+        self.reset()
+
+
+    def _make_views(self):
+        """
+        Make the views of this estimator's arrays that predict and update go
+        through: the rows of the stacked arrays, the elements of mu and
+        omega as 0-d arrays, and y as a column and a row. numpy makes a new
+        view, or converts a scalar, every time one is asked for otherwise.
+        """
+
+        self._xs = list(self.xs)
+        self._Ps = list(self.Ps)
+        self._xs_mixed = list(self.xs_mixed)
+        self._Ps_mixed = list(self.Ps_mixed)
+        self._xs_prior = list(self.xs_prior)
+        self._Ps_prior = list(self.Ps_prior)
+        self._M = list(self.M)
+        self._omega = list(self.omega)
+        self._omega_T = self.omega.T
+        self._mu_i = [self.mu[i:i + 1].reshape(()) for i in range(self.N)]
+        self._omega_ij = [[self.omega[i, j:j + 1].reshape(()) for j in range(self.N)]
+                          for i in range(self.N)]
+        self._y_col = self._y[:, np.newaxis]
+        self._y_row = self._y[np.newaxis, :]
+
+
+    def reset(self):
+        """
+        Take each filter's x and P into this estimator's buffers and
+        recompute the combined estimate from them, as on construction.
+        The mode probabilities are left as they are.
+        """
+
+        for i, f in enumerate(self.filters):
+            self.xs[i] = np.ravel(f.x)
+            self.Ps[i] = f.P
+            f.x = self._xs[i]
+            f.P = self._Ps[i]
+
+        self._compute_state_estimate()
+        np.copyto(self.x_prior, self.x)
+        np.copyto(self.P_prior, self.P)
+        np.copyto(self.x_post, self.x)
+        np.copyto(self.P_post, self.P)
+
+
+    def copy(self):
+        """
+        Returns: a new estimator over copies of this estimator's filters,
+        holding the same values in buffers of its own. Nothing is recomputed,
+        so this is cheaper than constructing one.
+        """
+
+        imm = copy.copy(self)
+        for name, value in list(vars(imm).items()):
+            if isinstance(value, np.ndarray):
+                setattr(imm, name, value.copy())
+
+        imm._make_views()
+        imm.filters = [f.copy() for f in self.filters]
+        for i, f in enumerate(imm.filters):
+            f.x = imm._xs[i]
+            f.P = imm._Ps[i]
+
+        return imm
+
+
+    def update(self, z):
+        """
+        Add a new measurement (z) to every filter, then update the mode
+        probabilities and the combined estimate.
+
+        Keyword arguments:
+        z -- measurement for this update
+        """
+
+        for i, f in enumerate(self.filters):
+            # The filter's x and P are updated in place, so an innovation
+            # cached against the same arrays may be out of date.
+            f.innovation = None
+            x, P = f.x, f.P
+            f.update(z)
+            self.likelihood[i] = f.likelihood
+
+            # Position and velocity measurements are incorporated straight
+            # into this filter's rows. Any other binds new arrays, so take
+            # the posterior back into them.
+            if f.x is not x or f.P is not P:
+                np.copyto(x, np.ravel(f.x))
+                np.copyto(P, f.P)
+                f.x = x
+                f.P = P
+
+        # mu = cbar * likelihood, normalized
+        np.multiply(self.cbar, self.likelihood, out=self.mu)
+        np.dot(self.mu, self._ones, out=self._total)
+        np.divide(self.mu, self._total, out=self.mu)
+
+        self._compute_mixing_probabilities()
+        self._compute_state_estimate()
+        np.copyto(self.x_post, self.x)
+        np.copyto(self.P_post, self.P)
+
+
+    def predict(self):
+        """
+        Mix the filter states, then predict each filter's prior from its
+        mixed initial conditions with the F and Q the filter holds.
+        """
+
+        # x_j = sum_i omega_ij x_i
+        np.dot(self._omega_T, self.xs, out=self.xs_mixed)
+
+        # P_j = sum_i omega_ij ((x_i - x_j)(x_i - x_j)' + P_i)
+        y = self._y
+        yy = self._yy
+        for j in range(self.N):
+            Pj = self._Ps_mixed[j]
+            Pj.fill(0.)
+            for i in range(self.N):
+                np.subtract(self._xs[i], self._xs_mixed[j], out=y)
+                np.dot(self._y_col, self._y_row, out=yy)
+                yy += self._Ps[i]
+                np.multiply(yy, self._omega_ij[i][j], out=yy)
+                Pj += yy
+
+        # x = Fx, P = FPF' + Q from the mixed initial conditions
+        for j, f in enumerate(self.filters):
+            F = f.F
+            np.dot(F, self._xs_mixed[j], out=self._xs[j])
+            np.dot(F, self._Ps_mixed[j], out=self._FP)
+            np.dot(self._FP, F.T, out=self._Ps[j])
+            self._Ps[j] += f.Q
+
+            np.copyto(self._xs_prior[j], self._xs[j])
+            np.copyto(self._Ps_prior[j], self._Ps[j])
+            f.x_prior = self._xs_prior[j]
+            f.P_prior = self._Ps_prior[j]
+
+        self._compute_state_estimate()
+        np.copyto(self.x_prior, self.x)
+        np.copyto(self.P_prior, self.P)
+
+
+    def _compute_state_estimate(self):
+        """
+        Compute the combined state estimate and covariance from the filters,
+        weighted by the mode probabilities.
+        """
+
+        np.dot(self.mu, self.xs, out=self.x)
+
+        y = self._y
+        yy = self._yy
+        self.P.fill(0.)
+        for i in range(self.N):
+            np.subtract(self._xs[i], self.x, out=y)
+            np.dot(self._y_col, self._y_row, out=yy)
+            yy += self._Ps[i]
+            np.multiply(yy, self._mu_i[i], out=yy)
+            self.P += yy
+
+
+    def _compute_mixing_probabilities(self):
+        """
+        Compute the mixing probabilities omega_ij = M_ij mu_i / cbar_j.
+        """
+
+        np.dot(self.mu, self.M, out=self.cbar)
+        for i in range(self.N):
+            np.multiply(self._M[i], self._mu_i[i], out=self._omega[i])
+            np.divide(self._omega[i], self.cbar, out=self._omega[i])
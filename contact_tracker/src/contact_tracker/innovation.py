@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# Classes to hold the innovation of one Kalman filter against one measurement
+# so that the likelihood, the Bayes factor and the update can share the
+# residual, the system uncertainty and its factorization.
+
+import math
+
+import numpy as np
+
+from contact_tracker.model_cache import H_POSITION
+from contact_tracker.model_cache import H_POSITION_VELOCITY
+
+
+LOG_2PI = math.log(2.0*math.pi)
+
+
+class Innovation:
+    """
+    Class to compute the residual y = z - Hx, the system uncertainty
+    S = HPH' + R and its inverse exactly once, and to answer every question
+    about them from that one inverse. Works for any dimension of measurement.
+
+    S is at most a few rows, so it is inverted with a single numpy call and
+    the answers are plain products; a factorization and a LAPACK solve per
+    question cost more in call overhead than they save. Its log determinant
+    is only taken when a likelihood is asked for.
+    """
+
+    def __init__(self, H, x, P, R, z):
+        """
+        Define the constructor.
+
+        H -- measurement function
+        x -- state the measurement is compared against
+        P -- covariance of that state
+        R -- measurement noise matrix
+        z -- the measurement
+        """
+
+        # Keep references to the inputs so callers can tell whether this
+        # innovation was computed from the arrays they currently hold.
+        self.H = H
+        self.x = x
+        self.P = P
+        self.R = R
+        self.z = z
+
+        if H is H_POSITION or H is H_POSITION_VELOCITY:
+            # H picks the leading dim_z states, so Hx, PH' and HPH' are
+            # slices of x and P.
+            dim_z = H.shape[0]
+            self.Hx = x[:dim_z]
+            self.PHT = P[:, :dim_z]
+            self.S = P[:dim_z, :dim_z] + R
+        else:
+            # S = HPH' + R
+            self.Hx = np.dot(H, x)
+            self.PHT = np.dot(P, H.T)
+            self.S = np.dot(H, self.PHT) + R
+
+        # y = z - Hx
+        self.y = np.asarray(z, dtype=float) - self.Hx
+
+        self.S_inv = None
+        self.det_S = None
+        self._mahalanobis_sq = None
+        self._factor()
+
+
+    def _factor(self):
+        """
+        Invert S once for all later questions.
+        """
+
+        self.S_inv = np.linalg.inv(self.S)
+
+
+    def is_for(self, H, x, P, R, z):
+        """
+        Returns: True if this innovation was computed from exactly these arrays.
+        """
+
+        return (self.H is H and self.x is x and self.P is P and
+                self.R is R and self.z is z)
+
+
+    def quadratic_forms(self, V):
+        """
+        Returns: v' S^-1 v of each column v of V.
+        """
+
+        return np.einsum('ij,ik,kj->j', V, self.S_inv, V)
+
+
+    def solve(self, B):
+        """
+        Returns: S^-1 B.
+        """
+
+        return np.dot(self.S_inv, B)
+
+
+    def mahalanobis_sq(self):
+        """
+        Returns: Squared Mahalanobis distance y' S^-1 y of the residual.
+        """
+
+        if self._mahalanobis_sq is None:
+            self._mahalanobis_sq = float(np.dot(self.y, np.dot(self.S_inv, self.y)))
+        return self._mahalanobis_sq
+
+
+    def log_det_S(self):
+        """
+        Returns: Log determinant of S.
+        """
+
+        if self.det_S is None:
+            self.det_S = np.linalg.det(self.S)
+        return math.log(self.det_S)
+
+
+    def log_likelihood(self):
+        """
+        Returns: Log of the normal density of the residual, including the
+        normalizing constant.
+        """
+
+        return -0.5*(self.mahalanobis_sq() + self.log_det_S() +
+                     self.y.shape[0]*LOG_2PI)
+
+
+    def gain(self):
+        """
+        Returns: Kalman gain K = PH' S^-1.
+        """
+
+        return self.solve(self.PHT.T).T
+
+
+def _inv2(a, b, c, d):
+    """
+    Returns: determinant and inverse of the 2x2 matrix [[a, b], [c, d]], the
+    inverse as a flat (a, b, c, d) tuple of floats.
+    """
+
+    det = a*d - b*c
+    return det, (d/det, -b/det, -c/det, a/det)
+
+
+def _mul2(m, n):
+    """
+    Returns: product of two 2x2 matrices held as flat (a, b, c, d) tuples.
+    """
+
+    return (m[0]*n[0] + m[1]*n[2], m[0]*n[1] + m[1]*n[3],
+            m[2]*n[0] + m[3]*n[2], m[2]*n[1] + m[3]*n[3])
+
+
+class Innovation2(Innovation):
+    """
+    Innovation of a position-only measurement. S is 2x2, so it is inverted
+    in closed form on plain floats rather than with numpy.
+    """
+
+    @staticmethod
+    def invert(S, out):
+        """
+        Invert a 2x2 S in closed form.
+
+        Keyword arguments:
+        S -- the system uncertainty
+        out -- array shaped like S to write the inverse to
+
+        Returns: determinant of S
+        """
+
+        (a, b), (c, d) = S.tolist()
+        det, inv = _inv2(a, b, c, d)
+        out[0, 0], out[0, 1], out[1, 0], out[1, 1] = inv
+        return det
+
+
+    def _factor(self):
+        """
+        Invert S and take its determinant in closed form.
+        """
+
+        self.S_inv = np.empty(self.S.shape)
+        self.det_S = self.invert(self.S, self.S_inv)
+
+
+class Innovation4(Innovation2):
+    """
+    Innovation of a position and velocity measurement. S is 4x4 and made
+    of 2x2 position, velocity and cross blocks,
+
+        S = [A B]
+            [C D],
+
+    so it is inverted block-wise on plain floats through the 2x2 Schur
+    complement of A.
+    """
+
+    @staticmethod
+    def invert(S, out):
+        """
+        Invert a 4x4 S block-wise.
+
+        Keyword arguments:
+        S -- the system uncertainty
+        out -- array shaped like S to write the inverse to
+
+        Returns: determinant of S
+        """
+
+        s = S.tolist()
+        A = (s[0][0], s[0][1], s[1][0], s[1][1])
+        B = (s[0][2], s[0][3], s[1][2], s[1][3])
+        C = (s[2][0], s[2][1], s[3][0], s[3][1])
+        D = (s[2][2], s[2][3], s[3][2], s[3][3])
+
+        det_A, A_inv = _inv2(*A)
+        A_inv_B = _mul2(A_inv, B)
+        C_A_inv = _mul2(C, A_inv)
+
+        # Schur complement of A, D - C A^-1 B
+        C_A_inv_B = _mul2(C, A_inv_B)
+        det_Sc, Sc_inv = _inv2(D[0] - C_A_inv_B[0], D[1] - C_A_inv_B[1],
+                               D[2] - C_A_inv_B[2], D[3] - C_A_inv_B[3])
+
+        TR = _mul2(A_inv_B, Sc_inv)
+        BL = _mul2(Sc_inv, C_A_inv)
+        TR_C_A_inv = _mul2(TR, C_A_inv)
+
+        # S^-1 = [A^-1 + TR C A^-1   -TR    ]
+        #        [-BL               Sc^-1  ]
+        out[0, 0], out[0, 1] = A_inv[0] + TR_C_A_inv[0], A_inv[1] + TR_C_A_inv[1]
+        out[1, 0], out[1, 1] = A_inv[2] + TR_C_A_inv[2], A_inv[3] + TR_C_A_inv[3]
+        out[0, 2], out[0, 3], out[1, 2], out[1, 3] = -TR[0], -TR[1], -TR[2], -TR[3]
+        out[2, 0], out[2, 1], out[3, 0], out[3, 1] = -BL[0], -BL[1], -BL[2], -BL[3]
+        out[2, 2], out[2, 3], out[3, 2], out[3, 3] = Sc_inv
+        return det_A*det_Sc
+
+
+INNOVATION_KERNELS = {2: Innovation2, 4: Innovation4}
+
+
+def make_innovation(H, x, P, R, z):
+    """
+    Return the innovation of a state against a measurement, computed with
+    the closed-form kernel for the dimension of the measurement if there is
+    one, and with the generic one otherwise.
+
+    Keyword arguments:
+    H -- measurement function
+    x -- state the measurement is compared against
+    P -- covariance of that state
+    R -- measurement noise matrix
+    z -- the measurement
+    """
+
+    kernel = INNOVATION_KERNELS.get(H.shape[0], Innovation)
+    return kernel(H, x, P, R, z)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# Conversion between the local map frame, an east-north-up tangent plane
+# at the map origin, and WGS84 latitude/longitude, done in-process and on
+# whole arrays of positions at once.
+
+import numpy as np
+
+
+# WGS84 ellipsoid.
+WGS84_A = 6378137.0
+WGS84_F = 1.0/298.257223563
+WGS84_E2 = WGS84_F*(2.0 - WGS84_F)
+
+
+def geodetic_to_ecef(latitude, longitude, altitude):
+    """
+    Convert geodetic coordinates to earth-centered earth-fixed coordinates.
+
+    Keyword arguments:
+    latitude -- latitude(s), in degrees
+    longitude -- longitude(s), in degrees
+    altitude -- height(s) above the ellipsoid, in m
+
+    Returns: X, Y, Z arrays, in m
+    """
+
+    lat = np.radians(latitude)
+    lon = np.radians(longitude)
+    sin_lat = np.sin(lat)
+    cos_lat = np.cos(lat)
+    N = WGS84_A / np.sqrt(1.0 - WGS84_E2*sin_lat**2)
+
+    X = (N + altitude)*cos_lat*np.cos(lon)
+    Y = (N + altitude)*cos_lat*np.sin(lon)
+    Z = (N*(1.0 - WGS84_E2) + altitude)*sin_lat
+    return X, Y, Z
+
+
+def ecef_to_geodetic(X, Y, Z, iterations=4):
+    """
+    Convert earth-centered earth-fixed coordinates to geodetic coordinates.
+    The latitude is found by fixed-point iteration, which converges to well
+    under a millimeter within a few iterations near the earth's surface.
+
+    Keyword arguments:
+    X, Y, Z -- coordinates, in m
+    iterations -- number of latitude refinements
+
+    Returns: latitude, longitude (degrees) and altitude (m) arrays
+    """
+
+    p = np.hypot(X, Y)
+    lon = np.arctan2(Y, X)
+    lat = np.arctan2(Z, p*(1.0 - WGS84_E2))
+
+    for _ in range(iterations):
+        sin_lat = np.sin(lat)
+        N = WGS84_A / np.sqrt(1.0 - WGS84_E2*sin_lat**2)
+        alt = p/np.cos(lat) - N
+        lat = np.arctan2(Z, p*(1.0 - WGS84_E2*N/(N + alt)))
+
+    sin_lat = np.sin(lat)
+    N = WGS84_A / np.sqrt(1.0 - WGS84_E2*sin_lat**2)
+    alt = p/np.cos(lat) - N
+
+    return np.degrees(lat), np.degrees(lon), alt
+
+
+class LocalTangentPlane:
+    """
+    Class to convert positions in the map frame, taken as east-north-up
+    meters from the map origin, to and from WGS84.
+    """
+
+    def __init__(self, latitude, longitude, altitude=0.0):
+        """
+        Define the constructor.
+
+        latitude -- latitude of the map origin, in degrees
+        longitude -- longitude of the map origin, in degrees
+        altitude -- height of the map origin above the ellipsoid, in m
+        """
+
+        self.origin = (float(latitude), float(longitude), float(altitude))
+        self.origin_ecef = np.array(geodetic_to_ecef(latitude, longitude, altitude))
+
+        lat = np.radians(latitude)
+        lon = np.radians(longitude)
+        sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+        sin_lon, cos_lon = np.sin(lon), np.cos(lon)
+
+        # Rows are the east, north and up unit vectors in ECEF.
+        self.rotation = np.array([
+            [-sin_lon, cos_lon, .0],
+            [-sin_lat*cos_lon, -sin_lat*sin_lon, cos_lat],
+            [cos_lat*cos_lon, cos_lat*sin_lon, sin_lat]])
+
+
+    def to_wgs84(self, x, y, z=0.0):
+        """
+        Convert map positions to WGS84.
+
+        Keyword arguments:
+        x -- east position(s) in the map frame, in m
+        y -- north position(s) in the map frame, in m
+        z -- up position(s) in the map frame, in m
+
+        Returns: latitude, longitude (degrees) and altitude (m) arrays
+        """
+
+        enu = np.array(np.broadcast_arrays(x, y, z), dtype=float)
+        ecef = np.tensordot(self.rotation.T, enu, axes=1)
+        ecef += self.origin_ecef.reshape((3,) + (1,)*(ecef.ndim - 1))
+        return ecef_to_geodetic(ecef[0], ecef[1], ecef[2])
+
+
+    def to_map(self, latitude, longitude, altitude=0.0):
+        """
+        Convert WGS84 positions to the map frame.
+
+        Keyword arguments:
+        latitude -- latitude(s), in degrees
+        longitude -- longitude(s), in degrees
+        altitude -- height(s) above the ellipsoid, in m
+
+        Returns: x, y, z arrays in the map frame, in m
+        """
+
+        ecef = np.array(geodetic_to_ecef(*np.broadcast_arrays(latitude, longitude, altitude)),
+                        dtype=float)
+        ecef -= self.origin_ecef.reshape((3,) + (1,)*(ecef.ndim - 1))
+        enu = np.tensordot(self.rotation, ecef, axes=1)
+        return enu[0], enu[1], enu[2]
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# Track-to-track merging: finding pairs of contacts whose states cannot be
+# told apart, and fusing each such pair into one contact.
+
+import numpy as np
+
+from contact_tracker.innovation import make_innovation
+from contact_tracker.model_cache import H_POSITION_VELOCITY
+from contact_tracker.model_cache import MODEL_INDEX
+from contact_tracker.spatial_index import SpatialGrid
+
+
+def merge_candidates(x, P, cell_size, gate):
+    """
+    Find the pairs of contacts whose positions and velocities are within a
+    chi-square gate of each other, under the sum of their covariances.
+
+    A pair can only pass the gate if each position lies within the other's
+    disc of radius sqrt(gate * trace of its position covariance), so only
+    pairs whose discs overlap in a spatial grid are tested.
+
+    Keyword arguments:
+    x -- array of shape (n, 6) of the contacts' states at a common time
+    P -- array of shape (n, 6, 6) of the covariances of those states
+    cell_size -- side length of the cells of the spatial grid, in m
+    gate -- largest squared Mahalanobis distance of a pair that passes
+
+    Returns: arrays i, j and d2 of the rows of the passing pairs, with
+    i < j, and their squared Mahalanobis distances, and the number of
+    pairs tested
+    """
+
+    n = len(x)
+    empty = np.zeros(0, dtype=np.intp)
+    if n < 2:
+        return empty, empty, np.zeros(0), 0
+
+    radii = np.sqrt(gate*(P[:, 0, 0] + P[:, 1, 1]))
+    grid = SpatialGrid(cell_size)
+    grid.rebuild(x[:, 0:2], radii)
+
+    first = []
+    second = []
+    for i in range(n):
+        rows = grid.query(x[i, 0], x[i, 1], radii[i])
+        rows = rows[rows > i]
+        first.append(np.full(len(rows), i, dtype=np.intp))
+        second.append(rows)
+
+    i = np.concatenate(first)
+    j = np.concatenate(second)
+    if len(i) == 0:
+        return empty, empty, np.zeros(0), 0
+
+    # d' (Pi + Pj)^-1 d over position and velocity
+    d = x[i, 0:4] - x[j, 0:4]
+    S = P[i, 0:4, 0:4] + P[j, 0:4, 0:4]
+    d2 = np.einsum('ki,ki->k', d, np.linalg.solve(S, d[..., np.newaxis])[..., 0])
+
+    passed = d2 <= gate
+    return i[passed], j[passed], d2[passed], len(d2)
+
+
+def select_merges(i, j, d2):
+    """
+    Choose which of the passing pairs to merge, closest first, so that no
+    contact takes part in more than one merge.
+
+    Keyword arguments:
+    i -- rows of the first contact of each pair
+    j -- rows of the second contact of each pair
+    d2 -- squared Mahalanobis distance of each pair
+
+    Returns: list of (i, j) of the pairs to merge
+    """
+
+    merged = set()
+    pairs = []
+    for k in np.argsort(d2, kind='mergesort'):
+        a = int(i[k])
+        b = int(j[k])
+        if a in merged or b in merged:
+            continue
+        merged.add(a)
+        merged.add(b)
+        pairs.append((a, b))
+    return pairs
+
+
+def fuse(xa, Pa, xb, Pb):
+    """
+    Fuse two estimates of the same state by updating the first with the
+    position and velocity of the second as a measurement. Their errors are
+    taken to be independent.
+
+    Keyword arguments:
+    xa, Pa -- state and covariance of the estimate kept
+    xb, Pb -- state and covariance of the estimate fused into it
+
+    Returns: the fused state and covariance
+    """
+
+    inn = make_innovation(H_POSITION_VELOCITY, xa, Pa, Pb[0:4, 0:4], xb[0:4])
+    K = inn.gain()
+
+    # x = x + Ky, P = (I - KH)P
+    x = xa + np.dot(K, inn.y)
+    P = Pa - np.dot(K, inn.PHT.T)
+    return x, 0.5*(P + P.T)
+
+
+def fuse_contacts(bank, keep, drop):
+    """
+    Fuse the filters of one contact into those of another, filter by
+    filter, at the later of the times the two were last measured. The
+    contact kept takes that time as its own. The bank is updated, but the
+    contact dropped is left for the caller to retire.
+
+    Keyword arguments:
+    bank -- the ContactBank holding both contacts
+    keep -- the Contact object to fuse into
+    drop -- the Contact object to fuse from
+    """
+
+    later = keep if keep.last_measured >= drop.last_measured else drop
+    rows = [bank.registry.row(keep.id), bank.registry.row(drop.id)]
+    xs, Ps = bank.predict_states(rows, later.last_measured)
+
+    for kf in keep.filter_bank.filters:
+        m = MODEL_INDEX[kf.filter_type]
+        kf.x, kf.P = fuse(xs[0, m], Ps[0, m], xs[1, m], Ps[1, m])
+
+    keep.filter_bank.reset()
+    keep.last_measured = later.last_measured
+    bank.sync(keep)
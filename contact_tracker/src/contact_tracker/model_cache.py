@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+# Caches of the process model matrices F and Q, and of the measurement
+# model matrices H and R. Detects arrive at a few discrete rates from a few
+# sensors, so the same matrices come up over and over again.
+
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Position of each filter type along the model axis of stacked arrays.
+MODEL_INDEX = {'first': 0, 'second': 1}
+FILTER_TYPES = ('first', 'second')
+
+
+def transition_matrices(dt):
+    """
+    Build the F matrices of both filter types for an array of time steps.
+
+    Keyword arguments:
+    dt -- array of shape (n,) holding the time steps
+
+    Returns: array of shape (n, 2, 6, 6)
+    """
+
+    n = dt.shape[0]
+    F = np.zeros((n, 2, 6, 6))
+    idx = np.arange(6)
+    F[:, :, idx, idx] = 1.0
+    F[:, 0, 4, 4] = .0
+    F[:, 0, 5, 5] = .0
+
+    for m in range(2):
+        F[:, m, 0, 2] = dt
+        F[:, m, 1, 3] = dt
+        F[:, m, 2, 4] = dt
+        F[:, m, 3, 5] = dt
+        F[:, m, 0, 4] = 0.5*dt**2
+        F[:, m, 1, 5] = 0.5*dt**2
+
+    return F
+
+
+def process_noise_blocks(dt, spectral_density):
+    """
+    Build the 3x3 blocks of the continuous white noise Q matrices of both
+    filter types for an array of time steps, over the position, velocity
+    and acceleration of one axis. Q holds the same block for the x and y
+    axes and zero between them. The block of the first order model is
+    zero-padded from 2x2.
+
+    Keyword arguments:
+    dt -- array of shape (n,) holding the time steps
+    spectral_density -- array of shape (n, 2) holding the spectral density
+                        of each filter
+
+    Returns: array of shape (n, 2, 3, 3)
+    """
+
+    n = dt.shape[0]
+    dt2 = dt**2
+    dt3 = dt2*dt
+
+    base = np.zeros((n, 2, 3, 3))
+
+    # Constant velocity model, naturally a 4x4.
+    base[:, 0, 0, 0] = dt3/3.
+    base[:, 0, 0, 1] = base[:, 0, 1, 0] = dt2/2.
+    base[:, 0, 1, 1] = dt
+
+    # Constant acceleration model.
+    base[:, 1, 0, 0] = dt3*dt2/20.
+    base[:, 1, 0, 1] = base[:, 1, 1, 0] = dt2*dt2/8.
+    base[:, 1, 0, 2] = base[:, 1, 2, 0] = dt3/6.
+    base[:, 1, 1, 1] = dt3/3.
+    base[:, 1, 1, 2] = base[:, 1, 2, 1] = dt2/2.
+    base[:, 1, 2, 2] = dt
+
+    base *= spectral_density[:, :, np.newaxis, np.newaxis]
+    return base
+
+
+def process_noise_matrices(dt, spectral_density):
+    """
+    Build the zero-padded continuous white noise Q matrices of both filter
+    types for an array of time steps. Matches Q_continuous_white_noise with
+    block_size=2 and order_by_dim=False.
+
+    Keyword arguments:
+    dt -- array of shape (n,) holding the time steps
+    spectral_density -- array of shape (n, 2) holding the spectral density
+                        of each filter
+
+    Returns: array of shape (n, 2, 6, 6)
+    """
+
+    base = process_noise_blocks(dt, spectral_density)
+
+    Q = np.zeros((dt.shape[0], 2, 6, 6))
+    Q[:, :, 0::2, 0::2] = base
+    Q[:, :, 1::2, 1::2] = base
+
+    return Q
+
+
+def _apply_transition(p, v, a, dt, half_dt2, keep, tmp):
+    """
+    Multiply by transition matrices along one axis of a transposed stack,
+    in place.
+
+    Keyword arguments:
+    p, v, a -- views of the position, velocity and acceleration entries
+    dt, half_dt2, keep -- dt, dt^2/2 and the acceleration factor of each filter
+    tmp -- scratch array shaped like p
+    """
+
+    np.multiply(v, dt, out=tmp)
+    p += tmp
+    np.multiply(a, half_dt2, out=tmp)
+    p += tmp
+    np.multiply(a, dt, out=tmp)
+    v += tmp
+    a *= keep
+
+
+def predict_kinematic(dt, spectral_density, x, P):
+    """
+    Compute the priors x' = Fx and P' = FPF' + Q of both filter types for
+    an array of time steps, with F and Q as built by transition_matrices and
+    process_noise_matrices, but without forming F or any dense product.
+
+    F acts on the x and y axes alike: multiplying by it on the left adds dt
+    times the velocity rows and dt^2/2 times the acceleration rows to the
+    position rows, adds dt times the acceleration rows to the velocity rows,
+    and zeroes the acceleration rows of the first order model. Multiplying
+    by F' on the right does the same to the columns. The stacks are
+    transposed so that the filters lie along the last axis, which makes
+    each of those steps one operation over every filter.
+
+    Keyword arguments:
+    dt -- array of shape (n,) holding the time steps
+    spectral_density -- array of shape (n, 2) holding the spectral density
+                        of each filter
+    x -- array of shape (n, 2, 6) holding the state of each filter
+    P -- array of shape (n, 2, 6, 6) holding the covariance of each filter
+
+    Returns: x' and P' arrays, shaped like x and P
+    """
+
+    n = dt.shape[0]
+    N = 2*n
+    dt_N = np.repeat(dt, 2)
+    half_dt2 = 0.5*dt_N**2
+    keep = np.zeros((n, 2))
+    keep[:, MODEL_INDEX['second']] = 1.0
+    keep = keep.reshape(N)
+    tmp = np.empty((12, N))
+
+    # Row k of xt holds state k of every filter: [x, y, vx, vy, ax, ay].
+    xt = x.reshape(N, 6).T.copy()
+    X = xt.reshape(3, 2, N)
+    _apply_transition(X[0], X[1], X[2], dt_N, half_dt2, keep, tmp[:2])
+
+    # Row 6i + j of Pt holds P[i, j] of every filter.
+    Pt = P.reshape(N, 36).T.copy()
+    rows = Pt.reshape(3, 12, N)
+    _apply_transition(rows[0], rows[1], rows[2], dt_N, half_dt2, keep, tmp)
+    cols = Pt.reshape(6, 3, 2, N)
+    _apply_transition(cols[:, 0], cols[:, 1], cols[:, 2], dt_N, half_dt2, keep,
+                      tmp.reshape(6, 2, N))
+
+    # Q only has the same 3x3 block on the x and on the y axis, so add
+    # those terms in place rather than forming Q and adding all of it.
+    # Pt.reshape(3, 2, 3, 2, N)[i, a, j, b] holds P[2i + a, 2j + b].
+    blocks = process_noise_blocks(dt, spectral_density).reshape(N, 3, 3).transpose(1, 2, 0)
+    axes = Pt.reshape(3, 2, 3, 2, N)
+    axes[:, 0, :, 0] += blocks
+    axes[:, 1, :, 1] += blocks
+
+    x_prior = xt.T.reshape(x.shape)
+    P_prior = Pt.T.reshape(P.shape)
+    return x_prior, P_prior
+
+
+# Below this many contacts the dense FPF' of predict_dense is faster than
+# predict_kinematic, whose fixed cost of many small operations only pays
+# for itself over larger banks.
+DENSE_PREDICT_MAX = 50
+
+
+def predict_dense(dt, spectral_density, x, P):
+    """
+    Compute the priors x' = Fx and P' = FPF' + Q of both filter types for
+    an array of time steps, with F built as dense matrices.
+
+    Keyword arguments:
+    dt -- array of shape (n,) holding the time steps
+    spectral_density -- array of shape (n, 2) holding the spectral density
+                        of each filter
+    x -- array of shape (n, 2, 6) holding the state of each filter
+    P -- array of shape (n, 2, 6, 6) holding the covariance of each filter
+
+    Returns: x' and P' arrays, shaped like x and P
+    """
+
+    F = transition_matrices(dt)
+    x_prior = np.einsum('nmij,nmj->nmi', F, x)
+    P_prior = np.matmul(np.matmul(F, P), F.swapaxes(-1, -2))
+
+    # Add the x and y blocks of Q in place, without forming Q.
+    # P_prior.reshape(n, 2, 3, 2, 3, 2)[..., i, a, j, b] holds P'[2i + a, 2j + b].
+    blocks = process_noise_blocks(dt, spectral_density)
+    axes = P_prior.reshape(P.shape[:2] + (3, 2, 3, 2))
+    axes[:, :, :, 0, :, 0] += blocks
+    axes[:, :, :, 1, :, 1] += blocks
+    return x_prior, P_prior
+
+
+def predict_priors(dt, spectral_density, x, P):
+    """
+    Compute the priors of both filter types for an array of time steps with
+    predict_dense for fewer than DENSE_PREDICT_MAX contacts, and with
+    predict_kinematic for more. Arguments and results are as for either.
+    """
+
+    if dt.shape[0] < DENSE_PREDICT_MAX:
+        return predict_dense(dt, spectral_density, x, P)
+    return predict_kinematic(dt, spectral_density, x, P)
+
+
+class ProcessModelCache:
+    """
+    Class to map (filter_type, quantized dt, spectral density) to read-only
+    F and Q matrices, evicting the least recently used entry when full.
+    """
+
+    def __init__(self, maxsize=512, dt_tolerance=0.001):
+        """
+        Define the constructor.
+
+        maxsize -- maximum number of entries to keep
+        dt_tolerance -- time steps are rounded to a multiple of this before
+                        being used as a key, in s. 0 disables the rounding.
+        """
+
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.configure(maxsize, dt_tolerance)
+
+
+    def configure(self, maxsize, dt_tolerance):
+        """
+        Change the size and quantization of the cache. Changing the
+        quantization empties the cache.
+
+        Keyword arguments:
+        maxsize -- maximum number of entries to keep
+        dt_tolerance -- time steps are rounded to a multiple of this, in s
+        """
+
+        if getattr(self, 'dt_tolerance', None) != dt_tolerance:
+            self.entries.clear()
+
+        self.maxsize = max(int(maxsize), 2)
+        self.dt_tolerance = float(dt_tolerance)
+
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+
+    def quantize(self, dt):
+        """
+        Round time steps to a multiple of dt_tolerance.
+
+        Keyword arguments:
+        dt -- scalar or array of time steps, in s
+        """
+
+        if self.dt_tolerance <= 0:
+            return dt
+        return np.round(np.asarray(dt) / self.dt_tolerance) * self.dt_tolerance
+
+
+    def _lookup(self, key):
+        """
+        Return the entry for key, marking it most recently used, or None.
+        """
+
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries[key] = entry
+        self.hits += 1
+        return entry
+
+
+    def _store(self, key, F, Q):
+        """
+        Make F and Q read-only and store them under key.
+        """
+
+        F.flags.writeable = False
+        Q.flags.writeable = False
+        self.entries[key] = (F, Q)
+
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+
+    def get(self, filter_type, dt, spectral_density):
+        """
+        Return the read-only F and Q of one filter for a time step.
+
+        Keyword arguments:
+        filter_type -- type/order of the filter, 'first' or 'second'
+        dt -- time step, in s
+        spectral_density -- spectral density of the filter's process noise
+        """
+
+        qdt = float(self.quantize(dt))
+        key = (filter_type, qdt, float(spectral_density))
+        entry = self._lookup(key)
+
+        if entry is None:
+            m = MODEL_INDEX[filter_type]
+            sd = np.zeros((1, 2))
+            sd[0, m] = spectral_density
+            F = transition_matrices(np.array([qdt]))[0, m].copy()
+            Q = process_noise_matrices(np.array([qdt]), sd)[0, m].copy()
+            self._store(key, F, Q)
+            entry = (F, Q)
+
+        return entry
+
+
+    def stats(self):
+        """
+        Returns: Dictionary of the cache's size and hit, miss and eviction counts.
+        """
+
+        return {'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+
+# Cache shared by every contact and filter in the process.
+PROCESS_MODELS = ProcessModelCache()
+
+
+def _read_only(a):
+    a.flags.writeable = False
+    return a
+
+
+# Measurement functions for position only and position plus velocity detects.
+H_POSITION = _read_only(np.array([
+    [1., .0, .0, .0, .0, .0],
+    [.0, 1., .0, .0, .0, .0]]))
+
+H_POSITION_VELOCITY = _read_only(np.array([
+    [1., .0, .0, .0, .0, .0],
+    [.0, 1., .0, .0, .0, .0],
+    [.0, .0, 1., .0, .0, .0],
+    [.0, .0, .0, 1., .0, .0]]))
+
+
+class MeasurementModelCache:
+    """
+    Class to hand out the read-only H and R of a detect, shared by every
+    filter of every contact. The last R of each sensor is kept and reused
+    for as long as that sensor reports the same covariance.
+    """
+
+    def __init__(self):
+        """
+        Define the constructor.
+        """
+
+        self.by_sensor = {}
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, detect_info):
+        """
+        Return the H and R matrices for a detect.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info to use
+        """
+
+        pc = detect_info['pos_covar']
+        tc = detect_info['twist_covar']
+
+        if math.isnan(detect_info['x_vel']):
+            signature = (pc[0], pc[7])
+        else:
+            signature = (pc[0], pc[7], tc[0], tc[7])
+
+        entry = self.by_sensor.get(detect_info['sensor_id'])
+        if entry is not None and entry[0] == signature:
+            self.hits += 1
+            return entry[1], entry[2]
+
+        self.misses += 1
+        if len(signature) == 2:
+            H = H_POSITION
+        else:
+            H = H_POSITION_VELOCITY
+        R = _read_only(np.diag(np.array(signature, dtype=float)))
+
+        self.by_sensor[detect_info['sensor_id']] = (signature, H, R)
+        return H, R
+
+
+    def stats(self):
+        """
+        Returns: Dictionary of the number of sensors seen and the hit and miss counts.
+        """
+
+        return {'sensors': len(self.by_sensor),
+                'hits': self.hits,
+                'misses': self.misses}
+
+
+# Cache shared by every contact and filter in the process.
+MEASUREMENT_MODELS = MeasurementModelCache()
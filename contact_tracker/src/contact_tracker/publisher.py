@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# Output stage that builds and publishes messages on its own thread, so
+# slow serialization or subscribers do not add to the latency of the
+# detect callback.
+
+import threading
+from collections import OrderedDict
+
+
+class AsyncPublisher:
+    """
+    Class to own a set of publishers and feed them from a bounded queue
+    serviced by a worker thread.
+
+    Updates are queued under a key, normally the contact id. A newer update
+    for a key that is still waiting replaces the older one, and when the
+    queue is full the oldest waiting update is dropped. The worker takes
+    every update waiting at once, so their messages are built together.
+    """
+
+    def __init__(self, publishers, build_msgs, maxsize=100, on_error=None):
+        """
+        Define the constructor.
+
+        publishers -- list of publishers owned by this stage
+        build_msgs -- function taking a list of queued updates, oldest first,
+                      and returning for each a list of one message (or None
+                      to skip) per publisher, in the same order
+        maxsize -- maximum number of updates waiting to be published
+        on_error -- function called on the worker thread with the exception and
+                    the number of errors so far whenever building or publishing
+                    an update fails, or None to only count the errors
+        """
+
+        self.publishers = publishers
+        self.build_msgs = build_msgs
+        self.maxsize = max(int(maxsize), 1)
+        self.on_error = on_error
+
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.running = True
+
+        self.submitted = 0
+        self.published = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+
+        self.worker = threading.Thread(target=self._run, name='async_publisher')
+        self.worker.daemon = True
+        self.worker.start()
+
+
+    def submit(self, key, update):
+        """
+        Queue an update for publishing. Returns immediately.
+
+        Keyword arguments:
+        key -- updates with the same key are coalesced into the latest one
+        update -- everything build_msgs needs, which must not change afterwards
+        """
+
+        with self.condition:
+            self.submitted += 1
+            if key in self.pending:
+                del self.pending[key]
+                self.coalesced += 1
+            elif len(self.pending) >= self.maxsize:
+                self.pending.popitem(last=False)
+                self.dropped += 1
+
+            self.pending[key] = update
+            self.condition.notify()
+
+
+    def _run(self):
+        """
+        Build and publish queued updates, oldest first, until shut down
+        and the queue is empty.
+        """
+
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                updates = list(self.pending.values())
+                self.pending.clear()
+
+            try:
+                batch = self.build_msgs(updates)
+            except Exception as e:
+                self._failed(e, len(updates))
+                continue
+
+            for msgs in batch:
+                try:
+                    for pub, msg in zip(self.publishers, msgs):
+                        if msg is not None:
+                            pub.publish(msg)
+                    with self.condition:
+                        self.published += 1
+
+                except Exception as e:
+                    self._failed(e, 1)
+
+
+    def _failed(self, error, n):
+        """
+        Count updates that failed to be built or published, and report them.
+
+        Keyword arguments:
+        error -- the exception raised
+        n -- number of updates that failed
+        """
+
+        with self.condition:
+            self.errors += n
+            self.last_error = error
+            errors = self.errors
+        if self.on_error is not None:
+            self.on_error(error, errors)
+
+
+    def depth(self):
+        """
+        Returns: Number of updates waiting to be published.
+        """
+
+        with self.condition:
+            return len(self.pending)
+
+
+    def stats(self):
+        """
+        Returns: Dictionary of the queue depth and the update counters.
+        """
+
+        with self.condition:
+            return {'depth': len(self.pending),
+                    'submitted': self.submitted,
+                    'published': self.published,
+                    'coalesced': self.coalesced,
+                    'dropped': self.dropped,
+                    'errors': self.errors}
+
+
+    def shutdown(self, timeout=1.0):
+        """
+        Stop the worker once it has published what is still queued.
+
+        Keyword arguments:
+        timeout -- longest time to wait for the worker, in s
+        """
+
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.worker.join(timeout)
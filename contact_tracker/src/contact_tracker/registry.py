@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# Slot map holding the live contacts under integer handles. Slots of deleted
+# contacts are reused, and a generation count per slot tells handles to a
+# deleted contact from handles to the contact now in its slot. The live
+# contacts are kept packed, so arrays with a row per contact can be indexed
+# by the registry directly.
+
+SLOT_BITS = 32
+SLOT_MASK = (1 << SLOT_BITS) - 1
+
+
+class ContactRegistry:
+    """
+    Class to hand out dense integer handles to contacts.
+
+    A handle packs the contact's slot in its low SLOT_BITS bits and the
+    slot's generation at the time the contact was added above them. Looking
+    up a handle whose generation no longer matches its slot finds nothing.
+
+    Each slot in use points at the contact's row in self.contacts, which
+    holds the live contacts packed. A contact is added in the next row, and
+    removing one moves the last contact into its row. The ContactBank keeps
+    its rows in step with these.
+
+    Supports the parts of the dict interface the tracker uses, with handles
+    as keys.
+    """
+
+    def __init__(self):
+        """
+        Define the constructor.
+        """
+
+        self.contacts = []
+        self.rows = []
+        self.generations = []
+        self.free = []
+
+
+    def __len__(self):
+        return len(self.contacts)
+
+
+    def row(self, handle):
+        """
+        Returns: the row in self.contacts of a live handle, or None if the
+        handle is stale.
+        """
+
+        slot = handle & SLOT_MASK
+        if slot < len(self.rows) and self.generations[slot] == handle >> SLOT_BITS:
+            return self.rows[slot]
+        return None
+
+
+    def add(self, contact):
+        """
+        Register a contact in a free slot, and set contact.id to its handle.
+
+        Keyword arguments:
+        contact -- the Contact object to register
+
+        Returns: the contact's handle
+        """
+
+        if self.free:
+            slot = self.free.pop()
+        else:
+            slot = len(self.rows)
+            self.rows.append(None)
+            self.generations.append(0)
+
+        handle = (self.generations[slot] << SLOT_BITS) | slot
+        contact.id = handle
+        self.rows[slot] = len(self.contacts)
+        self.contacts.append(contact)
+        return handle
+
+
+    def remove(self, handle):
+        """
+        Unregister a contact and free its slot, moving the last contact
+        into its row.
+
+        Keyword arguments:
+        handle -- handle of the contact to remove
+
+        Returns: the removed Contact object
+        """
+
+        i = self.row(handle)
+        if i is None:
+            raise KeyError(handle)
+
+        contact = self.contacts[i]
+        moved = self.contacts.pop()
+        if moved is not contact:
+            self.contacts[i] = moved
+            self.rows[moved.id & SLOT_MASK] = i
+
+        slot = handle & SLOT_MASK
+        self.rows[slot] = None
+        self.generations[slot] += 1
+        self.free.append(slot)
+        return contact
+
+
+    def get(self, handle, default=None):
+        """
+        Returns: the contact of a live handle, or default if the handle is stale.
+        """
+
+        i = self.row(handle)
+        if i is None:
+            return default
+        return self.contacts[i]
+
+
+    def __getitem__(self, handle):
+        i = self.row(handle)
+        if i is None:
+            raise KeyError(handle)
+        return self.contacts[i]
+
+
+    def __delitem__(self, handle):
+        self.remove(handle)
+
+
+    def __contains__(self, handle):
+        return self.row(handle) is not None
+
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+    def keys(self):
+        """
+        Returns: list of the handles of the live contacts, in row order.
+        """
+
+        return [c.id for c in self.contacts]
+
+
+    def values(self):
+        """
+        Returns: list of the live contacts, in row order.
+        """
+
+        return list(self.contacts)
+
+
+    def items(self):
+        """
+        Returns: list of (handle, contact) of the live contacts, in row order.
+        """
+
+        return [(c.id, c) for c in self.contacts]
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# Offline replay of recorded detects through the tracking engine, in
+# timestamp order and as fast as they can be processed, with stale deletion,
+# merging and scan timeouts run on the detects' clock instead of timers.
+
+import io
+import heapq
+
+from contact_tracker.engine import TrackingEngine
+from contact_tracker.engine import check_detect
+from contact_tracker.engine import detect_from_msg
+from contact_tracker.stage_timers import clock
+
+# Columns of a flat detect export. The variances are the diagonal terms of
+# the 6x6 pose and twist covariances, and xy_covar their x-y term.
+DETECT_COLUMNS = ['stamp', 'sensor_id', 'x_pos', 'y_pos', 'x_vel', 'y_vel',
+                  'x_var', 'y_var', 'xy_covar', 'x_vel_var', 'y_vel_var']
+
+# Columns of a track file, one row per update made to a contact.
+TRACK_COLUMNS = ['stamp', 'name', 'new', 'sensor_id',
+                 'x_pos', 'y_pos', 'x_vel', 'y_vel', 'x_acc', 'y_acc']
+
+# Period of the check for a scan whose window has passed, as in the node.
+SCAN_CHECK_PERIOD = 0.1
+
+
+def read_bag(path, topic='/detects'):
+    """
+    Read the detects on a topic of a bag file, in the order they were
+    recorded. rosbag is only imported when a bag is read.
+
+    Keyword arguments:
+    path -- the bag file
+    topic -- topic of the marine_msgs/Detect messages
+
+    Returns: generator of the dictionaries containing the detect info
+    """
+
+    import rosbag
+
+    with rosbag.Bag(path) as bag:
+        for _, msg, _ in bag.read_messages(topics=[topic]):
+            yield detect_from_msg(msg)
+
+
+def covariances(x_var, y_var, xy_covar, x_vel_var, y_vel_var):
+    """
+    Returns: row-major 6x6 pose and twist covariances, as lists, holding
+    the given terms and zero elsewhere.
+    """
+
+    pos_covar = [.0]*36
+    pos_covar[0] = x_var
+    pos_covar[1] = pos_covar[6] = xy_covar
+    pos_covar[7] = y_var
+    twist_covar = [.0]*36
+    twist_covar[0] = x_vel_var
+    twist_covar[7] = y_vel_var
+    return pos_covar, twist_covar
+
+
+def read_csv(path):
+    """
+    Read the detects of a flat export: a comma separated file with a header
+    row naming DETECT_COLUMNS, in any order, and a row per detect. Missing
+    positions and velocities are written as nan.
+
+    Keyword arguments:
+    path -- the file to read
+
+    Returns: generator of the dictionaries containing the detect info
+    """
+
+    with io.open(path, 'r', encoding='utf-8') as f:
+        header = f.readline().strip().split(',')
+        col = dict((name, header.index(name)) for name in DETECT_COLUMNS)
+        for line in f:
+            row = line.rstrip('\n').split(',')
+            if len(row) < len(header):
+                continue
+            pos_covar, twist_covar = covariances(*[float(row[col[name]]) for name in DETECT_COLUMNS[6:]])
+            yield {'stamp': float(row[col['stamp']]),
+                   'sensor_id': str(row[col['sensor_id']]),
+                   'x_pos': float(row[col['x_pos']]),
+                   'y_pos': float(row[col['y_pos']]),
+                   'x_vel': float(row[col['x_vel']]),
+                   'y_vel': float(row[col['y_vel']]),
+                   'pos_covar': pos_covar,
+                   'twist_covar': twist_covar}
+
+
+def write_csv(detects, path):
+    """
+    Write detects as a flat export that read_csv() reads back.
+
+    Keyword arguments:
+    detects -- iterable of the dictionaries containing the detect info
+    path -- the file to write
+
+    Returns: number of detects written
+    """
+
+    n = 0
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(u','.join(DETECT_COLUMNS) + u'\n')
+        for d in detects:
+            pc = d['pos_covar']
+            tc = d['twist_covar']
+            f.write(u'%r,%s,%r,%r,%r,%r,%r,%r,%r,%r,%r\n' %
+                    (d['stamp'], d['sensor_id'], d['x_pos'], d['y_pos'], d['x_vel'], d['y_vel'],
+                     float(pc[0]), float(pc[7]), float(pc[6]), float(tc[0]), float(tc[7])))
+            n += 1
+    return n
+
+
+def in_stamp_order(detects, window):
+    """
+    Put a stream of detects, recorded in the order they arrived, back into
+    the order of their stamps. Detects are held in a heap until one stamped
+    more than window later arrives, so only that much of the stream is in
+    memory; a detect arriving later still is passed on as soon as it arrives.
+
+    Keyword arguments:
+    detects -- iterable of the dictionaries containing the detect info
+    window -- longest time a detect is held for reordering, in s
+
+    Returns: generator of the detects, in stamp order as far as the window allows
+    """
+
+    heap = []
+    n = 0
+    for detect_info in detects:
+        heapq.heappush(heap, (detect_info['stamp'], n, detect_info))
+        n += 1
+        while heap[0][0] < detect_info['stamp'] - window:
+            yield heapq.heappop(heap)[2]
+
+    while len(heap) > 0:
+        yield heapq.heappop(heap)[2]
+
+
+class Replay:
+    """
+    Class to run recorded detects through a TrackingEngine as fast as
+    they can be processed.
+
+    The node deletes stale contacts, merges contacts and closes scans on
+    timers. Here they are run on the clock of the detects instead: a task
+    due at time t runs after every detect stamped before t has been
+    processed and before any stamped at or after it. The detects in
+    between are processed as one batch.
+    """
+
+    def __init__(self, config, flight_recorder_size=20000):
+        """
+        Define the constructor.
+
+        config -- dictionary of the parameters of cfg/contact_tracker.cfg
+        flight_recorder_size -- number of association decisions kept by the flight recorder
+        """
+
+        self.engine = TrackingEngine(0, flight_recorder_size)
+        self.engine.configure(config)
+
+        # Period of each periodic task, and when each is next due.
+        self.periods = {'stale': 1.0/config['stale_check_rate']}
+        if config['merge_rate'] > 0:
+            self.periods['merge'] = 1.0/config['merge_rate']
+        if config['scan_window'] > 0:
+            self.periods['scan'] = SCAN_CHECK_PERIOD
+        self.due = None
+        self.next_due = None
+
+        self.counts = {'detects': 0, 'rejected': 0, 'late': 0, 'updates': 0,
+                       'new': 0, 'stale': 0, 'merged': 0}
+        self.last_stamp = None
+        self.engine_seconds = 0.0
+        self.output = None
+
+
+    def run_tasks(self, now):
+        """
+        Run every periodic task due before a given time, in the order they
+        fell due, each at the time it was due.
+
+        Keyword arguments:
+        now -- the time to run the tasks up to, in s
+        """
+
+        while self.next_due <= now:
+            task = min(sorted(self.due), key=self.due.get)
+            due = self.due[task]
+            if task == 'stale':
+                self.counts['stale'] += len(self.engine.delete_stale_contacts(due))
+            elif task == 'merge':
+                self.counts['merged'] += len(self.engine.merge_contacts(due))
+            else:
+                self.write_updates(self.engine.close_scan(due))
+            self.due[task] = due + self.periods[task]
+            self.next_due = min(self.due.values())
+
+
+    def write_updates(self, updates):
+        """
+        Write a row of the track file for each update made to a contact.
+
+        Keyword arguments:
+        updates -- list of the updates, as made by TrackingEngine.make_update()
+        """
+
+        self.counts['updates'] += len(updates)
+        for update in updates:
+            d = update['detect_info']
+            x = update['x']
+            self.counts['new'] += update['new']
+            if self.output is not None:
+                self.output.write(u'%r,%s,%d,%s,%r,%r,%r,%r,%r,%r\n' %
+                                  (d['stamp'], update['name'], update['new'], d['sensor_id'],
+                                   float(x[0]), float(x[1]), float(x[2]),
+                                   float(x[3]), float(x[4]), float(x[5])))
+
+
+    def process(self, batch):
+        """
+        Run a batch of detects through the engine and write the updates.
+
+        Keyword arguments:
+        batch -- list of the dictionaries containing the detect info
+        """
+
+        if len(batch) == 0:
+            return
+        t = clock()
+        updates = self.engine.process(batch)
+        self.engine_seconds += clock() - t
+        self.write_updates(updates)
+
+
+    def run(self, detects, output_path=None):
+        """
+        Track every detect of a stream and write the tracks.
+
+        Keyword arguments:
+        detects -- iterable of the dictionaries containing the detect info, in stamp order
+        output_path -- track file to write, with a header row naming
+                       TRACK_COLUMNS, or None to only count the updates
+
+        Returns: dictionary of the counts of detects, rejected and late
+        detects, updates, contacts started, deleted as stale and merged
+        """
+
+        if output_path is not None:
+            self.output = io.open(output_path, 'w', encoding='utf-8')
+            self.output.write(u','.join(TRACK_COLUMNS) + u'\n')
+
+        try:
+            batch = []
+            for detect_info in detects:
+                self.counts['detects'] += 1
+                if check_detect(detect_info) is not None:
+                    self.counts['rejected'] += 1
+                    continue
+
+                now = detect_info['stamp']
+                if self.due is None:
+                    self.due = dict((task, now + period) for task, period in self.periods.items())
+                    self.next_due = min(self.due.values())
+                if self.last_stamp is not None and now < self.last_stamp:
+                    self.counts['late'] += 1
+                else:
+                    self.last_stamp = now
+
+                if now >= self.next_due:
+                    self.process(batch)
+                    batch = []
+                    t = clock()
+                    self.run_tasks(now)
+                    self.engine_seconds += clock() - t
+                batch.append(detect_info)
+
+            self.process(batch)
+            if self.engine.scan_window > 0:
+                self.write_updates(self.engine.close_scan(float('inf')))
+
+        finally:
+            if self.output is not None:
+                self.output.close()
+                self.output = None
+            if self.engine.trace.enabled:
+                self.engine.trace.flush()
+
+        return self.counts
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Uniform grid over the predicted positions of the contacts, used to find the
+# contacts a detect could plausibly belong to without testing all of them.
+
+import math
+import numpy as np
+
+
+class SpatialGrid:
+    """
+    Class to index discs (a predicted position plus a gating radius) in a
+    uniform grid of square cells.
+
+    The grid is rebuilt from arrays every time the predictions change. Each
+    disc no larger than a cell is filed under the cell holding its center;
+    larger discs are kept aside and returned by every query.
+    """
+
+    def __init__(self, cell_size=100.0):
+        """
+        Define the constructor.
+
+        cell_size -- length of the side of a grid cell, in meters
+        """
+
+        self.cell_size = float(cell_size)
+        self.rebuild(np.zeros((0, 2)), np.zeros(0))
+
+
+    def _keys(self, ix, iy):
+        """
+        Combine integer cell coordinates into one sortable key per cell.
+        Keys of the same column are contiguous, so a column of cells can
+        be looked up with a single range search.
+        """
+
+        return (ix.astype(np.int64) << 32) + (iy.astype(np.int64) + (1 << 31))
+
+
+    def rebuild(self, positions, radii):
+        """
+        Rebuild the grid from the current predictions.
+
+        Keyword arguments:
+        positions -- array of shape (n, 2) holding the predicted x, y of each contact
+        radii -- array of shape (n,) holding the gating radius of each contact
+        """
+
+        self.positions = positions
+        self.radii = radii
+
+        small = radii <= self.cell_size
+        rows = np.nonzero(small)[0]
+        self.oversized = np.nonzero(~small)[0]
+
+        cells = np.floor(positions[rows] / self.cell_size)
+        keys = self._keys(cells[:, 0], cells[:, 1])
+        order = np.argsort(keys, kind='mergesort')
+        self.sorted_keys = keys[order]
+        self.sorted_rows = rows[order]
+
+
+    def query(self, x, y, radius):
+        """
+        Find the contacts whose gating disc overlaps a disc around a detect.
+
+        Keyword arguments:
+        x -- x position of the detect
+        y -- y position of the detect
+        radius -- gating radius of the detect
+
+        Returns: array of the row indices of the overlapping contacts
+        """
+
+        # A disc filed in a cell has its center no further than one cell away
+        # from the cell edge, so look that much beyond the detect's own disc.
+        reach = int(math.ceil(radius / self.cell_size)) + 1
+        cx = int(math.floor(x / self.cell_size))
+        cy = int(math.floor(y / self.cell_size))
+
+        columns = np.arange(cx - reach, cx + reach + 1)
+        lo = np.searchsorted(self.sorted_keys,
+                             self._keys(columns, np.full(columns.shape, cy - reach)),
+                             side='left')
+        hi = np.searchsorted(self.sorted_keys,
+                             self._keys(columns, np.full(columns.shape, cy + reach)),
+                             side='right')
+
+        found = [self.sorted_rows[a:b] for a, b in zip(lo, hi) if b > a]
+        found.append(self.oversized)
+        rows = np.concatenate(found)
+
+        dx = self.positions[rows, 0] - x
+        dy = self.positions[rows, 1] - y
+        limit = self.radii[rows] + radius
+
+        return rows[dx*dx + dy*dy <= limit*limit]
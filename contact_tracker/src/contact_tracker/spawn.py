@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# Class to create new contacts by copying a fully initialized prototype
+# contact instead of building its filters and IMM estimator from scratch.
+
+import copy
+
+import numpy as np
+
+from contact_tracker.contact import Contact
+from contact_tracker.contact_kf import ContactKalmanFilter
+
+
+class ContactTemplate:
+    """
+    Class to spawn contacts from a prototype. The prototype is constructed
+    once, from the first detect spawned, and never updated. Each new
+    contact is a copy of it whose filter bank is copied array by array,
+    then given the position, velocity and covariance of its own detect.
+    Arrays that are the same for every new contact are frozen in the
+    prototype and shared.
+    """
+
+    def __init__(self):
+        """
+        Define the constructor.
+        """
+
+        self.prototype = None
+
+        # The state and transition matrix of a filter as constructed, which
+        # a contact keeps when its detect has no position.
+        self.x = np.zeros(6)
+        self.F = np.eye(6)
+        self.F.flags.writeable = False
+
+
+    def construct(self, detect_info, timestamp):
+        """
+        Build a contact the slow way, with new filters and a new IMM estimator.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info to use
+        timestamp -- stamp of the detect, kept as the contact's name
+
+        Returns: the new Contact object
+        """
+
+        first_order_kf = ContactKalmanFilter(dim_x=6, dim_z=4, filter_type='first')
+        second_order_kf = ContactKalmanFilter(dim_x=6, dim_z=4, filter_type='second')
+        all_filters = [first_order_kf, second_order_kf]
+        return Contact(detect_info, all_filters, timestamp)
+
+
+    def spawn(self, detect_info, timestamp):
+        """
+        Create a new contact from a detect by copying the prototype.
+
+        Keyword arguments:
+        detect_info -- the dictionary containing the detect info to use
+        timestamp -- stamp of the detect, kept as the contact's name
+
+        Returns: the new Contact object
+        """
+
+        if self.prototype is None:
+            self.prototype = self.construct(detect_info, timestamp)
+            self.freeze(self.prototype)
+
+        c = copy.copy(self.prototype)
+        c.filter_bank = self.prototype.filter_bank.copy()
+        c.all_filters = c.filter_bank.filters
+
+        c.info = detect_info
+        c.last_measured = detect_info['stamp']
+        c.id = None
+        c.name = str(timestamp)
+
+        # Only the state and covariance depend on the detect. Q is that of
+        # the prototype, as new contacts all start from the same dt. The
+        # state and F are those of a constructed filter until init_state()
+        # sets them from the detect's position, as a contact built from a
+        # detect with velocity alone keeps them.
+        for kf in c.all_filters:
+            np.copyto(kf.x, self.x)
+            kf.F = self.F
+        c.init_state()
+        c.filter_bank.reset()
+        return c
+
+
+    def freeze(self, c):
+        """
+        Make every array of the contact's filters read-only except x and P,
+        which are rows of the filter bank's buffers. Copies of the filters
+        then share these arrays rather than copying them. The filters only
+        ever replace them, never write into them, and any write is an error.
+
+        Keyword arguments:
+        c -- the Contact object whose filters to freeze
+        """
+
+        for kf in c.filter_bank.filters:
+            for name, value in vars(kf).items():
+                if isinstance(value, np.ndarray) and name not in ('x', 'P'):
+                    value.flags.writeable = False
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# Timers around the stages of the detect callback, keeping a rolling window
+# of recent samples per stage so that percentiles of their latency can be
+# reported. Disabled timers cost one attribute check per call.
+
+import time
+
+import numpy as np
+
+# A monotonic clock where there is one; python2 only has the wall clock.
+clock = getattr(time, 'perf_counter', time.time)
+
+PERCENTILES = (50, 95, 99)
+
+
+class RollingWindow:
+    """
+    Class to hold the most recent samples of one quantity in a ring buffer.
+    """
+
+    def __init__(self, size):
+        """
+        Define the constructor.
+
+        size -- number of samples kept
+        """
+
+        self.values = [0.0]*size
+        self.size = size
+        self.n = 0
+
+
+    def add(self, value):
+        """
+        Add a sample, overwriting the oldest one once the window is full.
+
+        Keyword arguments:
+        value -- the sample
+        """
+
+        self.values[self.n % self.size] = value
+        self.n += 1
+
+
+    def percentiles(self, q=PERCENTILES):
+        """
+        Returns: list of the given percentiles of the samples in the window,
+        or None if there are none.
+        """
+
+        if self.n == 0:
+            return None
+        return list(np.percentile(self.values[:min(self.n, self.size)], q))
+
+
+class StageTimers:
+    """
+    Class to time the stages of processing a detect and keep other samples
+    taken per detect, each in a rolling window under its own name.
+
+    A stage is timed by calling start() before it and stop() after it.
+    stop() returns the time it stopped at, so consecutive stages can be
+    timed by passing it on. While disabled, start() returns None and
+    stop() and record() return straight away.
+    """
+
+    def __init__(self, window=1000, enabled=False):
+        """
+        Define the constructor.
+
+        window -- number of recent samples kept per name
+        enabled -- whether to time and record anything
+        """
+
+        self.window = window
+        self.enabled = enabled
+        self.windows = {}
+
+
+    def start(self):
+        """
+        Returns: the current time, or None if disabled.
+        """
+
+        if not self.enabled:
+            return None
+        return clock()
+
+
+    def stop(self, stage, started):
+        """
+        Record the time a stage took, in ms.
+
+        Keyword arguments:
+        stage -- name of the stage
+        started -- time returned by start(), or by stop() for the stage before
+
+        Returns: the current time, or None if disabled.
+        """
+
+        if started is None:
+            return None
+        now = clock()
+        self.record(stage, 1e3*(now - started))
+        return now
+
+
+    def record(self, name, value):
+        """
+        Record a sample.
+
+        Keyword arguments:
+        name -- name of the quantity sampled
+        value -- the sample
+        """
+
+        if not self.enabled:
+            return
+        w = self.windows.get(name)
+        if w is None:
+            w = self.windows[name] = RollingWindow(self.window)
+        w.add(value)
+
+
+    def summary(self):
+        """
+        Returns: dictionary of the number of samples taken and the 50th, 95th
+        and 99th percentiles of those in the window, for every name.
+        """
+
+        summary = {}
+        for name, w in list(self.windows.items()):
+            p = w.percentiles()
+            if p is not None:
+                summary[name] = {'count': w.n, 'p50': p[0], 'p95': p[1], 'p99': p[2]}
+        return summary
+
+
+    def clear(self):
+        """
+        Forget every sample.
+        """
+
+        self.windows = {}
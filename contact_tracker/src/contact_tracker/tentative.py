@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# Class to hold tentative tracks, started by detects that no contact took,
+# in compact arrays until they have been seen often enough to become
+# contacts with their own filter banks.
+
+import numpy as np
+
+
+class TentativeTracks:
+    """
+    Class to keep the position, velocity and timing of every tentative
+    track in stacked arrays, and predict them with an alpha-beta filter.
+
+    A track counts at most one hit per scan. It is confirmed once it has
+    M hits, and dropped once N scans have passed since its first detect
+    without it being confirmed. Row i of each array belongs to the i-th
+    live track; rows are moved around as tracks are removed.
+    """
+
+    def __init__(self, capacity=64, alpha=0.5, beta=0.2):
+        """
+        Define the constructor.
+
+        capacity -- number of tracks to allocate room for up front
+        alpha -- gain of the alpha-beta filter on the position residual
+        beta -- gain of the alpha-beta filter on the velocity residual
+        """
+
+        self.alpha = alpha
+        self.beta = beta
+        self.n = 0
+        self.counts = {'started': 0, 'confirmed': 0, 'dropped': 0}
+        self._allocate(capacity)
+
+
+    def _allocate(self, capacity):
+        """
+        (Re)allocate the stacked arrays, keeping the rows already in use.
+
+        Keyword arguments:
+        capacity -- number of tracks the arrays should hold
+        """
+
+        position = np.zeros((capacity, 2))
+        velocity = np.zeros((capacity, 2))
+        has_velocity = np.zeros(capacity, dtype=bool)
+        variance = np.zeros(capacity)
+        last_measured = np.zeros(capacity)
+        first_scan = np.zeros(capacity, dtype=np.int64)
+        last_scan = np.zeros(capacity, dtype=np.int64)
+        hits = np.zeros(capacity, dtype=np.int64)
+
+        if self.n > 0:
+            position[:self.n] = self.position[:self.n]
+            velocity[:self.n] = self.velocity[:self.n]
+            has_velocity[:self.n] = self.has_velocity[:self.n]
+            variance[:self.n] = self.variance[:self.n]
+            last_measured[:self.n] = self.last_measured[:self.n]
+            first_scan[:self.n] = self.first_scan[:self.n]
+            last_scan[:self.n] = self.last_scan[:self.n]
+            hits[:self.n] = self.hits[:self.n]
+
+        self.position = position
+        self.velocity = velocity
+        self.has_velocity = has_velocity
+        self.variance = variance
+        self.last_measured = last_measured
+        self.first_scan = first_scan
+        self.last_scan = last_scan
+        self.hits = hits
+        self.capacity = capacity
+
+
+    def __len__(self):
+        return self.n
+
+
+    def find(self, z, variance, stamp, gate_sigma, max_speed):
+        """
+        Find the tentative track nearest to a detect's position, among those
+        whose predicted position is within gate_sigma standard deviations
+        of it. The position of a track whose velocity is not yet known may
+        also have moved by up to max_speed since its last detect.
+
+        Keyword arguments:
+        z -- position of the detect, (x, y)
+        variance -- variance of the detect's position
+        stamp -- time of the detect, in seconds
+        gate_sigma -- number of standard deviations the gate spans
+        max_speed -- largest speed of a track of unknown velocity, in m/s
+
+        Returns: row of the nearest track, or None if none passes the gate
+        """
+
+        n = self.n
+        if n == 0:
+            return None
+
+        dt = stamp - self.last_measured[:n]
+        predicted = self.position[:n] + self.velocity[:n]*dt[:, np.newaxis]
+        distance = np.hypot(z[0] - predicted[:, 0], z[1] - predicted[:, 1])
+
+        radius = gate_sigma*np.sqrt(variance + self.variance[:n])
+        radius += np.where(self.has_velocity[:n], 0.0, max_speed*np.abs(dt))
+
+        distance[distance > radius] = np.inf
+        i = int(np.argmin(distance))
+        if distance[i] == np.inf:
+            return None
+        return i
+
+
+    def add(self, z, v, variance, stamp, scan):
+        """
+        Start a tentative track from a detect.
+
+        Keyword arguments:
+        z -- position of the detect, (x, y)
+        v -- velocity of the detect, (vx, vy), NaN if not measured
+        variance -- variance of the detect's position
+        stamp -- time of the detect, in seconds
+        scan -- number of the scan the detect belongs to
+
+        Returns: row of the new track
+        """
+
+        if self.n == self.capacity:
+            self._allocate(2*self.capacity)
+
+        i = self.n
+        self.n += 1
+        self.position[i] = z
+        self.has_velocity[i] = not np.isnan(v[0])
+        self.velocity[i] = v if self.has_velocity[i] else 0.0
+        self.variance[i] = variance
+        self.last_measured[i] = stamp
+        self.first_scan[i] = scan
+        self.last_scan[i] = scan
+        self.hits[i] = 1
+        self.counts['started'] += 1
+        return i
+
+
+    def hit(self, i, z, v, variance, stamp, scan):
+        """
+        Incorporate a detect into a tentative track. A measured velocity is
+        taken as it is. Otherwise the velocity comes from the alpha-beta
+        filter, or from the displacement since the last detect if the track
+        had none.
+
+        Keyword arguments:
+        i -- row of the track
+        z -- position of the detect, (x, y)
+        v -- velocity of the detect, (vx, vy), NaN if not measured
+        variance -- variance of the detect's position
+        stamp -- time of the detect, in seconds
+        scan -- number of the scan the detect belongs to
+
+        Returns: number of scans in which the track has been hit
+        """
+
+        dt = stamp - self.last_measured[i]
+        predicted = self.position[i] + self.velocity[i]*dt
+        residual = np.asarray(z) - predicted
+
+        if not np.isnan(v[0]):
+            self.position[i] = predicted + self.alpha*residual
+            self.velocity[i] = v
+            self.has_velocity[i] = True
+        elif dt <= 0:
+            self.position[i] = z
+        elif self.has_velocity[i]:
+            self.position[i] = predicted + self.alpha*residual
+            self.velocity[i] += self.beta*residual/dt
+        else:
+            self.velocity[i] = residual/dt
+            self.has_velocity[i] = True
+            self.position[i] = z
+
+        self.variance[i] = variance
+        self.last_measured[i] = max(stamp, self.last_measured[i])
+        if scan != self.last_scan[i]:
+            self.last_scan[i] = scan
+            self.hits[i] += 1
+
+        return int(self.hits[i])
+
+
+    def remove(self, i):
+        """
+        Remove a track, moving the last row into its place.
+
+        Keyword arguments:
+        i -- row of the track to remove
+        """
+
+        last = self.n - 1
+        if i != last:
+            self.position[i] = self.position[last]
+            self.velocity[i] = self.velocity[last]
+            self.has_velocity[i] = self.has_velocity[last]
+            self.variance[i] = self.variance[last]
+            self.last_measured[i] = self.last_measured[last]
+            self.first_scan[i] = self.first_scan[last]
+            self.last_scan[i] = self.last_scan[last]
+            self.hits[i] = self.hits[last]
+
+        self.n = last
+
+
+    def confirm(self, i):
+        """
+        Remove a track that has become a contact.
+
+        Keyword arguments:
+        i -- row of the track
+        """
+
+        self.remove(i)
+        self.counts['confirmed'] += 1
+
+
+    def expire(self, scan, window):
+        """
+        Drop every track that has spent window scans without being confirmed.
+
+        Keyword arguments:
+        scan -- number of the current scan
+        window -- number of scans a track has to be confirmed in
+        """
+
+        n = self.n
+        if n == 0:
+            return
+
+        keep = scan - self.first_scan[:n] < window
+        kept = int(np.count_nonzero(keep))
+        if kept == n:
+            return
+
+        for a in [self.position, self.velocity, self.has_velocity, self.variance,
+                  self.last_measured, self.first_scan, self.last_scan, self.hits]:
+            a[:kept] = a[:n][keep]
+
+        self.n = kept
+        self.counts['dropped'] += n - kept
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# Class to keep a fixed-size history of a contact's state for plotting,
+# overwriting the oldest entry once it is full.
+
+import numpy as np
+
+
+# Everything the plots read, one row per detect.
+HISTORY_DTYPE = np.dtype([
+    ('time', np.float64),             # time of the detect, in s
+    ('z', np.float64, (4,)),          # contact.Z, NaN padded when position only
+    ('x', np.float64, (6,)),          # filter_bank.x
+    ('P_diag', np.float64, (6,)),     # diagonal of filter_bank.P
+    ('x_prior', np.float64, (6,)),    # second order filter's x_prior
+    ('P_prior_diag', np.float64, (6,)),  # diagonal of second order filter's P_prior
+    ('R_diag', np.float64, (2,)),     # position terms of the diagonal of R
+    ('track_xy', np.float64, (2,)),   # estimated or predicted position
+    ('meas_xy', np.float64, (2,)),    # measured position, NaN when not associated
+    ('track_P_xy', np.float64, (2, 2)),  # covariance of track_xy
+    ])
+
+# Rows a history starts with. It doubles as detects arrive, up to its depth,
+# so short-lived contacts do not hold a full buffer.
+INITIAL_ROWS = 16
+
+
+class TrackHistory:
+    """
+    Class to record the state of one contact at every detect in a ring
+    buffer of at most depth rows, grown by doubling until it reaches them.
+    """
+
+    def __init__(self, depth=500, name=''):
+        """
+        Define the constructor.
+
+        depth -- number of detects to remember
+        name -- name of the contact, used to label the plots
+        """
+
+        self.name = name
+        self.depth = max(int(depth), 1)
+        self.count = 0
+        self.data = np.zeros(min(self.depth, INITIAL_ROWS), dtype=HISTORY_DTYPE)
+
+
+    def __len__(self):
+        return min(self.count, self.depth)
+
+
+    def append(self, time, contact, associated):
+        """
+        Record the state of a contact after a detect was processed.
+
+        Keyword arguments:
+        time -- time of the detect, in s
+        contact -- the Contact object to record
+        associated -- True if the detect was incorporated into this contact
+        """
+
+        if self.count == len(self.data) < self.depth:
+            # Not yet wrapped around, so the rows are in order.
+            grown = np.zeros(min(2*len(self.data), self.depth), dtype=HISTORY_DTYPE)
+            grown[:self.count] = self.data
+            self.data = grown
+
+        i = self.count % self.depth
+        self.count += 1
+        d = self.data
+
+        first = contact.all_filters[0]
+        second = contact.all_filters[1]
+        x = contact.filter_bank.x
+        P = contact.filter_bank.P
+
+        d['time'][i] = time
+        d['z'][i] = np.nan
+        if contact.Z is not None:
+            d['z'][i, :len(contact.Z)] = contact.Z
+        d['x'][i] = x
+        d['P_diag'][i] = P.diagonal()
+        d['x_prior'][i] = np.ravel(second.x_prior)
+        d['P_prior_diag'][i] = second.P_prior.diagonal()
+        d['R_diag'][i, 0] = first.R[0, 0]
+        d['R_diag'][i, 1] = first.R[1, 1]
+
+        if associated:
+            d['track_xy'][i] = x[0:2]
+            d['meas_xy'][i, 0] = contact.info['x_pos']
+            d['meas_xy'][i, 1] = contact.info['y_pos']
+            d['track_P_xy'][i] = P[0:2, 0:2]
+
+        else:
+            # For contacts not associated with the measurement, capture their
+            # predicted location for the measurement time. Capture only the
+            # values for the 1st order filter for simplicity.
+            d['track_xy'][i] = np.ravel(first.x_prior)[0:2]
+            d['meas_xy'][i] = np.nan
+            d['track_P_xy'][i] = first.P_prior[0:2, 0:2]
+
+
+    def __getitem__(self, name):
+        """
+        Returns: The recorded values of one field, oldest first.
+        """
+
+        column = self.data[name]
+        if self.count <= self.depth:
+            return column[:self.count]
+
+        start = self.count % self.depth
+        return np.concatenate((column[start:], column[:start]))